@@ -1,4 +1,5 @@
 from .cross_server_tools import VfbConnect
+from .async_connect import AsyncVfbConnect
 
 # Try to get version from setuptools_scm generated file
 try:
@@ -15,4 +16,4 @@ except ImportError:
 # Create an instance of VfbConnect and make it available directly
 vfb = VfbConnect(vfb_launch=True)
 
-__all__ = ['vfb', 'VfbConnect', '__version__']
\ No newline at end of file
+__all__ = ['vfb', 'VfbConnect', 'AsyncVfbConnect', '__version__']
\ No newline at end of file
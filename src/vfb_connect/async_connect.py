@@ -0,0 +1,303 @@
+import asyncio
+import json
+import time
+from functools import partial
+
+import pandas as pd
+
+from .neo.neo4j_tools import dict_cursor, cypher_statement
+from .neo.query_wrapper import vfb_solr, _populate_summary
+from .owl.owlery_query_tools import gen_short_form, QUERY_RETURN_TYPES
+from .retry_policy import RetryPolicy
+from .schema.vfb_term import VFBTerm, VFBTerms
+
+
+class AsyncVfbConnect:
+
+    """Asynchronous (asyncio) access to the VFB servers for serving many concurrent lookups from one event loop.
+
+    Provides awaitable versions of cypher_query, get_TermInfo, search, owl_subclasses, owl_superclasses,
+    owl_instances and lookup_id. Requests go through a single pooled aiohttp session, so any number of calls can
+    be gathered without a thread per request. The lookup table, OWL query cache and closure index are shared with
+    the wrapped (synchronous) VfbConnect. Requires `aiohttp`.
+
+    Example:
+        async with AsyncVfbConnect() as avc:
+            infos = await asyncio.gather(*[avc.get_TermInfo(t) for t in terms])
+
+        :param vc: Optional. The VfbConnect whose servers, lookup and caches are used. Default: the `vfb` session.
+        :param max_connections: Optional. Maximum number of simultaneous HTTP connections. Default 100.
+        :param timeout: Optional. Timeout in seconds for each HTTP request. Default 120.
+        :param retry_policy: Optional. RetryPolicy template for failed requests; a copy is used for each server."""
+
+    def __init__(self, vc=None, max_connections=100, timeout=120, retry_policy=None):
+        try:
+            import aiohttp
+        except ImportError:
+            raise ImportError("AsyncVfbConnect requires aiohttp. Install it with: pip install aiohttp")
+        self._aiohttp = aiohttp
+        if vc is None:
+            from vfb_connect import vfb as vc
+        self.vc = vc
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._session = None
+        template = retry_policy if retry_policy else RetryPolicy()
+        settings = {k: getattr(template, k) for k in ('max_attempts', 'base_delay', 'max_delay', 'deadline',
+                                                      'retry_on_status', 'failure_threshold', 'reset_timeout')}
+        retry_on = (aiohttp.ClientError, asyncio.TimeoutError)
+        self.neo_retry_policy = RetryPolicy(name='Neo4j', retry_on_exceptions=retry_on, **settings)
+        self.solr_retry_policy = RetryPolicy(name='SOLR', retry_on_exceptions=retry_on, **settings)
+        self.owlery_retry_policy = RetryPolicy(name='OWLery', retry_on_exceptions=retry_on, **settings)
+
+    @property
+    def lookup(self):
+        """The label/symbol to ID lookup shared with the wrapped VfbConnect."""
+        return self.vc.lookup
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        """Close the HTTP session. A new one is opened if the object is used again."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        # Created lazily so the session belongs to the running event loop
+        if self._session is None or self._session.closed:
+            aiohttp = self._aiohttp
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_connections),
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def _request(self, retry_policy, method, url, **kwargs):
+        """Make an HTTP request applying retry_policy.
+
+        :return: (status, reason, body text)
+        :raises: aiohttp.ClientError or asyncio.TimeoutError if the request still fails after retrying.
+        """
+        async def attempt():
+            async with self._get_session().request(method, url, **kwargs) as response:
+                if response.status in retry_policy.retry_on_status:
+                    response.raise_for_status()
+                return response.status, response.reason, await response.text()
+        return await retry_policy.call_async(attempt)
+
+    @staticmethod
+    async def _run_sync(func, *args, **kwargs):
+        """Run a blocking VfbConnect call in the default executor."""
+        return await asyncio.get_running_loop().run_in_executor(None, partial(func, *args, **kwargs))
+
+    async def lookup_id(self, key, return_curie=False, allow_substitutions=True, verbose=False):
+        """Lookup the ID for a given key (label or symbol). See VfbConnect.lookup_id.
+
+        Exact matches are answered straight from the shared lookup; anything else (substitutions, xrefs) runs
+        VfbConnect.lookup_id in an executor.
+        """
+        if isinstance(key, str):
+            out = self.lookup.get(key, key if key in self.vc.reverse_lookup else None)
+            if out:
+                return out if not return_curie else out.replace('_', ':')
+        return await self._run_sync(self.vc.lookup_id, key, return_curie=return_curie,
+                                    allow_substitutions=allow_substitutions, verbose=verbose)
+
+    async def commit_list(self, statements, return_graphs=False):
+        """Commit a list of cypher statements to the VFB neo4j (PDB). See Neo4jConnect.commit_list.
+
+        :return: List of results or False if any errors are encountered.
+        """
+        nc = self.vc.nc
+        payload = {'statements': [cypher_statement(s, return_graphs=return_graphs) for s in statements]}
+        profiler = nc.profiler
+        if profiler:
+            payload['statements'] = profiler.instrument(payload['statements'])
+            start = time.perf_counter()
+        try:
+            status, reason, body = await self._request(
+                self.neo_retry_policy, 'POST', "%s%s" % (nc.base_uri, nc.commit),
+                auth=self._aiohttp.BasicAuth(nc.usr, nc.pwd), data=json.dumps(payload), headers=nc.headers)
+        except (self._aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print("\033[31mConnection Error:\033[0m %s" % e)
+            if profiler:
+                profiler.record(payload['statements'], time.perf_counter() - start, error=str(e))
+            return False
+        j = json.loads(body) if status == 200 else None
+        if status != 200:
+            print("\033[31mConnection Error:\033[0m %s (%s)" % (status, reason))
+        elif j['errors']:
+            for e in j['errors']:
+                print("\033[31mQuery Error:\033[0m " + str(e))
+        ok = status == 200 and not j['errors']
+        if profiler:
+            error = None
+            if not ok:
+                error = "Query error" if status == 200 else "Status %s" % status
+            profiler.record(payload['statements'], time.perf_counter() - start, len(body.encode('utf-8')),
+                            j['results'] if ok else None, error=error)
+        return j['results'] if ok else False
+
+    async def cypher_query(self, query, return_dataframe=True, verbose=False, parameters=None):
+        """Run a Cypher query. See VfbConnect.cypher_query.
+
+        :return: A DataFrame or list of results.
+        :rtype: pandas.DataFrame or list of dicts
+        """
+        print(f"Running query: {query}") if verbose else None
+        r = await self.commit_list([cypher_statement(query, parameters)])
+        dc = dict_cursor(r) if r else []
+        if return_dataframe:
+            return pd.DataFrame.from_records(dc)
+        return dc
+
+    async def _get_Cached_TermInfo(self, short_forms, verbose=False):
+        params = {'q': '*', 'fl': 'term_info', 'df': 'id', 'defType': 'edismax', 'q.op': 'OR', 'wt': 'json',
+                  'rows': str(len(short_forms) + 10), 'fq': '{!terms f=id}' + ','.join(short_forms)}
+        try:
+            status, reason, body = await self._request(self.solr_retry_policy, 'GET', vfb_solr.url.rstrip('/') + '/select',
+                                                       params=params)
+        except (self._aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"\033[33mWarning:\033[0m Cache query failed for {short_forms}. Error: {e}")
+            return []
+        if status != 200:
+            print(f"\033[33mWarning:\033[0m Cache query failed for {short_forms}. Error: {status} ({reason})")
+            return []
+        docs = json.loads(body)['response']['docs']
+        results = [json.loads(doc['term_info'][0]) for doc in docs if doc.get('term_info')]
+        print(f"Got {len(results)} cached results out of {len(short_forms)}.") if verbose else None
+        return results
+
+    async def get_TermInfo(self, short_forms, summary=True, cache=True, return_dataframe=False, query_by_label=True,
+                           limit=None, verbose=False):
+        """Get term info (VFB_json) or summaries for terms. See VfbConnect.get_TermInfo.
+
+        Terms are read from the SOLR cache; any missing from it are pulled from the PDB with the (blocking)
+        QueryWrapper in an executor.
+
+        :return: A list of term metadata as VFB_json or summary_report_json, or a pandas DataFrame if `return_dataframe` is `True`.
+        :rtype: list of dicts or pandas.DataFrame
+        """
+        if isinstance(short_forms, str):
+            short_forms = [short_forms]
+        if isinstance(short_forms, VFBTerm):
+            short_forms = [short_forms.id]
+        if isinstance(short_forms, VFBTerms):
+            short_forms = short_forms.get_ids()
+        if query_by_label:
+            short_forms = await asyncio.gather(*[self.lookup_id(sf) for sf in short_forms])
+        short_forms = list(dict.fromkeys(sf for sf in short_forms if sf))
+        result = await self._get_Cached_TermInfo(short_forms, verbose=verbose) if cache and short_forms else []
+        found = set(r['term']['core']['short_form'] for r in result)
+        missing = [sf for sf in short_forms if sf not in found]
+        if missing:
+            print(f"Pulling {len(missing)} terms from VFB PDB (Neo4j)") if verbose else None
+            pdb = await self._run_sync(self.vc.neo_query_wrapper.get_TermInfo, missing, summary=False, cache=False)
+            result = result + (pdb if pdb else [])
+        result = result[:limit] if limit else result
+        if summary:
+            result = [_populate_summary(r) for r in result]
+        if return_dataframe:
+            return pd.DataFrame(result)
+        return result
+
+    async def search(self, query, return_dataframe=True, verbose=False, filter_by_has_tag=None, filter_by_not_tag=['Deprecated'], fl=None):
+        """Search for terms using the same SOLR query configuration as VfbConnect.search.
+
+        :return: A DataFrame or list of results.
+        :rtype: pandas.DataFrame or list of dicts
+        """
+        search_params = self.vc._search_params(query, filter_by_has_tag=filter_by_has_tag, filter_by_not_tag=filter_by_not_tag, fl=fl)
+        print(f"Solr Search JSON: {json.dumps({'params': search_params})}") if verbose else None
+        params = [(k, v) for k, values in search_params.items()
+                  for v in (values if isinstance(values, list) else [values])]
+        try:
+            status, reason, body = await self._request(self.solr_retry_policy, 'GET',
+                                                       self.vc.solr_url.rstrip('/') + '/select', params=params)
+        except (self._aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print("\033[31mConnection Error:\033[0m %s" % e)
+            docs = []
+        else:
+            if status == 200:
+                docs = json.loads(body)['response']['docs']
+            else:
+                print("\033[31mConnection Error:\033[0m %s (%s)" % (status, reason))
+                docs = []
+        if return_dataframe:
+            return pd.DataFrame(docs)
+        return docs
+
+    async def owl_query(self, query_type, query, query_by_label=True, direct=False, verbose=False):
+        """Run an OWLery query. See OWLeryConnect.query.
+
+        Results are shared with the OWLeryConnect cache and closure index of the wrapped VfbConnect.
+
+        :param query_type: Options: subclasses, superclasses, equivalent, instances, types
+        :return: list of short_forms or False if the query failed.
+        """
+        oc = self.vc.oc
+        return_type = QUERY_RETURN_TYPES[query_type]
+        if query_by_label:
+            query = await self._run_sync(oc.labels_2_ids, query)
+        print("Running query: " + query) if verbose else None
+        result, key = oc._query_locally(query_type, return_type, query, direct, verbose)
+        if result is None:
+            params = {'object': query, 'prefixes': json.dumps(oc.curies), 'direct': str(direct)}
+            try:
+                status, reason, body = await self._request(self.owlery_retry_policy, 'GET',
+                                                           oc.owlery_endpoint + query_type, params=params)
+            except (self._aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print("\033[31mConnection Error:\033[0m " + str(e))
+                return False
+            if status != 200:
+                print("\033[31mConnection Error:\033[0m " + body)
+                return False
+            result = json.loads(body)[return_type]
+            oc._set_cached(key, result)
+        return list(map(gen_short_form, result))
+
+    async def _owl_terms(self, query_type, query, query_by_label, return_id_only, return_dataframe, limit, verbose):
+        ids = await self.owl_query(query_type, query, query_by_label=query_by_label, verbose=verbose)
+        if not ids:
+            ids = []
+        elif limit:
+            print(f"Limiting to {limit} instances out of {len(ids)}")
+            ids = ids[:limit]
+        if return_id_only:
+            return ids
+        if return_dataframe:
+            return await self.get_TermInfo(ids, summary=True, return_dataframe=True, query_by_label=False)
+        return VFBTerms(await self.get_TermInfo(ids, summary=False, query_by_label=False), verbose=verbose)
+
+    async def owl_subclasses(self, query, query_by_label=True, return_id_only=False, return_dataframe=False, limit=False, verbose=False):
+        """Get subclasses of a class expression. See VfbConnect.owl_subclasses.
+
+        :rtype: dependant on the options a pandas.DataFrame, list of ids or VFBTerms. Default is VFBTerms
+        """
+        return await self._owl_terms('subclasses', query, query_by_label, return_id_only, return_dataframe, limit, verbose)
+
+    async def owl_superclasses(self, query, query_by_label=True, return_id_only=False, return_dataframe=False, limit=False, verbose=False):
+        """Get superclasses of a class expression. See VfbConnect.owl_superclasses.
+
+        :rtype: dependant on the options a pandas.DataFrame, list of ids or VFBTerms. Default is VFBTerms
+        """
+        return await self._owl_terms('superclasses', query, query_by_label, return_id_only, return_dataframe, limit, verbose)
+
+    async def owl_instances(self, query, query_by_label=True, return_id_only=False, return_dataframe=False, limit=False, verbose=False):
+        """Get instances of a class expression. See VfbConnect.owl_instances.
+
+        :rtype: dependant on the options a pandas.DataFrame, list of ids or VFBTerms. Default is VFBTerms
+        """
+        return await self._owl_terms('instances', query, query_by_label, return_id_only, return_dataframe, limit, verbose)
+
+    def retry_metrics(self, reset=False):
+        """Retry and circuit breaker counts per server. See VfbConnect.retry_metrics."""
+        policies = {'neo4j': self.neo_retry_policy, 'solr': self.solr_retry_policy, 'owlery': self.owlery_retry_policy}
+        metrics = {name: policy.metrics for name, policy in policies.items()}
+        if reset:
+            for policy in policies.values():
+                policy.reset_metrics()
+        return metrics
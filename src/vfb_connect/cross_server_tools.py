@@ -1,21 +1,30 @@
+import hashlib
 import json
 import os
+import threading
+import time
 import warnings
-from string import Template
+from collections import OrderedDict
 from typing import List
 from xml.sax import saxutils
 
 import pkg_resources
-from .owl.owlery_query_tools import OWLeryConnect
-from .neo.neo4j_tools import Neo4jConnect, re, dict_cursor
+import requests
+from requests.adapters import HTTPAdapter
+from .owl.owlery_query_tools import OWLeryConnect, gen_short_form
+from .owl.closure_index import ClosureIndex
+from .search_index import SearchIndex, SEARCH_FIELDS
+from .neo.neo4j_tools import Neo4jConnect, re, dict_cursor, cypher_statement, chunks
 from .neo.query_wrapper import QueryWrapper, batch_query
+from .neo.query_profiler import QueryProfiler
+from .neo.connectivity_matrix import ConnectivityMatrix, aggregate_by_type, type_matrix
+from .neo.similarity_matrix import SimilarityMatrix
+from .neo.expression_matrix import ExpressionMatrix
+from .neo.xref_index import XrefIndex
 from .default_servers import get_default_servers
 from .schema.vfb_term import VFBTerm, VFBTerms, Partner
 import pandas as pd
 import numpy as np
-from colormath.color_objects import LabColor, sRGBColor
-from colormath.color_conversions import convert_color
-from scipy.spatial import KDTree
 
 VFB_DBS_2_SYMBOLS = {"JRC_OpticLobe":"neuprint_JRC_OpticLobe_v1_0_1", "FAFB":"catmaid_fafb", "L1EM":"catmaid_l1em", "MANC":"neuprint_JRC_Manc_1_2_1", 
                      "FlyEM-HB":"neuprint_JRC_Hemibrain_1point2point1","ol":"neuprint_JRC_OpticLobe_v1_0_1", "fafb":"catmaid_fafb", "l1em":"catmaid_l1em", 
@@ -45,6 +54,37 @@ def dequote(string):
     else:
         return string
 
+# CIE D50 reference white used by Lab and the combined Bradford D50->D65 adaptation and XYZ->linear sRGB matrix
+LAB_D50_WHITE = np.array([0.96422, 1.0, 0.82521])
+LAB_D50_TO_SRGB = np.array([[3.1341035681, -1.6169944432, -0.4906536851],
+                            [-0.978760122, 1.9161202575, 0.0334536286],
+                            [0.071934672, -0.2289578402, 1.405036424]])
+
+def _lab_to_linear_rgb(lab):
+    """Convert an (n, 3) array of CIE Lab (D50) colours to unclamped linear sRGB (D65); in gamut colours are in [0, 1]."""
+    lab = np.atleast_2d(np.asarray(lab, dtype=float))
+    fy = (lab[:, 0] + 16.0) / 116.0
+    f = np.stack([fy + lab[:, 1] / 500.0, fy, fy - lab[:, 2] / 200.0], axis=1)
+    epsilon, kappa = 216.0 / 24389.0, 24389.0 / 27.0
+    xyz = np.where(f ** 3 > epsilon, f ** 3, (116.0 * f - 16.0) / kappa)
+    xyz[:, 1] = np.where(lab[:, 0] > kappa * epsilon, ((lab[:, 0] + 16.0) / 116.0) ** 3, lab[:, 0] / kappa)
+    xyz = xyz * LAB_D50_WHITE
+    return xyz @ LAB_D50_TO_SRGB.T
+
+def lab_to_rgb(lab):
+    """Convert an array of CIE Lab (D50) colours to clamped 8 bit sRGB (D65) tuples.
+
+    Vectorised equivalent of converting each colour with colormath's convert_color(LabColor(...), sRGBColor).
+
+    :param lab: An (n, 3) array-like of L, a, b values.
+    :return: A list of (r, g, b) integer tuples.
+    :rtype: list of tuple
+    """
+    linear = _lab_to_linear_rgb(lab)
+    rgb = np.where(linear <= 0.0031308, 12.92 * linear, 1.055 * np.power(np.abs(linear), 1 / 2.4) - 0.055)
+    rgb = np.rint(np.clip(rgb, 0.0, 1.0) * 255).astype(int)
+    return [tuple(int(c) for c in row) for row in rgb]
+
 NT_NTR_pairs = {'Cholinergic': 'Acetylcholine_receptor', 'Dopaminergic': 'Dopamine_receptor',  
     'GABAergic': 'GABA_receptor', 'Glutamatergic': 'Glutamate_receptor', 'GABAergic': 'GABA_receptor',
     'Histaminergic': 'Histamine_receptor', 'Octopaminergic': 'Octopamine_receptor',
@@ -96,15 +136,27 @@ class VfbConnect:
             }
         }
         self.solr_url = solr_endpoint
+        self._solr = None
+        self._search_index = None
+        self._connectivity_matrix = None
+        self._xref_indexes = {}
+        self._search_cache = OrderedDict()
+        self._search_cache_lock = threading.Lock()
+        self.search_cache_ttl = 60
+        self.search_cache_size = 256
         self.nc = Neo4jConnect(**connections['neo'])
         self.neo_query_wrapper = QueryWrapper(**connections['neo'])
         self.cache_file = self.get_cache_file_path()
         self._dbs_cache = {}
+        self._palette_cache = {}
         self.lookup = self.nc.get_lookup(cache=self.cache_file)
         self.normalized_lookup = self.preprocess_lookup()
         self.reverse_lookup = {v: k for k, v in self.lookup.items()}
         self.oc = OWLeryConnect(endpoint=owlery_endpoint,
-                                lookup=self.lookup)
+                                lookup=self.lookup,
+                                cache_file=os.path.join(self.get_cache_dir(), 'owlery_cache.pkl'),
+                                cache_release=self._owlery_release,
+                                resolver=self.lookup_id)
         self.vfb_base = "https://v2.virtualflybrain.org/org.geppetto.frontend/geppetto?id="
 
         multi_query_json = pkg_resources.resource_filename(
@@ -129,13 +181,32 @@ class VfbConnect:
 
     def setNeoEndpoint(self, endpoint, usr, pwd):
         """Set the Neo4j endpoint and credentials."""
-        self.nc = Neo4jConnect(endpoint=endpoint, usr=usr, pwd=pwd)
-        self.neo_query_wrapper = QueryWrapper(endpoint=endpoint, usr=usr, pwd=pwd)
+        profiler = self.nc.profiler
+        self.nc = Neo4jConnect(endpoint=endpoint, usr=usr, pwd=pwd, profiler=profiler)
+        self.neo_query_wrapper = QueryWrapper(endpoint=endpoint, usr=usr, pwd=pwd, profiler=profiler)
         self.reload_lookup_cache()
 
     def setOwleryEndpoint(self, endpoint):
         """Set the OWLery endpoint."""
-        self.oc = OWLeryConnect(endpoint=endpoint, lookup=self.lookup)
+        self.oc.flush_cache()
+        self.oc = OWLeryConnect(endpoint=endpoint, lookup=self.lookup,
+                                cache_file=os.path.join(self.get_cache_dir(), 'owlery_cache.pkl'),
+                                cache_release=self._owlery_release, resolver=self.lookup_id)
+
+    def _owlery_release(self):
+        """Fingerprint of the current release of the PDB (numbers of classes, individuals, SUBCLASSOF and INSTANCEOF
+        edges), used to discard OWLery results cached on disk from an earlier release, or None.
+
+        Passed to OWLeryConnect uncalled, so the query only runs when the OWLery cache file is first read or written.
+        """
+        r = self.nc.commit_list([cypher_statement(
+            "MATCH (c:Class) WITH count(c) AS classes "
+            "MATCH (i:Individual) WITH classes, count(i) AS individuals "
+            "MATCH ()-[s:SUBCLASSOF]->() WITH classes, individuals, count(s) AS subclassof "
+            "MATCH ()-[t:INSTANCEOF]->() RETURN classes, individuals, subclassof, count(t)")])
+        if not r or not r[0]['data']:
+            return None
+        return ":".join(str(v) for v in r[0]['data'][0]['row'])
 
     def get_cache_file_path(self):
         """Determine a safe place to save the pickle file in the same directory as the module."""
@@ -144,15 +215,161 @@ class VfbConnect:
         # Define the cache file name
         cache_file = os.path.join(module_dir, 'lookup_cache.pkl')
         return cache_file
-    
+
+    def get_cache_dir(self, subdir=None):
+        """
+        Determine a safe place to save cached data alongside the lookup cache.
+
+        :param subdir: Optional sub directory within the cache directory.
+        :return: The path to the (created) cache directory.
+        :rtype: str
+        """
+        cache_dir = os.path.join(os.path.dirname(self.cache_file), 'cache')
+        if subdir:
+            cache_dir = os.path.join(cache_dir, subdir)
+        os.makedirs(cache_dir, exist_ok=True)
+        return cache_dir
+
+    def retry_metrics(self, reset=False):
+        """
+        Report how often requests to each server have been retried or rejected by the circuit breaker.
+
+        :param reset: Optional. Reset the counts after reporting them. Default `False`
+        :return: Dict of server name to a dict of counts (calls, attempts, retries, failures, circuit_opened,
+            circuit_rejected, sleep_time).
+        """
+        policies = {'neo4j': self.nc.retry_policy,
+                    'query_wrapper': self.neo_query_wrapper.retry_policy,
+                    'solr': self.neo_query_wrapper.solr_retry_policy,
+                    'owlery': self.oc.retry_policy}
+        metrics = {name: policy.metrics for name, policy in policies.items()}
+        if reset:
+            for policy in policies.values():
+                policy.reset_metrics()
+        return metrics
+
+    def profile_queries(self, enable=True, profile_db_hits=False, hooks=None, max_records=10000):
+        """
+        Turn recording of Cypher query timings on or off (see query_profile).
+
+        Each statement sent to the neo4j (PDB) server is recorded with the VfbConnect method that made it, its wall
+        time, bytes and rows returned and optionally its database hits.
+
+        :param enable: Optional. Start (`True`) or stop (`False`) recording. Default `True`
+        :param profile_db_hits: Optional. Also run queries with PROFILE to record database hits. This adds
+            server side overhead so is best kept for investigating specific queries. Default `False`
+        :param hooks: Optional. List of functions called with each record (a dict), e.g. to send timings to an
+            external metrics system.
+        :param max_records: Optional. Maximum number of records kept. Default 10000.
+        :return: The QueryProfiler in use, or None if recording was turned off.
+        """
+        profiler = QueryProfiler(profile_db_hits=profile_db_hits, max_records=max_records, hooks=hooks) if enable else None
+        self.nc.profiler = profiler
+        self.neo_query_wrapper.profiler = profiler
+        return profiler
+
+    def query_profile(self, by='statement', top=None, detail=False, reset=False):
+        """
+        Report the Cypher queries recorded since profile_queries was called, slowest in total first.
+
+        :param by: Optional. Summarise by 'statement' (calling method and query text) or by 'caller' (method only).
+            Default 'statement'
+        :param top: Optional. Only report this many rows.
+        :param detail: Optional. Return every recorded statement instead of a summary. Default `False`
+        :param reset: Optional. Discard the records after reporting them. Default `False`
+        :return: DataFrame of calls, total/mean/max time (seconds), rows, bytes, db hits and failures.
+        :rtype: pandas.DataFrame
+        """
+        profiler = self.nc.profiler
+        if profiler is None:
+            print("\033[33mWarning:\033[0m Query profiling is off. Turn it on with profile_queries().")
+            return pd.DataFrame()
+        report = profiler.to_dataframe() if detail else profiler.report(by=by, top=top)
+        if reset:
+            profiler.reset()
+        return report
+
+    def load_closure_index(self, include_instances=True, force_reload=False, verbose=False):
+        """Build (or load from disk) a local index of the class hierarchy and use it for named class OWL queries.
+
+        Once loaded, get_subclasses, get_superclasses and get_instances (and the owl_ equivalents) for a single named
+        class are answered locally from the SUBCLASSOF/INSTANCEOF closure in the PDB. Class expressions still go to
+        the OWLery reasoner. The index is cached on disk for three months.
+
+        :param include_instances: Optional. Also index INSTANCEOF so instance queries can be answered. Default `True`
+        :param force_reload: Optional. Rebuild the index from the PDB even if a cached copy exists. Default `False`
+        :param verbose: Optional. Print progress if `True`.
+        :return: The ClosureIndex now in use.
+        """
+        three_months_in_seconds = 3 * 30 * 24 * 60 * 60
+        cache = os.path.join(self.get_cache_dir(), 'closure_index%s.npz' % ('' if include_instances else '_classes'))
+        index = None
+        if not force_reload:
+            try:
+                index = ClosureIndex.load(cache, max_age=three_months_in_seconds)
+                print("Loaded closure index from %s" % cache) if verbose and index else None
+            except Exception as e:
+                print(f"Failed to load closure index from disk: {e}")
+        if index is None:
+            index = ClosureIndex.from_neo(self.nc, include_instances=include_instances, verbose=verbose)
+            try:
+                index.save(cache)
+            except Exception as e:
+                print(f"Failed to save closure index to disk: {e}")
+        self.oc.closure_index = index
+        return index
+
+    def load_search_index(self, source='pdb', force_reload=False, verbose=False):
+        """Build (or load from disk) the local index used by search(..., backend='local').
+
+        With source 'pdb' the labels, synonyms and facets of all searchable terms are loaded from the PDB in bulk,
+        so local results have the same fields as SOLR results. With source 'lookup' the index is built from the
+        name lookup alone, without querying any server, but results have no facets. The index is cached on disk
+        for three months.
+
+        :param source: Optional. 'pdb' (default) or 'lookup'.
+        :param force_reload: Optional. Rebuild the index even if a cached copy exists. Default `False`
+        :param verbose: Optional. Print progress if `True`.
+        :return: The SearchIndex now in use.
+        """
+        if source not in ('pdb', 'lookup'):
+            raise ValueError("Unknown search index source '%s'. Options: pdb, lookup" % source)
+        three_months_in_seconds = 3 * 30 * 24 * 60 * 60
+        cache = os.path.join(self.get_cache_dir(), 'search_index_%s.pkl' % source)
+        index = None
+        if not force_reload:
+            try:
+                index = SearchIndex.load(cache, max_age=three_months_in_seconds)
+                print("Loaded search index from %s" % cache) if verbose and index else None
+            except Exception as e:
+                print(f"Failed to load search index from disk: {e}")
+        if index is None:
+            if source == 'pdb':
+                index = SearchIndex.from_neo(self.nc, verbose=verbose)
+                if index is None:
+                    print("\033[33mWarning:\033[0m Failed to load terms from the PDB; building the search index from the lookup instead.")
+                    return self.load_search_index(source='lookup', force_reload=force_reload, verbose=verbose)
+            else:
+                index = SearchIndex.from_lookup(self.lookup)
+            try:
+                index.save(cache)
+            except Exception as e:
+                print(f"Failed to save search index to disk: {e}")
+        self._search_index = index
+        return index
+
     def reload_lookup_cache(self, verbose=False):
-        """Clear the lookup cache file."""
+        """Clear the lookup cache file and reload the lookup, sharing it with the OWLery client."""
         if os.path.exists(self.cache_file):
             os.remove(self.cache_file)
             print("Cache file removed.")
         else:
             print("No cache file found.")
         self.lookup = self.nc.get_lookup(cache=self.cache_file, verbose=verbose)
+        self.normalized_lookup = self.preprocess_lookup()
+        self.reverse_lookup = {v: k for k, v in self.lookup.items()}
+        # The setter also clears the queries compiled against the old lookup
+        self.oc.lookup = self.lookup
 
     def lookup_name(self, ids):
         """
@@ -415,21 +632,22 @@ class VfbConnect:
             raise Exception(ValueError)  # Needs improving
         if classification:
             instances = self.oc.get_instances(classification, query_by_label=query_by_label)
+        parameters = {'weight': weight, 'neuron': neuron, 'instances': instances}
         cypher_query = 'MATCH (upstream:Neuron)-[r:synapsed_to]->(downstream:Neuron) ' \
-                       'WHERE r.weight[0] >= %d ' % weight
+                       'WHERE r.weight[0] >= $weight '
         if query_by_label:
-            cypher_query += 'AND %s.label = "%s" ' % (direction, neuron)
+            cypher_query += 'AND %s.label = $neuron ' % direction
         else:
-            cypher_query += 'AND %s.short_form = "%s" ' % (direction, neuron)
+            cypher_query += 'AND %s.short_form = $neuron ' % direction
         if classification and instances:
             directions.remove(direction)
-            cypher_query += "AND %s.short_form IN %s " % (directions[0], str(instances))
+            cypher_query += "AND %s.short_form IN $instances " % directions[0]
         cypher_query += "RETURN upstream.short_form as query_neuron_id, upstream.label as query_neuron_name, " \
                         "r.weight[0] as weight, " \
                         "downstream.short_form as target_neuron_id, downstream.label as target_neuron_name " \
                         "ORDER BY weight DESC"
         print(cypher_query) if verbose else None
-        r = self.nc.commit_list([cypher_query])
+        r = self.nc.commit_list([cypher_statement(cypher_query, parameters)])
         dc = dict_cursor(r)
         print(dc) if verbose else None
         if return_dataframe:
@@ -449,16 +667,16 @@ class VfbConnect:
         """
         id = neuron if query_by_label else self.lookup_id(neuron)
         query = "MATCH (c1:Class)<-[:INSTANCEOF]-(n1:Individual)-[r:has_similar_morphology_to]-(n2:Individual)-[:INSTANCEOF]->(c2:Class) " \
-                "WHERE n1.short_form = '%s'  and exists(r.%s) " \
+                "WHERE n1.short_form = $id and exists(r.%s) " \
                 "WITH c1, n1, r, n2, c2 " \
                 "OPTIONAL MATCH (n1)-[dbx1:database_cross_reference]->(s1:Site), " \
                 "(n2)-[dbx2:database_cross_reference]->(s2:Site) " \
                 "WHERE s1.is_data_source and s2.is_data_source " \
                 "RETURN DISTINCT n2.short_form AS id, r.%s[0] AS score, n2.label AS label, " \
                 "COLLECT(c2.label) AS tags, s2.short_form AS source_id, dbx2.accession[0] AS accession_in_source " \
-                "ORDER BY score DESC" % (id, similarity_score, similarity_score)
+                "ORDER BY score DESC" % (similarity_score, similarity_score)
         print(query) if verbose else None
-        dc = self.neo_query_wrapper._query(query)
+        dc = self.neo_query_wrapper._query(query, {'id': id})
         print(dc) if verbose else None
         if return_dataframe:
             return pd.DataFrame.from_records(dc)
@@ -477,19 +695,126 @@ class VfbConnect:
         """
         id = neuron if query_by_label else self.lookup_id(neuron)
         query = "MATCH (c1:Class)<-[:INSTANCEOF]-(n1:Individual)-[r:has_similar_morphology_to_part_of]-(n2:Individual)-[:INSTANCEOF]->(c2:Class) " \
-                "WHERE n1.short_form = '%s'  and exists(r.%s) " \
+                "WHERE n1.short_form = $id and exists(r.%s) " \
                 "WITH c1, n1, r, n2, c2 " \
                 "RETURN DISTINCT n2.short_form AS id, r.%s[0] AS score, n2.label AS label, " \
                 "COLLECT(c2.label) AS tags " \
-                "ORDER BY score DESC" % (id, similarity_score, similarity_score)
+                "ORDER BY score DESC" % (similarity_score, similarity_score)
         print(query) if verbose else None
-        dc = self.neo_query_wrapper._query(query)
+        dc = self.neo_query_wrapper._query(query, {'id': id})
         print(dc) if verbose else None
         if return_dataframe:
             return pd.DataFrame.from_records(dc)
         else:
             return dc
 
+    def _get_similar_many(self, neurons, relation, similarity_score='NBLAST_score', top_k=None, min_score=None,
+                          query_by_label=True, chunk_size=1000, return_dataframe=True, verbose=False):
+        """Private method to get morphological matches for many neurons, with one query per chunk of neurons.
+
+        :param neurons: A list of names or IDs of neurons (dependent on query_by_label setting).
+        :param relation: The similarity relation, 'has_similar_morphology_to' or 'has_similar_morphology_to_part_of'.
+        :param similarity_score: Optional. The similarity score to use. Default 'NBLAST_score'.
+        :param top_k: Optional. Only return the top_k best scoring matches per query neuron. Default all.
+        :param min_score: Optional. Only return matches scoring >= min_score. Default all.
+        :param query_by_label: Optional. Query neurons by label if `True`, or by ID if `False`. Default `True`.
+        :param chunk_size: Optional. Number of query neurons per query. Default 1000.
+        :param return_dataframe: Optional. Returns pandas DataFrame if `True`, otherwise returns list of dicts. Default `True`.
+        :return: A DataFrame or list of matches (query_neuron_id, query_neuron_name, id, label, score, tags, and for
+            has_similar_morphology_to source_id and accession_in_source), grouped by query neuron with the best
+            matches first.
+        :rtype: pandas.DataFrame or list of dicts
+        """
+        if query_by_label:
+            neurons = [self.lookup_id(dequote(n)) for n in neurons]
+        neurons = list(dict.fromkeys(n for n in neurons if n))
+        parameters = {}
+        query = "UNWIND $neurons AS id " \
+                "MATCH (n1:Individual {short_form: id})-[r:%s]-(n2:Individual) " \
+                "WHERE exists(r.%s) " % (relation, similarity_score)
+        if min_score is not None:
+            parameters['min_score'] = min_score
+            query += "AND r.%s[0] >= $min_score " % similarity_score
+        query += "WITH DISTINCT n1, n2, r.%s[0] AS score " % similarity_score
+        if top_k is not None:
+            parameters['top_k'] = int(top_k)
+            query += "ORDER BY score DESC " \
+                     "WITH n1, collect({n2: n2, score: score})[..$top_k] AS matches " \
+                     "UNWIND matches AS match " \
+                     "WITH n1, match.n2 AS n2, match.score AS score "
+        query += "OPTIONAL MATCH (n2)-[:INSTANCEOF]->(c2:Class) " \
+                 "WITH n1, n2, score, COLLECT(c2.label) AS tags "
+        columns = ['query_neuron_id', 'query_neuron_name', 'id', 'label', 'score', 'tags']
+        if relation == 'has_similar_morphology_to':
+            query += "OPTIONAL MATCH (n2)-[dbx2:database_cross_reference]->(s2:Site) " \
+                     "WHERE s2.is_data_source " \
+                     "WITH n1, n2, score, tags, COLLECT([s2.short_form, dbx2.accession[0]])[0] AS source "
+            columns += ['source_id', 'accession_in_source']
+        query += "RETURN n1.short_form AS query_neuron_id, n1.label AS query_neuron_name, n2.short_form AS id, " \
+                 "n2.label AS label, score, tags"
+        if relation == 'has_similar_morphology_to':
+            query += ", source[0] AS source_id, source[1] AS accession_in_source"
+        query += " ORDER BY query_neuron_id, score DESC"
+        print(query) if verbose else None
+        dc = []
+        for chunk in chunks(neurons, chunk_size):
+            r = self.nc.commit_list([cypher_statement(query, dict(parameters, neurons=chunk))])
+            if r is False:
+                print("\033[31mError:\033[0m Failed to get %s matches for %d neurons starting with %s"
+                      % (similarity_score, len(chunk), chunk[0]))
+                continue
+            dc.extend(dict_cursor(r))
+        print("Found %d matches for %d neurons" % (len(dc), len(neurons))) if verbose else None
+        if return_dataframe:
+            return pd.DataFrame.from_records(dc, columns=columns)
+        return dc
+
+    def get_similar_neurons_many(self, neurons, similarity_score='NBLAST_score', top_k=None, min_score=None,
+                                 query_by_label=True, chunk_size=1000, return_dataframe=True, verbose=False):
+        """Get individual neurons similar to each of a list of neurons.
+
+        Batched version of get_similar_neurons: all neurons are queried together (in chunks of chunk_size), with
+        the score threshold and top_k limit applied on the server.
+
+        :param neurons: A list of names or IDs of neurons (dependent on query_by_label setting).
+        :param similarity_score: Optional. Specify the similarity score to use (e.g., 'NBLAST_score'). Default 'NBLAST_score'.
+        :param top_k: Optional. Only return the top_k most similar neurons per query neuron. Default all.
+        :param min_score: Optional. Only return neurons with similarity score >= min_score. Default all.
+        :param query_by_label: Optional. Query neurons by label if `True`, or by ID if `False`. Default `True`.
+        :param chunk_size: Optional. Number of query neurons per query. Default 1000.
+        :param return_dataframe: Optional. Returns pandas DataFrame if `True`, otherwise returns list of dicts. Default `True`.
+        :return: A DataFrame or list with a row per query neuron and similar neuron (query_neuron_id, query_neuron_name,
+            id, label, score, tags, source_id, accession_in_source).
+        :rtype: pandas.DataFrame or list of dicts
+        """
+        return self._get_similar_many(neurons=neurons, relation='has_similar_morphology_to',
+                                      similarity_score=similarity_score, top_k=top_k, min_score=min_score,
+                                      query_by_label=query_by_label, chunk_size=chunk_size,
+                                      return_dataframe=return_dataframe, verbose=verbose)
+
+    def get_potential_drivers_many(self, neurons, similarity_score='NBLAST_score', top_k=None, min_score=None,
+                                   query_by_label=True, chunk_size=1000, return_dataframe=True, verbose=False):
+        """Get driver expression likely to contain each of a list of neurons.
+
+        Batched version of get_potential_drivers: all neurons are queried together (in chunks of chunk_size), with
+        the score threshold and top_k limit applied on the server.
+
+        :param neurons: A list of names or IDs of neurons (dependent on query_by_label setting).
+        :param similarity_score: Optional. Specify the similarity score to use (e.g., 'NBLAST_score', 'neuronbridge_score'). Default 'NBLAST_score'.
+        :param top_k: Optional. Only return the top_k best scoring drivers per query neuron. Default all.
+        :param min_score: Optional. Only return drivers with similarity score >= min_score. Default all.
+        :param query_by_label: Optional. Query neurons by label if `True`, or by ID if `False`. Default `True`.
+        :param chunk_size: Optional. Number of query neurons per query. Default 1000.
+        :param return_dataframe: Optional. Returns pandas DataFrame if `True`, otherwise returns list of dicts. Default `True`.
+        :return: A DataFrame or list with a row per query neuron and potential driver (query_neuron_id,
+            query_neuron_name, id, label, score, tags).
+        :rtype: pandas.DataFrame or list of dicts
+        """
+        return self._get_similar_many(neurons=neurons, relation='has_similar_morphology_to_part_of',
+                                      similarity_score=similarity_score, top_k=top_k, min_score=min_score,
+                                      query_by_label=query_by_label, chunk_size=chunk_size,
+                                      return_dataframe=return_dataframe, verbose=verbose)
+
     def get_neurons_downstream_of(self, neuron, weight, classification=None, query_by_label=True,
                                   return_dataframe=True,verbose=False):
         """Get all neurons downstream of a specified neuron.
@@ -521,6 +846,101 @@ class VfbConnect:
                                               classification=classification, query_by_label=query_by_label,
                                               return_dataframe=return_dataframe, verbose=verbose)
 
+    def _get_neurons_connected_to_many(self, neurons, weight, direction, classification=None, query_by_label=True,
+                                       chunk_size=1000, return_dataframe=True, verbose=False):
+        """Private method to get the partners of many neurons, with one query per chunk of neurons.
+
+        :param neurons: A list of names or IDs of neurons (dependent on query_by_label setting).
+        :param weight: The minimum weight of synaptic connections to include.
+        :param direction: Direction of the partners from the query neurons, either 'upstream' or 'downstream'.
+        :param classification: Optional. Restrict partners to neurons of a specified classification.
+        :param query_by_label: Optional. Query using neuron labels if `True`, or IDs if `False`. Default `True`.
+        :param chunk_size: Optional. Number of query neurons per query. Default 1000.
+        :param return_dataframe: Optional. Returns pandas DataFrame if `True`, otherwise returns list of dicts. Default `True`.
+        :return: A DataFrame or list of partners (query_neuron_id, query_neuron_name, partner_neuron_id,
+            partner_neuron_name, weight), grouped by query neuron with the strongest connections first.
+        :rtype: pandas.DataFrame or list of dicts
+        """
+        if direction not in ['upstream', 'downstream']:
+            raise ValueError("direction must be 'upstream' or 'downstream', not '%s'" % direction)
+        if query_by_label:
+            neurons = [self.lookup_id(dequote(n)) for n in neurons]
+        neurons = list(dict.fromkeys(n for n in neurons if n))
+        parameters = {'weight': weight}
+        cypher_query = 'UNWIND $neurons AS id '
+        if direction == 'downstream':
+            cypher_query += 'MATCH (query:Neuron {short_form: id})-[r:synapsed_to]->(partner:Neuron) '
+        else:
+            cypher_query += 'MATCH (partner:Neuron)-[r:synapsed_to]->(query:Neuron {short_form: id}) '
+        cypher_query += 'WHERE r.weight[0] >= $weight '
+        if classification:
+            # Resolved once for all query neurons
+            parameters['instances'] = self.oc.get_instances(classification, query_by_label=query_by_label)
+            if not parameters['instances']:
+                return pd.DataFrame() if return_dataframe else []
+            cypher_query += 'AND partner.short_form IN $instances '
+        cypher_query += "RETURN query.short_form AS query_neuron_id, query.label AS query_neuron_name, " \
+                        "partner.short_form AS partner_neuron_id, partner.label AS partner_neuron_name, " \
+                        "r.weight[0] AS weight " \
+                        "ORDER BY query_neuron_id, weight DESC"
+        print(cypher_query) if verbose else None
+        dc = []
+        for chunk in chunks(neurons, chunk_size):
+            r = self.nc.commit_list([cypher_statement(cypher_query, dict(parameters, neurons=chunk))])
+            if r is False:
+                print("\033[31mError:\033[0m Failed to get partners for %d neurons starting with %s" % (len(chunk), chunk[0]))
+                continue
+            dc.extend(dict_cursor(r))
+        print("Found %d partners of %d neurons" % (len(dc), len(neurons))) if verbose else None
+        if return_dataframe:
+            return pd.DataFrame.from_records(dc, columns=['query_neuron_id', 'query_neuron_name', 'partner_neuron_id',
+                                                          'partner_neuron_name', 'weight'])
+        return dc
+
+    def get_neurons_downstream_of_many(self, neurons, weight, classification=None, query_by_label=True,
+                                       chunk_size=1000, return_dataframe=True, verbose=False):
+        """Get all neurons downstream of each of a list of neurons.
+
+        Batched version of get_neurons_downstream_of: all neurons are queried together (in chunks of chunk_size)
+        and any classification is resolved once, rather than a query per neuron.
+
+        :param neurons: A list of names or IDs of neurons (dependent on query_by_label setting).
+        :param weight: Limit returned neurons to those connected by >= weight synapses.
+        :param classification: Optional. Restrict downstream neurons by classification.
+        :param query_by_label: Optional. Query neurons by label if `True`, or by ID if `False`. Default `True`.
+        :param chunk_size: Optional. Number of query neurons per query. Default 1000.
+        :param return_dataframe: Optional. Returns pandas DataFrame if `True`, otherwise returns list of dicts. Default `True`.
+        :return: A DataFrame or list with a row per query neuron and downstream partner (query_neuron_id,
+            query_neuron_name, partner_neuron_id, partner_neuron_name, weight).
+        :rtype: pandas.DataFrame or list of dicts
+        """
+        return self._get_neurons_connected_to_many(neurons=neurons, weight=weight, direction='downstream',
+                                                   classification=classification, query_by_label=query_by_label,
+                                                   chunk_size=chunk_size, return_dataframe=return_dataframe,
+                                                   verbose=verbose)
+
+    def get_neurons_upstream_of_many(self, neurons, weight, classification=None, query_by_label=True,
+                                     chunk_size=1000, return_dataframe=True, verbose=False):
+        """Get all neurons upstream of each of a list of neurons.
+
+        Batched version of get_neurons_upstream_of: all neurons are queried together (in chunks of chunk_size)
+        and any classification is resolved once, rather than a query per neuron.
+
+        :param neurons: A list of names or IDs of neurons (dependent on query_by_label setting).
+        :param weight: Limit returned neurons to those connected by >= weight synapses.
+        :param classification: Optional. Restrict upstream neurons by classification.
+        :param query_by_label: Optional. Query neurons by label if `True`, or by ID if `False`. Default `True`.
+        :param chunk_size: Optional. Number of query neurons per query. Default 1000.
+        :param return_dataframe: Optional. Returns pandas DataFrame if `True`, otherwise returns list of dicts. Default `True`.
+        :return: A DataFrame or list with a row per query neuron and upstream partner (query_neuron_id,
+            query_neuron_name, partner_neuron_id, partner_neuron_name, weight).
+        :rtype: pandas.DataFrame or list of dicts
+        """
+        return self._get_neurons_connected_to_many(neurons=neurons, weight=weight, direction='upstream',
+                                                   classification=classification, query_by_label=query_by_label,
+                                                   chunk_size=chunk_size, return_dataframe=return_dataframe,
+                                                   verbose=verbose)
+
     def get_connected_neurons_by_type(self, weight, upstream_type=None, downstream_type=None, query_by_label=True,
                                       return_dataframe=True, verbose=False):
 
@@ -549,19 +969,19 @@ class VfbConnect:
         if upstream_type:
             cypher_ql.append(
                 "MATCH (up:Class)<-[:SUBCLASSOF*0..]-(c1:Class)<-[:INSTANCEOF]-(n1:has_neuron_connectivity)"
-                " WHERE up.short_form = '%s' " % upstream_type)
+                " WHERE up.short_form = $upstream_type ")
         if downstream_type:
             cypher_ql.append(
                 "MATCH (down:Class)<-[:SUBCLASSOF*0..]-(c2:Class)<-[:INSTANCEOF]-(n2:has_neuron_connectivity)"
-                "WHERE down.short_form = '%s' " % downstream_type)
+                "WHERE down.short_form = $downstream_type ")
         if not upstream_type:
             cypher_ql.append(
-                "MATCH (c1:Class)<-[:INSTANCEOF]-(n1)-[r:synapsed_to]->(n2) WHERE r.weight[0] >= %d " % weight)
+                "MATCH (c1:Class)<-[:INSTANCEOF]-(n1)-[r:synapsed_to]->(n2) WHERE r.weight[0] >= $weight ")
         elif not downstream_type:
             cypher_ql.append(
-                "MATCH (n1)-[r:synapsed_to]->(n2)-[:INSTANCEOF]->(c2:Class) WHERE r.weight[0] >= %d " % weight)
+                "MATCH (n1)-[r:synapsed_to]->(n2)-[:INSTANCEOF]->(c2:Class) WHERE r.weight[0] >= $weight ")
         else:
-            cypher_ql.append("MATCH (n1)-[r:synapsed_to]->(n2) WHERE r.weight[0] >= %d " % weight)
+            cypher_ql.append("MATCH (n1)-[r:synapsed_to]->(n2) WHERE r.weight[0] >= $weight ")
         cypher_ql.append("OPTIONAL MATCH (n1)-[r1:database_cross_reference]->(s1:Site) "
                         "WHERE exists(s1.is_data_source) AND s1.is_data_source = [True] ")
         cypher_ql.append("OPTIONAL MATCH (n2)-[r2:database_cross_reference]->(s2:Site) " 
@@ -577,7 +997,8 @@ class VfbConnect:
                          "s2.short_form AS down_source, r2.accession[0] AS down_accession")
         cypher_q = ' \n'.join(cypher_ql)
         print(cypher_q) if verbose else None
-        r = self.nc.commit_list([cypher_q])
+        r = self.nc.commit_list([cypher_statement(cypher_q, {'upstream_type': upstream_type, 'downstream_type': downstream_type,
+                                                          'weight': weight})])
         if not r:
             warnings.warn("No results returned")
             return False
@@ -587,6 +1008,428 @@ class VfbConnect:
         else:
             return dc
 
+    def _get_neuron_types(self, neurons, within=None, include_superclasses=False, chunk_size=5000):
+        """Types of neurons as a long DataFrame of neuron_id, class_id pairs.
+
+        :param neurons: List of neuron short_forms.
+        :param within: Optional. Only include types that are (subclasses of) this class short_form.
+        :param include_superclasses: Optional. Also include all superclasses of the direct types, from the local
+            closure index if loaded, otherwise from the PDB.
+        :param chunk_size: Optional. Number of neurons per query.
+        :return: DataFrame of neuron_id, class_id
+        """
+        closure = self.oc.closure_index if include_superclasses else None
+        query = "UNWIND $ids AS id MATCH (n:Individual {short_form: id})-[:INSTANCEOF]->(c:Class) "
+        if include_superclasses and closure is None:
+            query += "MATCH (c)-[:SUBCLASSOF*0..]->(t:Class) "
+        else:
+            query += "WITH n, c AS t "
+        if within and closure is None:
+            query += "WHERE (t)-[:SUBCLASSOF*0..]->(:Class {short_form: $within}) "
+        query += "RETURN DISTINCT n.short_form, t.short_form"
+        rows = []
+        for chunk in chunks(list(neurons), chunk_size):
+            r = self.nc.commit_list([cypher_statement(query, {'ids': chunk, 'within': within})])
+            if r is False:
+                raise ValueError("Failed to get types for neurons starting with %s" % chunk[0])
+            rows.extend(d['row'] for d in r[0]['data'])
+        types = pd.DataFrame.from_records(rows, columns=['neuron_id', 'class_id'])
+        if closure is not None and not types.empty:
+            iris = {gen_short_form(iri): iri for iri in closure.iris}
+            allowed = None
+            if within:
+                allowed = {within}
+                if within in iris:
+                    allowed.update(gen_short_form(i) for i in closure.subclasses(iris[within]))
+            expanded = []
+            for c in types['class_id'].unique():
+                supers = [c] + ([gen_short_form(i) for i in closure.superclasses(iris[c])] if c in iris else [])
+                expanded.extend((c, t) for t in supers if allowed is None or t in allowed)
+            types = types.merge(pd.DataFrame.from_records(expanded, columns=['class_id', 'type_id']), on='class_id')
+            types = types[['neuron_id', 'type_id']].rename(columns={'type_id': 'class_id'}).drop_duplicates(ignore_index=True)
+        return types
+
+    def get_connectivity_by_type(self, upstream_type=None, downstream_type=None, weight=0, edges=None,
+                                 include_superclasses=False, value=None, query_by_label=True, verbose=False):
+        """Aggregate connections between individual neurons to connections between neuron types.
+
+        Neuron to neuron connections (between instances of upstream_type and downstream_type, or those given in
+        edges) are grouped by the types of the upstream and downstream neurons, giving the number of connections,
+        the total weight and the number of neurons of each type involved for every pair of types. Types are the
+        neurons' direct types under upstream_type/downstream_type or, with include_superclasses, these and all
+        their superclasses down to upstream_type/downstream_type (from the local closure index if loaded, see
+        load_closure_index). Aggregation is done locally on integer codes rather than joined strings.
+
+        :param upstream_type: Optional. The upstream neuron type (e.g., 'GABAergic neuron').
+        :param downstream_type: Optional. The downstream neuron type (e.g., 'Descending neuron').
+        :param weight: Optional. Limit to connections of >= weight synapses. Default 0.
+        :param edges: Optional. Neuron to neuron connections to aggregate instead of querying them: a ConnectivityMatrix
+            or a DataFrame with upstream_neuron_id, downstream_neuron_id and weight columns (e.g. from
+            get_connected_neurons_by_type). At least one of upstream_type, downstream_type or edges must be specified.
+        :param include_superclasses: Optional. Also count connections towards the superclasses of each type. Default `False`
+        :param value: Optional. Return an upstream type x downstream type matrix of this column (weight, connections,
+            upstream_neurons or downstream_neurons) instead of a table.
+        :param query_by_label: Optional. Specify neuron types by label if `True` (default) or by short_form ID if `False`.
+        :param verbose: Optional. Print progress if `True`.
+        :return: DataFrame with a row per pair of types (upstream_class, upstream_class_id, downstream_class,
+            downstream_class_id, connections, weight, upstream_neurons, downstream_neurons) by total weight, or
+            a matrix if value is given.
+        :rtype: pandas.DataFrame
+        """
+        if upstream_type is None and downstream_type is None and edges is None:
+            raise ValueError("At least one of upstream_type, downstream_type or edges must be specified")
+        if query_by_label:
+            if upstream_type: upstream_type = self.lookup_id(dequote(upstream_type))
+            if downstream_type: downstream_type = self.lookup_id(dequote(downstream_type))
+        if isinstance(edges, ConnectivityMatrix):
+            edges = edges.to_dataframe(weight=weight)
+        elif edges is not None:
+            edges = edges[edges['weight'] >= weight][['upstream_neuron_id', 'downstream_neuron_id', 'weight']]
+        else:
+            instances = {'up': "MATCH (up:Class)<-[:SUBCLASSOF*0..]-(:Class)<-[:INSTANCEOF]-(n1:has_neuron_connectivity) "
+                               "WHERE up.short_form = $upstream_type WITH DISTINCT n1 ",
+                         'down': "MATCH (down:Class)<-[:SUBCLASSOF*0..]-(:Class)<-[:INSTANCEOF]-(n2:has_neuron_connectivity) "
+                                 "WHERE down.short_form = $downstream_type WITH DISTINCT n2 "}
+            if upstream_type:
+                query = instances['up'] + "MATCH (n1)-[r:synapsed_to]->(n2:has_neuron_connectivity) WHERE r.weight[0] >= $weight "
+                if downstream_type:
+                    query += "AND (n2)-[:INSTANCEOF]->(:Class)-[:SUBCLASSOF*0..]->(:Class {short_form: $downstream_type}) "
+            else:
+                query = instances['down'] + "MATCH (n1:has_neuron_connectivity)-[r:synapsed_to]->(n2) WHERE r.weight[0] >= $weight "
+            query += "RETURN n1.short_form AS upstream_neuron_id, n2.short_form AS downstream_neuron_id, r.weight[0] AS weight"
+            print(query) if verbose else None
+            r = self.nc.commit_list([cypher_statement(query, {'upstream_type': upstream_type,
+                                                              'downstream_type': downstream_type, 'weight': weight})])
+            if r is False:
+                raise ValueError("Failed to get connections between %s and %s" % (upstream_type, downstream_type))
+            edges = pd.DataFrame.from_records(dict_cursor(r), columns=['upstream_neuron_id', 'downstream_neuron_id', 'weight'])
+        print("Aggregating %d connections" % len(edges)) if verbose else None
+        upstream_types = self._get_neuron_types(edges['upstream_neuron_id'].unique(), within=upstream_type,
+                                                include_superclasses=include_superclasses)
+        downstream_types = self._get_neuron_types(edges['downstream_neuron_id'].unique(), within=downstream_type,
+                                                  include_superclasses=include_superclasses)
+        aggregated = aggregate_by_type(edges, upstream_types, downstream_types)
+        class_ids = list(pd.unique(pd.concat([aggregated['upstream_class_id'], aggregated['downstream_class_id']])))
+        labels = {}
+        for chunk in chunks(class_ids, 5000):
+            r = self.nc.commit_list([cypher_statement("UNWIND $ids AS id MATCH (c:Class {short_form: id}) "
+                                                      "RETURN c.short_form, c.label", {'ids': chunk})])
+            if r:
+                labels.update((d['row'][0], d['row'][1]) for d in r[0]['data'])
+        if value:
+            return type_matrix(aggregated, value=value, labels=labels)
+        aggregated.insert(0, 'upstream_class', aggregated['upstream_class_id'].map(labels))
+        aggregated.insert(2, 'downstream_class', aggregated['downstream_class_id'].map(labels))
+        return aggregated
+
+    def export_connectivity(self, path, dataset=None, weight=0, page_size=5000, resume=True, query_by_label=True, verbose=False):
+        """Export all synaptic connections (synapsed_to edges) of a dataset to partitioned Parquet files.
+
+        Upstream neurons are paged through in short_form order (keyset pagination) and each page of edges is written
+        as a separate Parquet file with dictionary-encoded neuron IDs, so whole connectomes can be exported without
+        holding them in memory. Progress is recorded after every page, so an interrupted export resumes where it
+        stopped. Requires `pyarrow`.
+
+        The result can be loaded with e.g. `pyarrow.dataset.dataset(path, partitioning='hive')` or `pandas.read_parquet(path)`.
+
+        :param path: Directory to write the export to. Files are written under `<path>/dataset=<dataset id>/`.
+        :param dataset: Optional. The dataset to export. If not specified all neurons with connectivity are exported.
+        :param weight: Optional. The minimum weight of synaptic connections to include. Default 0.
+        :param page_size: Optional. The number of upstream neurons per page/file. Default 5000.
+        :param resume: Optional. Continue a previous export in the same location if `True` (default), otherwise start
+            again, removing the files of the previous export. An export can only be resumed with the same weight and
+            page_size.
+        :param query_by_label: Optional. Specify the dataset by label if `True` (default) or by short_form ID if `False`.
+        :param verbose: Optional. Print progress if `True`.
+        :return: A summary of the export including the partition directory, number of pages and number of edges.
+        :rtype: dict
+        """
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("export_connectivity requires pyarrow. Install it with: pip install pyarrow")
+        if dataset and query_by_label:
+            dataset = self.lookup_id(dataset)
+        partition = os.path.join(path, "dataset=%s" % (dataset if dataset else 'all'))
+        os.makedirs(partition, exist_ok=True)
+        progress_file = os.path.join(partition, '_progress.json')
+        if resume and os.path.exists(progress_file):
+            with open(progress_file, 'r') as f:
+                progress = json.load(f)
+            if (progress.get('weight'), progress.get('page_size')) != (weight, page_size):
+                raise ValueError("The export in %s was started with weight=%s and page_size=%s. Rerun with those "
+                                 "settings to resume it, or with resume=False to start again."
+                                 % (partition, progress.get('weight'), progress.get('page_size')))
+            if progress['complete']:
+                print("Export already complete in %s" % partition) if verbose else None
+                return dict(progress, path=partition)
+            print("Resuming export after %s (%d pages written)" % (progress['last_neuron'], progress['pages'])) if verbose else None
+        else:
+            # Starting again: remove files of any earlier export so its edges are not mixed in
+            for f in os.listdir(partition):
+                if f == '_progress.json' or f.lstrip('.').startswith('part-'):
+                    os.remove(os.path.join(partition, f))
+            progress = {'last_neuron': '', 'pages': 0, 'edges': 0, 'complete': False, 'weight': weight,
+                        'page_size': page_size}
+        if dataset:
+            neuron_match = "MATCH (ds:DataSet)<-[:has_source]-(n1:has_neuron_connectivity) WHERE ds.short_form = $dataset AND "
+        else:
+            neuron_match = "MATCH (n1:has_neuron_connectivity) WHERE "
+        # The same statement is sent for every page so the server plans it once
+        cypher_query = neuron_match + "n1.short_form > $last_neuron " \
+                       "WITH n1 ORDER BY n1.short_form LIMIT $page_size " \
+                       "OPTIONAL MATCH (n1)-[r:synapsed_to]->(n2:has_neuron_connectivity) WHERE r.weight[0] >= $weight " \
+                       "RETURN n1.short_form AS upstream_neuron_id, n2.short_form AS downstream_neuron_id, " \
+                       "r.weight[0] AS weight"
+        print(cypher_query) if verbose else None
+        while True:
+            parameters = {'dataset': dataset, 'last_neuron': progress['last_neuron'], 'page_size': page_size, 'weight': weight}
+            r = self.nc.commit_list([cypher_statement(cypher_query, parameters)])
+            if r is False:
+                print("\033[31mError:\033[0m Query failed after %s; rerun to resume the export" % progress['last_neuron'])
+                return dict(progress, path=partition)
+            rows = [d['row'] for d in r[0]['data']] if r else []
+            if not rows:
+                break
+            edges = [row for row in rows if row[1] is not None]
+            if edges:
+                table = pa.table({
+                    'upstream_neuron_id': pa.array([e[0] for e in edges], type=pa.string()).dictionary_encode(),
+                    'downstream_neuron_id': pa.array([e[1] for e in edges], type=pa.string()).dictionary_encode(),
+                    'weight': pa.array([e[2] for e in edges], type=pa.int32()),
+                })
+                part_file = "part-%06d.parquet" % progress['pages']
+                temp_file = os.path.join(partition, '.' + part_file)  # hidden until complete so readers skip it
+                pq.write_table(table, temp_file)
+                os.replace(temp_file, os.path.join(partition, part_file))
+                progress['pages'] += 1
+                progress['edges'] += len(edges)
+            progress['last_neuron'] = max(row[0] for row in rows)
+            with open(progress_file, 'w') as f:
+                json.dump(progress, f)
+            print("Exported %d edges for neurons up to %s" % (progress['edges'], progress['last_neuron'])) if verbose else None
+            if len(set(row[0] for row in rows)) < page_size:
+                break
+        progress['complete'] = True
+        with open(progress_file, 'w') as f:
+            json.dump(progress, f)
+        print("Exported %d edges in %d files to %s" % (progress['edges'], progress['pages'], partition)) if verbose else None
+        return dict(progress, path=partition)
+
+    def _dataset_release(self, dataset, label='has_neuron_connectivity'):
+        """Fingerprint of the current release of a dataset's neurons (number and last short_form), or None."""
+        r = self.nc.commit_list([cypher_statement(
+            "MATCH (ds:DataSet)<-[:has_source]-(n:%s) WHERE ds.short_form = $dataset "
+            "RETURN count(n), max(n.short_form)" % label, {'dataset': dataset})])
+        if not r or not r[0]['data']:
+            return None
+        return "%s:%s" % tuple(r[0]['data'][0]['row'])
+
+    def connectivity_matrix(self, neurons_or_dataset, weight=0, query_by_label=True, cache=True, force_reload=False,
+                            page_size=5000, verbose=False):
+        """Load the connectivity of a dataset, or between a set of neurons, into a local sparse matrix.
+
+        All synapsed_to edges are streamed from the PDB into a SciPy CSR matrix (rows upstream, columns downstream)
+        with an ID to index map, so up/downstream partners can then be looked up locally in time proportional to
+        the number of partners (see ConnectivityMatrix.downstream/upstream). Matrices for datasets are cached on
+        disk (npz) and reloaded as long as the dataset's neurons are unchanged, for up to three months.
+
+        :param neurons_or_dataset: A dataset (name or ID), or a list of neurons (names, IDs or a VFBTerms object).
+            For neurons only the connections between them are loaded.
+        :param weight: Optional. The minimum weight of synaptic connections to include. Default 0.
+        :param query_by_label: Optional. Specify the dataset or neurons by label if `True` (default) or by ID if `False`.
+        :param cache: Optional. Use (and save) the on-disk cache for datasets. Default `True`
+        :param force_reload: Optional. Reload from the PDB even if a cached copy exists. Default `False`
+        :param page_size: Optional. Number of neurons per query. Default 5000.
+        :param verbose: Optional. Print progress if `True`.
+        :return: The ConnectivityMatrix.
+        :rtype: ConnectivityMatrix
+        """
+        if isinstance(neurons_or_dataset, str):
+            dataset = self.lookup_id(neurons_or_dataset) if query_by_label else neurons_or_dataset
+            if not dataset:
+                raise ValueError("Dataset '%s' not found." % neurons_or_dataset)
+            release = self._dataset_release(dataset) if cache else None
+            path = os.path.join(self.get_cache_dir('connectivity'), '%s_%s.npz' % (dataset, weight))
+            matrix = None
+            if cache and not force_reload:
+                three_months_in_seconds = 3 * 30 * 24 * 60 * 60
+                try:
+                    matrix = ConnectivityMatrix.load(path, max_age=three_months_in_seconds, release=release)
+                    print("Loaded connectivity matrix from %s" % path) if verbose and matrix else None
+                except Exception as e:
+                    print(f"Failed to load connectivity matrix from disk: {e}")
+            if matrix is None:
+                matrix = ConnectivityMatrix.from_neo(self.nc, dataset=dataset, weight=weight, page_size=page_size,
+                                                     release=release, verbose=verbose)
+                if cache:
+                    try:
+                        matrix.save(path)
+                    except Exception as e:
+                        print(f"Failed to save connectivity matrix to disk: {e}")
+        else:
+            matrix = ConnectivityMatrix.from_neo(self.nc, neurons=self._neuron_ids(neurons_or_dataset, query_by_label),
+                                                 weight=weight, page_size=page_size, verbose=verbose)
+        print(matrix) if verbose else None
+        self._connectivity_matrix = matrix
+        return matrix
+
+    def similarity_matrix(self, neurons_or_dataset, similarity_score='NBLAST_score', min_score=None,
+                          query_by_label=True, cache=True, force_reload=False, page_size=5000, verbose=False):
+        """Load the morphological similarity scores of a dataset's neurons, or of a set of neurons, into a local
+        sparse matrix.
+
+        All has_similar_morphology_to scores of the neurons (to neurons in any dataset) are paged from the PDB into
+        a symmetric SciPy CSR matrix with an ID to index map, so that nearest neighbours, clusters and cross dataset
+        matches can then be found locally (see SimilarityMatrix.nearest/clusters/cross_dataset_matches). Matrices
+        for datasets are cached on disk (npz) and reloaded as long as the dataset's neurons are unchanged, for up to
+        three months.
+
+        :param neurons_or_dataset: A dataset (name or ID), or a list of neurons (names, IDs or a VFBTerms object).
+        :param similarity_score: Optional. The similarity score to load (e.g., 'NBLAST_score'). Default 'NBLAST_score'.
+        :param min_score: Optional. Only load scores >= min_score. Default all.
+        :param query_by_label: Optional. Specify the dataset or neurons by label if `True` (default) or by ID if `False`.
+        :param cache: Optional. Use (and save) the on-disk cache for datasets. Default `True`
+        :param force_reload: Optional. Reload from the PDB even if a cached copy exists. Default `False`
+        :param page_size: Optional. Number of neurons per query. Default 5000.
+        :param verbose: Optional. Print progress if `True`.
+        :return: The SimilarityMatrix.
+        :rtype: SimilarityMatrix
+        """
+        if isinstance(neurons_or_dataset, str):
+            dataset = self.lookup_id(neurons_or_dataset) if query_by_label else neurons_or_dataset
+            if not dataset:
+                raise ValueError("Dataset '%s' not found." % neurons_or_dataset)
+            release = self._dataset_release(dataset, label='Individual') if cache else None
+            path = os.path.join(self.get_cache_dir('similarity'),
+                                '%s_%s_%s.npz' % (dataset, similarity_score, 'all' if min_score is None else min_score))
+            matrix = None
+            if cache and not force_reload:
+                three_months_in_seconds = 3 * 30 * 24 * 60 * 60
+                try:
+                    matrix = SimilarityMatrix.load(path, max_age=three_months_in_seconds, release=release)
+                    print("Loaded similarity matrix from %s" % path) if verbose and matrix else None
+                except Exception as e:
+                    print(f"Failed to load similarity matrix from disk: {e}")
+            if matrix is None:
+                matrix = SimilarityMatrix.from_neo(self.nc, dataset=dataset, similarity_score=similarity_score,
+                                                   min_score=min_score, page_size=page_size, release=release,
+                                                   verbose=verbose)
+                if cache:
+                    try:
+                        matrix.save(path)
+                    except Exception as e:
+                        print(f"Failed to save similarity matrix to disk: {e}")
+        else:
+            scores = self.get_similar_neurons_many(self._neuron_ids(neurons_or_dataset, query_by_label),
+                                                   similarity_score=similarity_score, min_score=min_score,
+                                                   query_by_label=False, chunk_size=page_size, verbose=verbose)
+            matrix = SimilarityMatrix.from_dataframe(scores, similarity_score=similarity_score)
+            matrix.min_score = min_score
+        print(matrix) if verbose else None
+        return matrix
+
+    def _path_graph(self, sources, max_hops, weight, upstream=False, targets=None, use_local=True, verbose=False):
+        """Connectivity to search for paths from sources: the loaded connectivity matrix if it was loaded for a
+        whole dataset and holds every downstream connection within max_hops of the sources (see
+        ConnectivityMatrix.covers), otherwise the connections found by a breadth first walk over the PDB, one query
+        per hop (chunked), expanding each neuron once and stopping early once all targets are reached. Upstream
+        walks always use the PDB, as a dataset matrix lacks connections from neurons outside the dataset."""
+        local = self._connectivity_matrix
+        if use_local and not upstream and local is not None and local.covers(sources, max_hops, weight):
+            print("Using local connectivity matrix %s" % local) if verbose else None
+            return local
+        direction = 'upstream' if upstream else 'downstream'
+        frontier, seen, edges = list(sources), set(sources), []
+        for hop in range(max_hops):
+            partners = self._get_neurons_connected_to_many(frontier, weight=weight, direction=direction,
+                                                           query_by_label=False, verbose=verbose)
+            edges.append(partners)
+            frontier = [n for n in partners['partner_neuron_id'].unique() if n not in seen]
+            seen.update(frontier)
+            print("Hop %d: %d new neurons" % (hop + 1, len(frontier))) if verbose else None
+            if not frontier or (targets and seen.issuperset(targets)):
+                break
+        edges = pd.concat(edges, ignore_index=True)
+        labels = dict(zip(edges['query_neuron_id'], edges['query_neuron_name']))
+        labels.update(zip(edges['partner_neuron_id'], edges['partner_neuron_name']))
+        up, down = ('partner_neuron_id', 'query_neuron_id') if upstream else ('query_neuron_id', 'partner_neuron_id')
+        graph = ConnectivityMatrix.from_dataframe(edges, upstream=up, downstream=down, labels=labels)
+        graph.min_weight = weight
+        return graph
+
+    def get_reachable_neurons(self, sources, max_hops=3, weight=0, direction='downstream', query_by_label=True,
+                              use_local=True, return_dataframe=True, verbose=False):
+        """Get all neurons reachable from a set of neurons within max_hops synapses, layer by layer.
+
+        If the connectivity matrix of a dataset has been loaded (see connectivity_matrix), with a weight no higher
+        than this one, and a downstream walk stays within the dataset's neurons, the search is run locally;
+        otherwise the PDB is walked breadth first, one batched query per hop, visiting each neuron once.
+
+        :param sources: A list of names or IDs of neurons (dependent on query_by_label setting), or a VFBTerms object.
+        :param max_hops: Optional. Maximum number of synapses to cross. Default 3.
+        :param weight: Optional. Only follow connections of >= weight synapses. Default 0.
+        :param direction: Optional. Follow connections 'downstream' (default) or 'upstream'.
+        :param query_by_label: Optional. Query neurons by label if `True`, or by ID if `False`. Default `True`.
+        :param use_local: Optional. Use the loaded connectivity matrix if it holds all the connections needed.
+            Default `True`
+        :param return_dataframe: Optional. Returns pandas DataFrame if `True`, otherwise returns list of dicts. Default `True`.
+        :param verbose: Optional. Print progress if `True`.
+        :return: A DataFrame or list of neuron_id, neuron_name and hop (the fewest synapses from a source, 0 for the
+            sources), by hop.
+        :rtype: pandas.DataFrame or list of dicts
+        """
+        if direction not in ['upstream', 'downstream']:
+            raise ValueError("direction must be 'upstream' or 'downstream', not '%s'" % direction)
+        sources = self._neuron_ids(sources, query_by_label)
+        graph = self._path_graph(sources, max_hops, weight, upstream=direction == 'upstream', use_local=use_local,
+                                 verbose=verbose)
+        return graph.reachable(sources, max_hops=max_hops, weight=weight, upstream=direction == 'upstream',
+                               return_dataframe=return_dataframe)
+
+    def get_paths(self, sources, targets, max_hops=3, weight=0, weighted=False, query_by_label=True, use_local=True,
+                  return_dataframe=True, verbose=False):
+        """Get the shortest (or strongest) paths from each of a set of neurons to each of another within max_hops synapses.
+
+        If the connectivity matrix of a dataset has been loaded (see connectivity_matrix), with a weight no higher
+        than this one, and the walk stays within the dataset's neurons, paths are found locally; otherwise the
+        connections within max_hops of the sources are first collected from the PDB by a breadth first walk, one
+        batched query per hop. Paths are then found with SciPy's sparse graph routines.
+
+        :param sources: A list of names or IDs of neurons (dependent on query_by_label setting), or a VFBTerms object.
+        :param targets: A list of names or IDs of neurons, or a VFBTerms object.
+        :param max_hops: Optional. Maximum number of synapses to cross. Default 3.
+        :param weight: Optional. Only follow connections of >= weight synapses. Default 0.
+        :param weighted: Optional. Find the paths with the lowest total 1/weight (strongest) rather than the fewest
+            hops. Default `False`
+        :param query_by_label: Optional. Query neurons by label if `True`, or by ID if `False`. Default `True`.
+        :param use_local: Optional. Use the loaded connectivity matrix if it holds all the connections needed.
+            Default `True`
+        :param return_dataframe: Optional. Returns pandas DataFrame if `True`, otherwise returns list of dicts. Default `True`.
+        :param verbose: Optional. Print progress if `True`.
+        :return: A DataFrame or list with a row per connected source and target: source_id, source_name, target_id,
+            target_name, hops, path (list of IDs), path_names, weights (along the path), min_weight and cost.
+        :rtype: pandas.DataFrame or list of dicts
+        """
+        sources = self._neuron_ids(sources, query_by_label)
+        targets = self._neuron_ids(targets, query_by_label)
+        graph = self._path_graph(sources, max_hops, weight, targets=None if weighted else set(targets),
+                                 use_local=use_local, verbose=verbose)
+        return graph.paths(sources, targets, max_hops=max_hops, weight=weight, weighted=weighted,
+                           return_dataframe=return_dataframe)
+
+    def _neuron_ids(self, neurons, query_by_label=True):
+        """IDs of a neuron or list of neurons (names or IDs) or a VFBTerms object, without duplicates."""
+        if isinstance(neurons, (VFBTerms, VFBTerm)):
+            neurons = neurons.get_ids() if isinstance(neurons, VFBTerms) else [neurons.id]
+            query_by_label = False
+        elif isinstance(neurons, str):
+            neurons = [neurons]
+        if query_by_label:
+            neurons = [self.lookup_id(dequote(n)) for n in neurons]
+        return list(dict.fromkeys(n for n in neurons if n))
+
     def get_instances_by_dataset(self, dataset, query_by_label=True, summary=True, return_dataframe=True, return_id_only=False):
         """Get JSON report of all individuals in a specified dataset.
 
@@ -600,9 +1443,9 @@ class VfbConnect:
             dataset = self.lookup_id(dataset)
         if dataset:
             query = "MATCH (ds:DataSet)<-[:has_source]-(i:Individual) " \
-                    "WHERE ds.short_form = '%s' " \
-                    "RETURN collect(distinct i.short_form) as inds" % dataset
-            dc = self.neo_query_wrapper._query(query) # TODO - Would better to use the original column oriented return!
+                    "WHERE ds.short_form = $dataset " \
+                    "RETURN collect(distinct i.short_form) as inds"
+            dc = self.neo_query_wrapper._query(query, {'dataset': dataset}) # TODO - Would better to use the original column oriented return!
             if return_id_only:
                 return dc[0]['inds']
             return self.get_TermInfo(dc[0]['inds'], summary=summary, return_dataframe=return_dataframe)
@@ -617,8 +1460,8 @@ class VfbConnect:
         :raises ValueError: If the template name is not recognized.
         """
         short_forms = list(short_forms)
-        query = "MATCH (t:Template { label: '%s'}) return t.short_form" % template
-        dc = self.neo_query_wrapper._query(query)
+        query = "MATCH (t:Template { label: $template}) return t.short_form"
+        dc = self.neo_query_wrapper._query(query, {'template': template})
         if not dc:
             raise ValueError("Unrecognised template name %s" % template)
         else:
@@ -709,7 +1552,7 @@ class VfbConnect:
 
         query = ("MATCH (g:Gene:Class%s)<-[e:expresses]-(clus:Cluster:Individual)-"
                  "[:composed_primarily_of]->(c2:Class)-[:SUBCLASSOF*0..]->(c1:Neuron:Class) "
-                 "WHERE c1.short_form = '%s' %s"
+                 "WHERE c1.short_form = $cell_type %s"
                  "MATCH (clus)-[:part_of]->()-[:has_part]->(sa:Sample:Individual) "
                  "OPTIONAL MATCH (sa)-[:part_of]->(sex:Class) "
                  "WHERE sex.short_form IN ['FBbt_00007011', 'FBbt_00007004'] "
@@ -728,14 +1571,159 @@ class VfbConnect:
                  "g.label AS gene, g.short_form AS gene_id, "
                  "apoc.coll.subtract(labels(g), ['Class', 'Entity', 'hasScRNAseq', 'Feature', 'Gene']) AS function, "
                  "e.expression_extent[0] as extent, toFloat(e.expression_level[0]) as level "
-                 "ORDER BY cell_type, g.label" % (gene_label, cell_type_short_form, equal_condition))
-        r = self.nc.commit_list([query])
+                 "ORDER BY cell_type, g.label" % (gene_label, equal_condition))
+        r = self.nc.commit_list([cypher_statement(query, {'cell_type': cell_type_short_form})])
         dc = dict_cursor(r)
         if return_dataframe:
             return pd.DataFrame.from_records(dc)
         else:
             return dc
 
+    def get_transcriptomic_profiles(self, cell_types, gene_types=None, no_subtypes=False, query_by_label=True,
+                                    chunk_size=100, return_dataframe=True, verbose=False):
+        """Get gene expression data for many cell types, optionally restricted to several gene types.
+
+        Batched version of get_transcriptomic_profile: all cell types and gene types are queried together (in
+        chunks of chunk_size cell types) and returned as a single long format table.
+
+        :param cell_types: A list of IDs, names, or symbols of classes in the Drosophila Anatomy Ontology (FBbt).
+        :param gene_types: Optional. A list of gene function labels retrieved using `get_gene_function_filters`.
+        :param no_subtypes: Optional. If `True`, only clusters for the specified cell types will be returned and not subtypes. Default `False`.
+        :param query_by_label: Optional. Query using cell type labels if `True`, or IDs if `False`. Default `True`.
+        :param chunk_size: Optional. Number of cell types per query. Default 100.
+        :param return_dataframe: Optional. Returns pandas DataFrame if `True`, otherwise returns list of dicts. Default `True`.
+        :return: A DataFrame with a row per queried cell type (query_cell_type_id), cluster, gene and matching gene
+            type (gene_type, None if no gene_types were given), with the columns of get_transcriptomic_profile.
+        :rtype: pandas.DataFrame or list of dicts
+        :raises KeyError: If a cell_type or gene_type is invalid.
+        """
+        cell_types = [cell_types] if isinstance(cell_types, str) else list(cell_types)
+        ids = [self.lookup_id(c) for c in cell_types] if query_by_label else cell_types
+        for cell_type, id in zip(cell_types, ids):
+            if not id or not id.startswith('FBbt'):
+                raise KeyError("cell_type must be a valid ID, label or symbol from the Drosophila Anatomy Ontology, "
+                               "not '%s'" % cell_type)
+        ids = list(dict.fromkeys(ids))
+        parameters = {}
+        query = "UNWIND $cell_types AS cell_type " \
+                "MATCH (g:Gene:Class)<-[e:expresses]-(clus:Cluster:Individual)-[:composed_primarily_of]->" \
+                "(c2:Class)-[:SUBCLASSOF*0..]->(c1:Neuron:Class {short_form: cell_type}) "
+        conditions = []
+        if no_subtypes:
+            conditions.append("c1.short_form = c2.short_form")
+        if gene_types:
+            gene_types = [gene_types] if isinstance(gene_types, str) else list(gene_types)
+            invalid = set(gene_types) - set(self.get_gene_function_filters())
+            if invalid:
+                raise KeyError("gene_type must be a valid gene function label, try running get_gene_function_filters()"
+                               " (invalid: %s)" % ', '.join(sorted(invalid)))
+            parameters['gene_types'] = gene_types
+            conditions.append("any(l IN labels(g) WHERE l IN $gene_types)")
+        if conditions:
+            query += "WHERE %s " % ' AND '.join(conditions)
+        if gene_types:
+            query += "UNWIND [l IN labels(g) WHERE l IN $gene_types] AS gene_type "
+        else:
+            query += "WITH c1, c2, clus, e, g, null AS gene_type "
+        query += "MATCH (clus)-[:part_of]->()-[:has_part]->(sa:Sample:Individual) " \
+                 "OPTIONAL MATCH (sa)-[:part_of]->(sex:Class) " \
+                 "WHERE sex.short_form IN ['FBbt_00007011', 'FBbt_00007004'] " \
+                 "OPTIONAL MATCH (sa)-[:overlaps]->(tis:Class:Anatomy) " \
+                 "OPTIONAL MATCH (clus)-[:has_source]->(ds:DataSet:Individual) " \
+                 "OPTIONAL MATCH (ds)-[:has_reference]->(p:pub:Individual) " \
+                 "OPTIONAL MATCH (ds)-[dbxw:database_cross_reference]->(sw:Site:Individual " \
+                 "{short_form:'scExpressionAtlas'}) " \
+                 "OPTIONAL MATCH (ds)-[dbxd:database_cross_reference]->(sd:Site:Individual " \
+                 "{short_form:'scExpressionAtlasFTP'}) WHERE dbxd.accession[0] = dbxw.accession[0] " \
+                 "RETURN DISTINCT c1.short_form AS query_cell_type_id, c2.label AS cell_type, " \
+                 "c2.short_form AS cell_type_id, " \
+                 "sex.label AS sample_sex, COLLECT(tis.label) AS sample_tissue, " \
+                 "ds.short_form AS dataset_id, p.miniref[0] as ref, " \
+                 "sw.link_base[0] + dbxw.accession[0] AS website_linkout, " \
+                 "sd.link_base[0] + dbxd.accession[0] + sd.postfix[0] AS download_linkout, " \
+                 "g.label AS gene, g.short_form AS gene_id, " \
+                 "apoc.coll.subtract(labels(g), ['Class', 'Entity', 'hasScRNAseq', 'Feature', 'Gene']) AS function, " \
+                 "gene_type, e.expression_extent[0] as extent, toFloat(e.expression_level[0]) as level " \
+                 "ORDER BY query_cell_type_id, cell_type, gene"
+        print(query) if verbose else None
+        dc = []
+        for chunk in chunks(ids, chunk_size):
+            r = self.nc.commit_list([cypher_statement(query, dict(parameters, cell_types=chunk))])
+            if r is False:
+                print("\033[31mError:\033[0m Failed to get transcriptomic profiles for %d cell types starting with %s"
+                      % (len(chunk), chunk[0]))
+                continue
+            dc.extend(dict_cursor(r))
+        print("Found %d expression records for %d cell types" % (len(dc), len(ids))) if verbose else None
+        if return_dataframe:
+            return pd.DataFrame.from_records(dc)
+        return dc
+
+    def _expression_release(self):
+        """Fingerprint of the current release of scRNAseq clusters (number and last short_form), or None."""
+        r = self.nc.commit_list([cypher_statement(
+            "MATCH (c:Cluster:Individual) RETURN count(c), max(c.short_form)")])
+        if not r or not r[0]['data']:
+            return None
+        return "%s:%s" % tuple(r[0]['data'][0]['row'])
+
+    def expression_matrix(self, cell_types, genes=None, value='level', by='cluster', no_subtypes=False,
+                          query_by_label=True, cache=True, force_reload=False, chunk_size=100,
+                          return_dataframe=True, verbose=False):
+        """Get scRNAseq expression of genes in clusters of cells of the given cell types as a (sparse) matrix.
+
+        All expresses edges of the matching clusters are loaded in bulk (chunk_size cell types per query) into
+        sparse cluster x gene matrices of expression level and extent, indexed by cluster and gene ID. Matrices are
+        cached on disk (npz) per set of cell types and genes, and reloaded as long as the scRNAseq clusters are
+        unchanged, for up to three months.
+
+        :param cell_types: A list of IDs, names, or symbols of classes in the Drosophila Anatomy Ontology (FBbt).
+        :param genes: Optional. A list of gene IDs, names or symbols. Default all genes.
+        :param value: Optional. Expression value for the DataFrame, 'level' or 'extent'. Default 'level'.
+        :param by: Optional. DataFrame rows, 'cluster' or 'cell_type' (max over the cell type's clusters). Default 'cluster'.
+        :param no_subtypes: Optional. If `True`, only clusters annotated with exactly the cell types are included and not subtypes. Default `False`.
+        :param query_by_label: Optional. Specify cell types and genes by label if `True` (default) or by ID if `False`.
+        :param cache: Optional. Use (and save) the on-disk cache. Default `True`
+        :param force_reload: Optional. Reload from the PDB even if a cached copy exists. Default `False`
+        :param chunk_size: Optional. Number of cell types per query. Default 100.
+        :param return_dataframe: Optional. Returns a sparse pandas DataFrame (rows x genes) with categorical indices
+            if `True`, otherwise the ExpressionMatrix. Default `True`.
+        :param verbose: Optional. Print progress if `True`.
+        :return: A DataFrame of expression values or the ExpressionMatrix.
+        :rtype: pandas.DataFrame or ExpressionMatrix
+        """
+        cell_types = [cell_types] if isinstance(cell_types, str) else list(cell_types)
+        if query_by_label:
+            cell_types = [self.lookup_id(c) for c in cell_types]
+            genes = None if genes is None else [self.lookup_id(g) for g in genes]
+        cell_types = sorted(set(c for c in cell_types if c))
+        if genes is not None:
+            genes = sorted(set(g for g in genes if g))
+        release = self._expression_release() if cache else None
+        key = hashlib.md5(('%s|%s|%s' % (','.join(cell_types), ','.join(genes) if genes is not None else '*',
+                                         no_subtypes)).encode('utf-8')).hexdigest()
+        path = os.path.join(self.get_cache_dir('expression'), '%s.npz' % key)
+        matrix = None
+        if cache and not force_reload:
+            three_months_in_seconds = 3 * 30 * 24 * 60 * 60
+            try:
+                matrix = ExpressionMatrix.load(path, max_age=three_months_in_seconds, release=release)
+                print("Loaded expression matrix from %s" % path) if verbose and matrix else None
+            except Exception as e:
+                print(f"Failed to load expression matrix from disk: {e}")
+        if matrix is None:
+            matrix = ExpressionMatrix.from_neo(self.nc, cell_types, genes=genes, no_subtypes=no_subtypes,
+                                               chunk_size=chunk_size, release=release, verbose=verbose)
+            if cache:
+                try:
+                    matrix.save(path)
+                except Exception as e:
+                    print(f"Failed to save expression matrix to disk: {e}")
+        print(matrix) if verbose else None
+        if return_dataframe:
+            return matrix.to_dataframe(value=value, by=by)
+        return matrix
+
     def get_neuron_pubs(self, neuron, include_subclasses=True, include_nlp=False,
                         query_by_label=True, verbose=False):
 
@@ -755,7 +1743,7 @@ class VfbConnect:
             cypher_ql.append("MATCH (n:Neuron:Class)<-[:SUBCLASSOF*0..]-(:Class:Neuron)-[r:has_reference]->(pub:Individual)")
         else:
             cypher_ql.append("MATCH (n:Class:Neuron)-[r:has_reference]->(pub:Individual) ")
-        cypher_ql.append("WHERE n.short_form = '%s' AND pub.title is not null " % neuron)
+        cypher_ql.append("WHERE n.short_form = $neuron AND pub.title is not null ")
         if not include_nlp:
             cypher_ql.append("AND NOT (r.typ = 'nlp') ")
         cypher_ql.append("""RETURN distinct r.typ as source, ([]+pub.miniref)[0] as miniref, 
@@ -766,13 +1754,13 @@ class VfbConnect:
         else:
             cypher_ql.append("MATCH (n:Neuron:Class)")
         cypher_ql.append("""-[:INSTANCEOF]-(anoni:Individual)-[ar:part_of]->(ep:Expression_pattern:Class) 
-                         WHERE n.short_form = '%s' AND exists(ar.pub)""" % neuron)
+                         WHERE n.short_form = $neuron AND exists(ar.pub)""")
         cypher_ql.append("MATCH (pub:pub { short_form : ar.pub[0]}) ")
         cypher_ql.append("""RETURN DISTINCT 'exp' as source, ([]+pub.miniref)[0] as miniref,
                         ([]+pub.PMID)[0] as PMID, ([]+pub.DOI)[0] as DOI, ([]+pub.title)[0] as title""")
         cypher_q = ' \n'.join(cypher_ql)
         print(cypher_q) if verbose else None
-        r = self.nc.commit_list([cypher_q])
+        r = self.nc.commit_list([cypher_statement(cypher_q, {'neuron': neuron})])
         if not r:
             warnings.warn("No results returned")
             return False
@@ -864,13 +1852,30 @@ class VfbConnect:
                         new_acc.append(temp_acc)
                     else:
                         new_acc.append(xref.split(':')[-1])
+                else:
+                    new_acc.append(xref)
             acc = new_acc
         if isinstance(acc, list) and all(isinstance(x, int) for x in acc):
             acc = [str(x) for x in acc]
             print(f"Converted to strings: {acc}") if verbose else None
         if db in VFB_DBS_2_SYMBOLS.keys():
             db = VFB_DBS_2_SYMBOLS[db]
-        result = self.neo_query_wrapper.xref_2_vfb_id(acc=acc, db=db, id_type=id_type, reverse_return=reverse_return, verbose=verbose)
+        index = self._xref_indexes.get(db) if acc is not None and not id_type else None
+        if index is not None:
+            # Served from the loaded xref index, falling back to the server for unknown accessions.
+            # Mappings name the DB by the site short_form the index was built from, as the server query does.
+            local = index.vfb_id_mapping(acc)
+            missing = [a for a in acc if a not in local]
+            print(f"Mapped {len(local)} accessions locally, querying {len(missing)}") if verbose else None
+            result = self.neo_query_wrapper.xref_2_vfb_id(acc=missing, db=db, reverse_return=reverse_return, verbose=verbose) if missing else {}
+            for a, ids in local.items():
+                if reverse_return:
+                    for id in ids:
+                        result.setdefault(id, []).append({'db': index.db, 'acc': a})
+                else:
+                    result[a] = [{'db': index.db, 'vfb_id': id} for id in ids]
+        else:
+            result = self.neo_query_wrapper.xref_2_vfb_id(acc=acc, db=db, id_type=id_type, reverse_return=reverse_return, verbose=verbose)
         print(result) if verbose else None
         if return_just_ids & reverse_return:
             return [x.key for x in result]
@@ -944,7 +1949,15 @@ class VfbConnect:
         if db in VFB_DBS_2_SYMBOLS.keys():
             db = VFB_DBS_2_SYMBOLS[db]
         print(f"vfb_id_2_xrefs: {vfb_id}, {db}, {id_type}, {reverse_return}") if verbose else None
-        result = self.neo_query_wrapper.vfb_id_2_xrefs(vfb_id=vfb_id, db=db, id_type=id_type, reverse_return=False, verbose=verbose, datasource_only=datasource_only)
+        index = self._xref_indexes.get(db) if not id_type else None
+        if index is not None:
+            # Served from the loaded xref index, falling back to the server for unknown IDs
+            local = index.accession_mapping(vfb_id)
+            missing = [id for id in vfb_id if id not in local]
+            result = self.neo_query_wrapper.vfb_id_2_xrefs(vfb_id=missing, db=db, reverse_return=False, verbose=verbose, datasource_only=datasource_only) if missing else {}
+            result.update({id: [{'db': index.db, 'acc': a} for a in accs] for id, accs in local.items()})
+        else:
+            result = self.neo_query_wrapper.vfb_id_2_xrefs(vfb_id=vfb_id, db=db, id_type=id_type, reverse_return=False, verbose=verbose, datasource_only=datasource_only)
         print(f"Returned: {result}") if verbose else None
         rl = {}
         if reverse_return:
@@ -965,6 +1978,57 @@ class VfbConnect:
         print(rl) if verbose else None
         return rl
 
+    def _xref_release(self, db):
+        """Fingerprint of the current release of a data source's cross references (number and last short_form), or None."""
+        r = self.nc.commit_list([cypher_statement(
+            "MATCH (s:Individual {short_form: $db})<-[r:database_cross_reference]-(i:Entity) "
+            "RETURN count(r), max(i.short_form)", {'db': db})])
+        if not r or not r[0]['data']:
+            return None
+        return "%s:%s" % tuple(r[0]['data'][0]['row'])
+
+    def xref_index(self, db, cache=True, force_reload=False, page_size=50000, verbose=False):
+        """Load all cross references of an external DB (data source) into a local index.
+
+        The accession <-> VFB ID pairs are exported in one paged pass into sorted arrays, so that whole lists of IDs
+        are mapped in either direction by binary search. Once loaded, xref_2_vfb_id, vfb_id_2_xrefs and lookup_id
+        ('db:acc' keys) use the index for this DB, querying the server only for IDs it does not contain. Indexes are
+        cached on disk (memory-mapped .npy files) and reloaded as long as the DB's cross references are unchanged,
+        for up to three months.
+
+        :param db: The VFB id (short_form) or symbol of an external DB (use get_dbs to find options), e.g. 'FlyEM-HB'.
+        :param cache: Optional. Use (and save) the on-disk cache. Default `True`
+        :param force_reload: Optional. Reload from the PDB even if a cached copy exists. Default `False`
+        :param page_size: Optional. Number of VFB entities per query. Default 50000.
+        :param verbose: Optional. Print progress if `True`.
+        :return: The XrefIndex.
+        :rtype: XrefIndex
+        """
+        if db in VFB_DBS_2_SYMBOLS.keys():
+            db = VFB_DBS_2_SYMBOLS[db]
+        release = self._xref_release(db) if cache else None
+        path = os.path.join(self.get_cache_dir('xrefs'), db)
+        index = None
+        if cache and not force_reload:
+            three_months_in_seconds = 3 * 30 * 24 * 60 * 60
+            try:
+                index = XrefIndex.load(path, max_age=three_months_in_seconds, release=release)
+                print("Loaded xref index from %s" % path) if verbose and index else None
+            except Exception as e:
+                print(f"Failed to load xref index from disk: {e}")
+        if index is None:
+            index = XrefIndex.from_neo(self.nc, db, page_size=page_size, release=release, verbose=verbose)
+            if not len(index):
+                print(f"\033[33mWarning:\033[0m No cross references found for {db}")
+            if cache:
+                try:
+                    index.save(path)
+                except Exception as e:
+                    print(f"Failed to save xref index to disk: {e}")
+        print(index) if verbose else None
+        self._xref_indexes[db] = index
+        return index
+
     def get_dbs(self, include_symbols=True, data_sources_only=True, verbose=False):
         """Get all external databases in the database, optionally filtering by data sources and including symbols.
 
@@ -1037,9 +2101,8 @@ class VfbConnect:
             return None
         if query_by_label:
             id = self.lookup_id(id)
-        qs = Template(query).substitute(ID=id)
-        print(f"Running query: {qs}") if verbose else None
-        r = self.nc.commit_list([qs])
+        print(f"Running query: {query} with ids: {[id]}") if verbose else None
+        r = self.nc.commit_list([cypher_statement(query, {'ids': [id]})])
         dc = dict_cursor(r)
         print(dc) if verbose else None
         if return_id_only:
@@ -1079,9 +2142,8 @@ class VfbConnect:
                 cluster_id = cluster
         if not cluster_id:
             raise ValueError("Cluster ID not matched for %s" % cluster)
-        qs = Template(query).substitute(ID=cluster_id)
-        print(f"Running query: {qs}") if verbose else None
-        r = self.nc.commit_list([qs])
+        print(f"Running query: {query} with ids: {[cluster_id]}") if verbose else None
+        r = self.nc.commit_list([cypher_statement(query, {'ids': [cluster_id]})])
         dc = dict_cursor(r)
         if return_id_only:
             return [d.get('gene',{}).get('short_form', None) for d in dc if d.get('gene',{}).get('short_form', None)]
@@ -1177,17 +2239,18 @@ class VfbConnect:
             return self.terms(ids, verbose=verbose).get_summaries(return_dataframe=return_dataframe)
         return self.terms(ids, verbose=verbose)
 
-    def cypher_query(self, query, return_dataframe=True, verbose=False):
+    def cypher_query(self, query, return_dataframe=True, verbose=False, parameters=None):
         """
         Run a Cypher query.
 
         :param query: The Cypher query to run.
         :param return_dataframe: Optional. Returns pandas DataFrame if `True`, otherwise returns list of dicts. Default `True`.
+        :param parameters: Optional. Dict of values for $name parameters in the query, e.g. {'ids': ['FBbt_00003748']}.
         :return: A DataFrame or list of results.
         :rtype: pandas.DataFrame or list of dicts
         """
         print(f"Running query: {query}") if verbose else None
-        r = self.nc.commit_list([query])
+        r = self.nc.commit_list([cypher_statement(query, parameters)])
         print(r) if verbose else None
         dc = dict_cursor(r)
         print(dc) if verbose else None
@@ -1204,39 +2267,69 @@ class VfbConnect:
         :return: A DataFrame.
         :rtype: pandas.DataFrame
         """
-        input_id = self.lookup_id(term)
-        # check input type
-        type_results = self.cypher_query(
-            query="MATCH (n:Neuron {short_form:'%s'}) RETURN labels(n) AS labels" % input_id)
-        input_labels = type_results.labels[0]
-
-        def get_instance_predicted_nts(nt_search_ids, verbose=False):
-            results = self.cypher_query(query="""
-            MATCH (i:Individual:Neuron)-[c:capable_of]->(nt) 
-            WHERE EXISTS(c.confidence_value) 
-            AND i.short_form IN %s
-            RETURN i.label AS individual, i.short_form AS individual_id, labels(i) AS instance_labels, 
-            nt.label AS predicted_nt, c.confidence_value[0] AS confidence, c.database_cross_reference AS references
-            """ % nt_search_ids)
-            if results.empty:
-                print(f"No predicted neurotransmitters found for {nt_search_ids}.") if verbose else None
-            else:
-                results['all_nts'] = results['instance_labels'].apply(
-                    lambda x: [l for l in x if l in NT_NTR_pairs.keys()])  # needed by get_nt_receptors_in_downstream_neurons
-                results = results.drop('instance_labels', axis=1)
-            return results
-
-        if 'Individual' in input_labels:
-            output = get_instance_predicted_nts([input_id], verbose=verbose)
-        elif 'Class' in input_labels:
-            instances = self.get_instances(input_id, query_by_label=False)
-            instance_ids = instances['id'].to_list()
-            output = get_instance_predicted_nts(instance_ids, verbose=verbose)
-
+        output = self.get_nt_predictions_bulk([term], verbose=verbose).drop(columns='term_id')
         if output.empty:
             print(f"No predicted neurotransmitters found for {term}.") if verbose else None
         return output
 
+    def get_nt_predictions_bulk(self, terms, query_by_label=True, chunk_size=1000, return_dataframe=True, verbose=False):
+        """
+        Find predicted neurotransmitter(s) for many neurons and/or all neurons of many types.
+
+        Terms are checked in chunked queries, instances of all classes are resolved as IDs only in one batch (see
+        OWLeryConnect.query_many; from the local closure index if loaded), and the predictions of all instances are
+        then queried together in chunks.
+
+        :param terms: A list of IDs, names, or symbols of neuron classes (FBbt) or individual neurons, or a VFBTerms object.
+        :param query_by_label: Optional. Specify terms by label if `True` (default) or by ID if `False`.
+        :param chunk_size: Optional. Number of terms or neurons per query. Default 1000.
+        :param return_dataframe: Optional. Returns pandas DataFrame if `True`, otherwise returns list of dicts. Default `True`.
+        :return: A DataFrame or list with a row per term (term_id) and predicted neurotransmitter of each of its neurons
+            (individual, individual_id, predicted_nt, confidence, references) and all_nts, the known neurotransmitters
+            of the neuron.
+        :rtype: pandas.DataFrame or list of dicts
+        """
+        columns = ['term_id', 'individual', 'individual_id', 'predicted_nt', 'confidence', 'references', 'all_nts']
+        ids = self._neuron_ids(terms, query_by_label=query_by_label)
+        pairs = []
+        classes = []
+        for chunk in chunks(ids, chunk_size):
+            r = self.nc.commit_list([cypher_statement(
+                "UNWIND $ids AS id MATCH (n:Neuron {short_form: id}) RETURN n.short_form, 'Individual' IN labels(n)",
+                {'ids': chunk})])
+            if r is False:
+                raise ValueError("Failed to check terms starting with %s" % chunk[0])
+            for id, is_individual in (d['row'] for d in r[0]['data']):
+                if is_individual:
+                    pairs.append((id, id))
+                else:
+                    classes.append(id)
+        if classes:
+            # Instances of all classes in one concurrent batch (answered locally if a closure index is loaded)
+            instances = self.oc.query_many([id.replace('_', ':') for id in classes], query_type='instances',
+                                           query_by_label=False, verbose=verbose)
+            pairs.extend((id, i) for id in classes for i in instances[id.replace('_', ':')])
+        pairs = pd.DataFrame.from_records(pairs, columns=['term_id', 'individual_id'])
+        print("Found %d neurons for %d terms" % (len(pairs), len(ids))) if verbose else None
+        query = "UNWIND $ids AS id " \
+                "MATCH (i:Individual:Neuron {short_form: id})-[c:capable_of]->(nt) " \
+                "WHERE EXISTS(c.confidence_value) " \
+                "RETURN i.label AS individual, i.short_form AS individual_id, nt.label AS predicted_nt, " \
+                "c.confidence_value[0] AS confidence, c.database_cross_reference AS references, " \
+                "[l IN labels(i) WHERE l IN $nts] AS all_nts"  # all_nts needed by get_nt_receptors_in_downstream_neurons
+        dc = []
+        for chunk in chunks(pairs['individual_id'].unique().tolist(), chunk_size):
+            r = self.nc.commit_list([cypher_statement(query, {'ids': chunk, 'nts': list(NT_NTR_pairs.keys())})])
+            if r is False:
+                raise ValueError("Failed to get neurotransmitter predictions for neurons starting with %s" % chunk[0])
+            dc.extend(dict_cursor(r))
+        predictions = pd.DataFrame.from_records(dc, columns=columns[1:])
+        output = pairs.merge(predictions, on='individual_id')[columns]
+        print("Found %d predictions for %d terms" % (len(output), output['term_id'].nunique())) if verbose else None
+        if return_dataframe:
+            return output
+        return output.to_dict('records')
+
     def get_nt_receptors_in_downstream_neurons(self, upstream_type, downstream_type='neuron', weight=0, use_predictions=True, return_dataframe=True, verbose=False):
         """
         Get neurotransmitter receptors in downstream neurons of a given neuron type.
@@ -1256,23 +2349,15 @@ class VfbConnect:
         upstream_type = self.lookup_id(upstream_type)
         downstream_type = self.lookup_id(downstream_type)
 
-        # get all types of all connected neurons that are instances of downstream_type
-        downstream = self.get_connected_neurons_by_type(upstream_type=upstream_type, downstream_type=downstream_type, weight=weight)
-        downstream['downstream_class'] = downstream['downstream_class'].apply(
-            lambda x: x.split('|') if isinstance(x, str) else x)
-        downstream_classes = downstream.explode('downstream_class')['downstream_class'].drop_duplicates().to_list()
-
-        # only keep downstream_classes that are subclasses of downstream_type
-        subclass_check_query = self.cypher_query(
-            query=("MATCH (c2:Neuron:Class)-[:SUBCLASSOF*0..]->(c1:Neuron:Class) "
-                   "WHERE c2.label IN %s AND c1.short_form = '%s'"
-                   "RETURN c2.label AS downstream_classes"
-                    % (downstream_classes, downstream_type)))
-        downstream_classes = subclass_check_query.downstream_classes.to_list()
+        # get all types of connected neurons that are subclasses of downstream_type
+        downstream = self.get_connectivity_by_type(upstream_type=upstream_type, downstream_type=downstream_type,
+                                                   weight=weight, query_by_label=False)
+        downstream_classes = downstream['downstream_class_id'].drop_duplicates().to_list()
 
         # get nts for upstream
         cell_type_short_form = self.lookup_id(upstream_type)
-        known_nt_results = self.cypher_query(query="MATCH (n:Neuron {short_form:'%s'}) RETURN labels(n) AS labels" % cell_type_short_form)
+        known_nt_results = self.cypher_query(query="MATCH (n:Neuron {short_form: $id}) RETURN labels(n) AS labels",
+                                             parameters={'id': cell_type_short_form})
         nts = [r for r in known_nt_results.labels[0] if r in NT_NTR_pairs.keys()]
         if use_predictions:
             predicted_nt_results = self.get_nt_predictions(upstream_type)
@@ -1285,29 +2370,25 @@ class VfbConnect:
 
         print(nts) if verbose else None
         if nts:
-            ntr = [NT_NTR_pairs[n] for n in nts]
+            ntr = list(dict.fromkeys(NT_NTR_pairs[n] for n in nts))
         elif not use_predictions:
             print(f"No known neurotransmitters for {upstream_type}, try setting use_predictions=True")
         else:
             print(f"No known or predicted neurotransmitters for {upstream_type}")
-
+        if not nts or not downstream_classes:
+            return pd.DataFrame() if return_dataframe else []
+
+        # get expression for every ntr in every downstream class in one batched query
+        # only exact match classes (no_subtypes=True)
+        # to avoid specific-looking results based on general typing of connectomics data
+        receptor_expression = self.get_transcriptomic_profiles(downstream_classes, gene_types=ntr, no_subtypes=True,
+                                                               query_by_label=False, verbose=verbose)
+        if receptor_expression.empty:
+            return receptor_expression if return_dataframe else []
+        receptor_expression = receptor_expression.drop(columns='query_cell_type_id')
         if use_predictions:
             pred_only_ntrs = [NT_NTR_pairs[n] for n in pred_only_nts]
-
-        # get expression for each ntr in each downstream class
-        dataframes = []
-        for c in downstream_classes:
-            for n in ntr:
-                # only exact match classes (no_subtypes=True)
-                # to avoid specific-looking results based on general typing of connectomics data
-                df = self.get_transcriptomic_profile(c, gene_type=n, no_subtypes=True)
-                if use_predictions:
-                    if n in pred_only_ntrs:
-                        df['nt_only_predicted'] = True
-                    else:
-                        df['nt_only_predicted'] = False
-                dataframes.append(df)
-        receptor_expression = pd.concat(dataframes, ignore_index=True)
+            receptor_expression['nt_only_predicted'] = receptor_expression['gene_type'].isin(pred_only_ntrs)
         if not return_dataframe:
             return receptor_expression.to_dict('records')
         return receptor_expression
@@ -1315,23 +2396,20 @@ class VfbConnect:
     import json
 
 
-    def search(self, query, return_dataframe=True, verbose=False, filter_by_has_tag=None, filter_by_not_tag=['Deprecated']):
-        """
-        Search for terms in the database using a complex Solr query configuration.
-
-        :param query: The search query.
-        :param return_dataframe: Optional. Returns pandas DataFrame if `True`, otherwise returns list of dicts. Default `True`.
-        :param verbose: Optional. If `True`, prints the query for debugging purposes.
-        :param filter_by_has_tag: Optional. List of tags to boost if present. These will be upvoted in the query.
-        :param filter_by_not_tag: Optional. List of tags to downvote if present. These will be downvoted in the query.
-        :return: A DataFrame or list of results.
-        :rtype: pandas.DataFrame or list of dicts
-        """
-        import pysolr
-
-        # Initialize the Solr client
-        solr = pysolr.Solr(self.solr_url, always_commit=True)
-
+    @property
+    def solr(self):
+        """Persistent SOLR client for search, reusing a pooled HTTP session across calls."""
+        if self._solr is None or self._solr.url != self.solr_url:
+            import pysolr
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._solr = pysolr.Solr(self.solr_url, always_commit=False, session=session)
+        return self._solr
+
+    def _search_params(self, query, filter_by_has_tag=None, filter_by_not_tag=['Deprecated'], fl=None):
+        """SOLR parameters for a search (see search)."""
         # Base search parameters
         search_params = {
             "q": f"({query} OR {query}* OR *{query} OR *{query}*)",
@@ -1339,7 +2417,7 @@ class VfbConnect:
             "defType": "edismax",
             "mm": "45%",
             "qf": "label^110 synonym^100 label_autosuggest synonym_autosuggest shortform_autosuggest",
-            "fl": "short_form,label,synonym,id,facets_annotation,unique_facets",
+            "fl": ",".join(SEARCH_FIELDS),
             "start": "0",
             "pf": "true",
             "fq": [
@@ -1360,20 +2438,102 @@ class VfbConnect:
             for tag in filter_by_not_tag:
                 search_params["bq"] += f" facets_annotation:{tag}^0.001"
 
-        # Convert the search parameters to JSON string for debugging
-        search_json = json.dumps({"params": search_params})
-        
+        if fl:
+            search_params["fl"] = fl if isinstance(fl, str) else ",".join(fl)
+        return search_params
+
+    def iter_search(self, query, fl=None, limit=None, page_size=150, filter_by_has_tag=None, filter_by_not_tag=['Deprecated'], verbose=False):
+        """
+        Stream search results (see search) page by page.
+
+        Result sets larger than one page are walked with SOLR cursorMark deep paging, so only one page is held at a time.
+
+        :param query: The search query.
+        :param fl: Optional. Fields to return, as a list or comma separated string. Default: short_form, label, synonym, id, facets_annotation, unique_facets.
+        :param limit: Optional. Maximum number of results. Default `None` (all results).
+        :param page_size: Optional. Number of results requested per page. Default 150.
+        :param filter_by_has_tag: Optional. List of tags to boost if present.
+        :param filter_by_not_tag: Optional. List of tags to downvote if present.
+        :param verbose: Optional. If `True`, prints the query and paging progress.
+        :return: Generator of result dicts.
+        """
+        search_params = self._search_params(query, filter_by_has_tag=filter_by_has_tag, filter_by_not_tag=filter_by_not_tag, fl=fl)
+        search_params["rows"] = str(min(page_size, limit) if limit else page_size)
+        cursor = None
+        if not limit or limit > page_size:
+            # Deep paging needs a stable sort ending on the unique key
+            search_params["sort"] = "score desc,id asc"
+            cursor = "*"
         if verbose:
-            print(f"Solr Search JSON: {search_json}")
+            print(f"Solr Search JSON: {json.dumps({'params': search_params})}")
+        returned = 0
+        while True:
+            if cursor:
+                search_params["cursorMark"] = cursor
+            results = self.neo_query_wrapper.solr_retry_policy.call(self.solr.search, **search_params)
+            docs = results.docs[:limit - returned] if limit else results.docs
+            for doc in docs:
+                yield doc
+            returned += len(docs)
+            print(f"Got {returned} of {results.hits} results") if verbose else None
+            next_cursor = getattr(results, 'nextCursorMark', None)
+            if not cursor or not docs or (limit and returned >= limit) or not next_cursor or next_cursor == cursor:
+                return
+            cursor = next_cursor
+
+    def search(self, query, return_dataframe=True, verbose=False, filter_by_has_tag=None, filter_by_not_tag=['Deprecated'],
+               fl=None, limit=150, page_size=150, cache=True, backend='solr'):
+        """
+        Search for terms in the database using a complex Solr query configuration.
+
+        Searches share one pooled SOLR client, and identical searches within `search_cache_ttl` seconds (default 60)
+        are answered from a small in memory cache, so repeated calls (e.g. autocomplete) are cheap.
 
-        # Execute the search
-        results = solr.search(**search_params)
+        :param query: The search query.
+        :param return_dataframe: Optional. Returns pandas DataFrame if `True`, otherwise returns list of dicts. Default `True`.
+        :param verbose: Optional. If `True`, prints the query for debugging purposes.
+        :param filter_by_has_tag: Optional. List of tags to boost if present. These will be upvoted in the query.
+        :param filter_by_not_tag: Optional. List of tags to downvote if present. These will be downvoted in the query.
+        :param fl: Optional. Fields to return, as a list or comma separated string. Default: short_form, label, synonym, id, facets_annotation, unique_facets.
+        :param limit: Optional. Maximum number of results; `None` pages through all results (see iter_search). Default 150.
+        :param page_size: Optional. Number of results requested per page. Default 150.
+        :param cache: Optional. Use the short lived search cache if `True` (default).
+        :param backend: Optional. 'solr' (default) or 'local' to search the in process index (see load_search_index),
+            which matches labels, synonyms and short_forms with the same boosting but without any network access.
+        :return: A DataFrame or list of results.
+        :rtype: pandas.DataFrame or list of dicts
+        """
+        if backend == 'local':
+            index = self._search_index if self._search_index is not None else self.load_search_index(verbose=verbose)
+            docs = index.search(query, limit=limit, filter_by_has_tag=filter_by_has_tag, filter_by_not_tag=filter_by_not_tag, fl=fl)
+            return pd.DataFrame(docs) if return_dataframe else docs
+        if backend != 'solr':
+            raise ValueError("Unknown search backend '%s'. Options: solr, local" % backend)
+        key = json.dumps([query, filter_by_has_tag, filter_by_not_tag, fl, limit, page_size], default=str)
+        docs = None
+        if cache and self.search_cache_ttl:
+            with self._search_cache_lock:
+                entry = self._search_cache.get(key)
+                if entry is not None and time.time() - entry[0] <= self.search_cache_ttl:
+                    self._search_cache.move_to_end(key)
+                    docs = list(entry[1])
+                    print("Using cached search results.") if verbose else None
+        if docs is None:
+            docs = list(self.iter_search(query, fl=fl, limit=limit, page_size=page_size, filter_by_has_tag=filter_by_has_tag,
+                                         filter_by_not_tag=filter_by_not_tag, verbose=verbose))
+            if cache and self.search_cache_ttl:
+                with self._search_cache_lock:
+                    self._search_cache[key] = (time.time(), docs)
+                    self._search_cache.move_to_end(key)
+                    while len(self._search_cache) > self.search_cache_size:
+                        self._search_cache.popitem(last=False)
+                docs = list(docs)
 
         # Return results as a DataFrame or list of dictionaries
         if return_dataframe:
-            return pd.DataFrame(results.docs)
+            return pd.DataFrame(docs)
         else:
-            return results.docs
+            return docs
 
 
     def term(self, term, verbose=False):
@@ -1405,52 +2565,57 @@ class VfbConnect:
         print(terms) if verbose else None
         return VFBTerms(terms, verbose=verbose)
 
-    def generate_lab_colors(self, num_colors, min_distance=100, verbose=False):
+    def generate_lab_colors(self, num_colors, min_distance=None, verbose=False):
         """
         Generate a list of Lab colors and convert them to RGB tuples.
 
+        Colours are picked by greedy farthest-point sampling over a grid of candidate Lab colours, starting away
+        from black and white, so each new colour is the candidate furthest from all colours already chosen. Only
+        candidates inside the sRGB gamut are used, so every colour returned is distinct. Palettes are memoised by
+        num_colors.
+
         :param num_colors: The number of colors to generate.
-        :param min_distance: Minimum perceptual distance between colors.
+        :param min_distance: Deprecated and ignored. Colours are always spread as far apart as the number requested
+            allows.
         :return: A list of RGB tuples.
         """
-        # Generate a large set of candidate colors in Lab space
-        grid_size = int(np.ceil((num_colors * 5) ** (1 / 3)))  # Generating more candidates
-        l_values = np.linspace(0, 100, grid_size)
-        a_values = np.linspace(-100, 100, grid_size)
-        b_values = np.linspace(-100, 100, grid_size)
-
-        lab_colors = np.array(np.meshgrid(l_values, a_values, b_values)).T.reshape(-1, 3)
-
-        # Shuffle the candidate colors to introduce randomness
-        np.random.shuffle(lab_colors)
-
-        selected_lab_colors = []
-        rgb_colors = []
-
-        # Select the first color
-        lab_tree = KDTree([(255,255,255),(0, 0, 0)])  # Start tree with black and white
-
-        # Pick colors that are far apart from each other and from black
-        for lab in lab_colors[0:]:
-            distances, _ = lab_tree.query([lab], k=1)
-            if distances[0] >= min_distance:
-                selected_lab_colors.append(lab)
-                lab_tree = KDTree(selected_lab_colors)  # Update tree with the new color
-            if len(selected_lab_colors) >= num_colors:
+        if min_distance is not None:
+            print("\033[33mWarning:\033[0m min_distance is deprecated and ignored; colours are always spread as far apart as possible.")
+        if num_colors in self._palette_cache:
+            print(f"Using cached palette for {num_colors} colors") if verbose else None
+            return list(self._palette_cache[num_colors])
+
+        # Generate a large set of candidate colors in Lab space, keeping those that are inside the sRGB gamut
+        # (others clamp to the same RGB colours) and have distinct 8 bit RGB values
+        grid_size = max(int(np.ceil((num_colors * 25) ** (1 / 3))), 4)  # Generating more candidates
+        while True:
+            l_values = np.linspace(0, 100, grid_size)
+            a_values = np.linspace(-100, 100, grid_size)
+            b_values = np.linspace(-100, 100, grid_size)
+            lab_colors = np.array(np.meshgrid(l_values, a_values, b_values)).T.reshape(-1, 3)
+            linear = _lab_to_linear_rgb(lab_colors)
+            lab_colors = lab_colors[np.all((linear > -1e-6) & (linear < 1 + 1e-6), axis=1)]
+            _, first = np.unique(np.array(lab_to_rgb(lab_colors)).reshape(-1, 3), axis=0, return_index=True)
+            lab_colors = lab_colors[np.sort(first)]
+            if len(lab_colors) >= num_colors * 5 or grid_size >= 64:
                 break
+            grid_size = min(int(grid_size * 1.5) + 1, 64)
+
+        # Distance from each candidate to the closest chosen colour, starting with black and white
+        anchors = np.array([(0, 0, 0), (100, 0, 0)])
+        nearest = np.min(np.linalg.norm(lab_colors[:, None, :] - anchors[None, :, :], axis=2), axis=1)
+        selected = []
+        for _ in range(min(num_colors, len(lab_colors))):
+            index = int(np.argmax(nearest))
+            selected.append(index)
+            nearest = np.minimum(nearest, np.linalg.norm(lab_colors - lab_colors[index], axis=1))
 
-        # Convert Lab to RGB
-        for lab in selected_lab_colors:
-            lab_color = LabColor(lab[0], lab[1], lab[2])
-            rgb_color = convert_color(lab_color, sRGBColor)
-            rgb_tuple = (int(round(rgb_color.clamped_rgb_r * 255)),
-                         int(round(rgb_color.clamped_rgb_g * 255)),
-                         int(round(rgb_color.clamped_rgb_b * 255)))
-            rgb_colors.append(rgb_tuple)
+        rgb_colors = lab_to_rgb(lab_colors[selected]) if selected else []
+        self._palette_cache[num_colors] = rgb_colors
 
         if verbose:
             print(f"Generated RGB colors: {rgb_colors}")
 
-        return rgb_colors
+        return list(rgb_colors)
 
       
\ No newline at end of file
@@ -0,0 +1,476 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from .neo4j_tools import chunks, cypher_statement
+
+PARTNER_COLUMNS = ['query_neuron_id', 'query_neuron_name', 'partner_neuron_id', 'partner_neuron_name', 'weight']
+PATH_COLUMNS = ['source_id', 'source_name', 'target_id', 'target_name', 'hops', 'path', 'path_names', 'weights',
+                'min_weight', 'cost']
+
+
+def encode_strings(strings):
+    """Pack a list of strings (without newlines) into a uint8 array for saving in an npz archive."""
+    return np.frombuffer('\n'.join(strings).encode('utf-8'), dtype=np.uint8)
+
+
+def decode_strings(array, n):
+    """Unpack n strings packed with encode_strings."""
+    return array.tobytes().decode('utf-8').split('\n') if n else []
+
+
+class ConnectivityMatrix:
+
+    """Neuron to neuron connectivity (synapsed_to weights) held locally as a sparse matrix.
+
+    Rows are upstream and columns downstream neurons, so a row holds a neuron's downstream partners and a column its
+    upstream partners; both are read in time proportional to the number of partners. Neuron IDs are mapped to
+    row/column positions by index.
+
+        :param ids: Sequence of neuron short_forms; positions in this list are used in the edge arrays.
+        :param labels: Sequence of neuron labels (same order as ids).
+        :param upstream: Integer array of upstream neuron positions, one per edge.
+        :param downstream: Integer array of downstream neuron positions, one per edge.
+        :param weights: Array of synapse counts, one per edge.
+        :param dataset: Optional. short_form of the dataset the matrix was built for.
+        :param min_weight: Optional. Minimum weight used when loading edges.
+        :param members: Optional. Boolean array marking the neurons whose outgoing connections (>= min_weight) were
+            all loaded, i.e. a dataset's own neurons rather than their partners outside it.
+        :param release: Optional. Identifier of the data release the matrix was built from.
+        :param timestamp: Time the matrix was built (seconds since the epoch)."""
+
+    def __init__(self, ids, labels, upstream, downstream, weights, dataset=None, min_weight=0, members=None,
+                 release=None, timestamp=None):
+        self.ids = list(ids)
+        self.labels = [label if label else '' for label in labels]
+        self.index = {id: i for i, id in enumerate(self.ids)}
+        self.dataset = dataset
+        self.min_weight = min_weight
+        self.members = np.asarray(members, dtype=bool) if members is not None else None
+        self.release = release
+        self.timestamp = timestamp if timestamp else time.time()
+        n = len(self.ids)
+        self.matrix = csr_matrix((np.asarray(weights, dtype=np.int32),
+                                  (np.asarray(upstream, dtype=np.int32), np.asarray(downstream, dtype=np.int32))),
+                                 shape=(n, n))
+        self._csc = None
+
+    @classmethod
+    def _from_rows(cls, rows, labels, members=None, **kwargs):
+        """Build from (upstream id, downstream id, weight) rows, a dict of id: label and optionally the set of
+        ids whose outgoing connections were all loaded."""
+        index = {}
+        for id in labels:
+            index.setdefault(id, len(index))
+        edges = np.array([[index.setdefault(up, len(index)), index.setdefault(down, len(index)), w]
+                          for up, down, w in rows], dtype=np.int64).reshape(-1, 3)
+        ids = list(index.keys())
+        if members is not None:
+            kwargs['members'] = [id in members for id in ids]
+        return cls(ids, [labels.get(id, '') for id in ids], edges[:, 0], edges[:, 1], edges[:, 2], **kwargs)
+
+    @classmethod
+    def from_neo(cls, nc, neurons=None, dataset=None, weight=0, page_size=5000, release=None, verbose=False):
+        """Load the synapsed_to edges of a dataset (or between a set of neurons) from a VFB neo4j (PDB) connection.
+
+        For a dataset, the dataset's neurons are paged through in short_form order and all their outgoing edges
+        loaded. For a list of neurons only the edges between them are loaded, page_size neurons per query.
+
+        :param nc: A Neo4jConnect object.
+        :param neurons: List of neuron short_forms. Either neurons or dataset must be given.
+        :param dataset: short_form of a dataset.
+        :param weight: Optional. Minimum weight of connections to load. Default 0.
+        :param page_size: Optional. Number of (upstream) neurons per query. Default 5000.
+        :param release: Optional. Release identifier to record with the matrix.
+        :param verbose: Print progress if `True`.
+        :return: ConnectivityMatrix
+        """
+        if neurons is None and dataset is None:
+            raise ValueError("Either neurons or dataset must be specified.")
+        rows = []
+        labels = {}
+        members = None
+        print("Loading connectivity from %s..." % nc.base_uri) if verbose else None
+        if dataset is not None:
+            # The same statement is sent for every page so the server plans it once
+            query = "MATCH (ds:DataSet)<-[:has_source]-(n1:has_neuron_connectivity) " \
+                    "WHERE ds.short_form = $dataset AND n1.short_form > $last_neuron " \
+                    "WITH n1 ORDER BY n1.short_form LIMIT $page_size " \
+                    "OPTIONAL MATCH (n1)-[r:synapsed_to]->(n2:has_neuron_connectivity) WHERE r.weight[0] >= $weight " \
+                    "RETURN n1.short_form, n1.label, n2.short_form, r.weight[0]"
+            last = ''
+            while True:
+                r = nc.commit_list([cypher_statement(query, {'dataset': dataset, 'last_neuron': last,
+                                                             'page_size': page_size, 'weight': weight})])
+                if r is False:
+                    raise ValueError("Failed to load connectivity for %s after %s" % (dataset, last))
+                page = [d['row'] for d in r[0]['data']]
+                if not page:
+                    break
+                for up, label, down, w in page:
+                    labels[up] = label
+                    if down is not None:
+                        rows.append((up, down, w))
+                last = max(row[0] for row in page)
+                print("Loaded %d edges for %d neurons" % (len(rows), len(labels))) if verbose else None
+                if len(set(row[0] for row in page)) < page_size:
+                    break
+            members = set(labels)
+            # Partners outside the dataset
+            missing = list(set(row[1] for row in rows) - set(labels))
+            for chunk in chunks(missing, page_size):
+                r = nc.commit_list([cypher_statement("UNWIND $ids AS id MATCH (n:Neuron {short_form: id}) "
+                                                     "RETURN n.short_form, n.label", {'ids': chunk})])
+                if r:
+                    labels.update((d['row'][0], d['row'][1]) for d in r[0]['data'])
+        else:
+            neurons = list(dict.fromkeys(neurons))
+            query = "UNWIND $chunk AS id MATCH (n1:Neuron {short_form: id}) " \
+                    "OPTIONAL MATCH (n1)-[r:synapsed_to]->(n2:Neuron) " \
+                    "WHERE r.weight[0] >= $weight AND n2.short_form IN $neurons " \
+                    "RETURN n1.short_form, n1.label, n2.short_form, r.weight[0]"
+            for chunk in chunks(neurons, page_size):
+                r = nc.commit_list([cypher_statement(query, {'chunk': chunk, 'neurons': neurons, 'weight': weight})])
+                if r is False:
+                    raise ValueError("Failed to load connectivity for neurons starting with %s" % chunk[0])
+                for up, label, down, w in (d['row'] for d in r[0]['data']):
+                    labels[up] = label
+                    if down is not None:
+                        rows.append((up, down, w))
+                print("Loaded %d edges for %d neurons" % (len(rows), len(labels))) if verbose else None
+        return cls._from_rows(rows, labels, members=members, dataset=dataset, min_weight=weight, release=release)
+
+    @classmethod
+    def from_dataframe(cls, df, upstream='upstream_neuron_id', downstream='downstream_neuron_id', weight='weight',
+                       labels=None):
+        """Build from an edge list, e.g. the output of get_connected_neurons_by_type or an export_connectivity file.
+
+        :param df: DataFrame with a row per connection.
+        :param upstream: Optional. Column of upstream neuron IDs. Default 'upstream_neuron_id'
+        :param downstream: Optional. Column of downstream neuron IDs. Default 'downstream_neuron_id'
+        :param weight: Optional. Column of weights. Default 'weight'
+        :param labels: Optional. dict of neuron ID: label.
+        :return: ConnectivityMatrix
+        """
+        rows = zip(df[upstream].astype(str), df[downstream].astype(str), df[weight])
+        return cls._from_rows(rows, dict(labels) if labels else {})
+
+    def save(self, path):
+        """Save the matrix as a compressed numpy archive.
+
+        :param path: File path (.npz).
+        """
+        m = self.matrix
+        np.savez_compressed(path,
+                            ids=encode_strings(self.ids),
+                            labels=encode_strings(self.labels),
+                            n=len(self.ids),
+                            indptr=m.indptr, indices=m.indices, data=m.data,
+                            dataset=self.dataset if self.dataset else '',
+                            min_weight=self.min_weight,
+                            members=self.members if self.members is not None else np.zeros(0, dtype=bool),
+                            has_members=self.members is not None,
+                            release=self.release if self.release else '',
+                            timestamp=self.timestamp)
+
+    @classmethod
+    def load(cls, path, max_age=None, release=None):
+        """Load a matrix saved with save.
+
+        :param path: File path (.npz).
+        :param max_age: Optional maximum age in seconds; older matrices are not loaded.
+        :param release: Optional release identifier; a matrix from a different release is not loaded.
+        :return: ConnectivityMatrix or None if the file is missing, too old or from a different release.
+        """
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            timestamp = float(data['timestamp'])
+            if max_age and time.time() - timestamp > max_age:
+                return None
+            if release is not None and str(data['release']) != release:
+                return None
+            n = int(data['n'])
+            m = cls.__new__(cls)
+            m.ids = decode_strings(data['ids'], n)
+            m.labels = decode_strings(data['labels'], n)
+            m.index = {id: i for i, id in enumerate(m.ids)}
+            m.dataset = str(data['dataset']) or None
+            m.min_weight = data['min_weight'].item()
+            m.members = data['members'] if 'has_members' in data.files and data['has_members'] else None
+            m.release = str(data['release']) or None
+            m.timestamp = timestamp
+            m.matrix = csr_matrix((data['data'], data['indices'], data['indptr']), shape=(n, n))
+            m._csc = None
+        return m
+
+    def __contains__(self, id):
+        return id in self.index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __repr__(self):
+        return "ConnectivityMatrix(dataset=%s, neurons=%d, connections=%d)" % (self.dataset, len(self), self.nnz)
+
+    @property
+    def nnz(self):
+        """Number of connections."""
+        return self.matrix.nnz
+
+    @property
+    def csc(self):
+        """The matrix in compressed sparse column form, for reading upstream partners."""
+        if self._csc is None:
+            self._csc = self.matrix.tocsc()
+        return self._csc
+
+    def positions(self, neurons):
+        """Row/column positions of neurons (unknown IDs are skipped).
+
+        :param neurons: A neuron ID or list of IDs.
+        :return: numpy array of positions.
+        """
+        neurons = [neurons] if isinstance(neurons, str) else neurons
+        return np.array([self.index[n] for n in neurons if n in self.index], dtype=np.int64)
+
+    def _partners(self, compressed, neurons, weight):
+        rows = []
+        for i in self.positions(neurons):
+            start, end = compressed.indptr[i], compressed.indptr[i + 1]
+            partners, weights = compressed.indices[start:end], compressed.data[start:end]
+            keep = weights >= weight
+            partners, weights = partners[keep], weights[keep]
+            order = np.argsort(-weights, kind='stable')
+            rows.extend((self.ids[i], self.labels[i], self.ids[p], self.labels[p], int(w))
+                        for p, w in zip(partners[order], weights[order]))
+        return rows
+
+    def downstream(self, neurons, weight=0, return_dataframe=True):
+        """Downstream partners of one or more neurons, strongest first.
+
+        :param neurons: A neuron ID or list of IDs.
+        :param weight: Optional. Minimum weight. Default 0.
+        :param return_dataframe: Optional. Returns pandas DataFrame if `True`, otherwise returns list of dicts. Default `True`.
+        :return: A DataFrame or list of partners (query_neuron_id, query_neuron_name, partner_neuron_id,
+            partner_neuron_name, weight), as VfbConnect.get_neurons_downstream_of_many.
+        """
+        rows = self._partners(self.matrix, neurons, weight)
+        if return_dataframe:
+            return pd.DataFrame.from_records(rows, columns=PARTNER_COLUMNS)
+        return [dict(zip(PARTNER_COLUMNS, row)) for row in rows]
+
+    def upstream(self, neurons, weight=0, return_dataframe=True):
+        """Upstream partners of one or more neurons, strongest first.
+
+        :param neurons: A neuron ID or list of IDs.
+        :param weight: Optional. Minimum weight. Default 0.
+        :param return_dataframe: Optional. Returns pandas DataFrame if `True`, otherwise returns list of dicts. Default `True`.
+        :return: A DataFrame or list of partners (query_neuron_id, query_neuron_name, partner_neuron_id,
+            partner_neuron_name, weight), as VfbConnect.get_neurons_upstream_of_many.
+        """
+        rows = self._partners(self.csc, neurons, weight)
+        if return_dataframe:
+            return pd.DataFrame.from_records(rows, columns=PARTNER_COLUMNS)
+        return [dict(zip(PARTNER_COLUMNS, row)) for row in rows]
+
+    def thresholded(self, weight=0):
+        """The matrix without connections of less than weight synapses.
+
+        :param weight: Optional. Minimum weight. Default 0.
+        :return: scipy.sparse.csr_matrix
+        """
+        if weight <= self.min_weight:
+            return self.matrix
+        m = self.matrix.copy()
+        m.data[m.data < weight] = 0
+        m.eliminate_zeros()
+        return m
+
+    def layers(self, sources, max_hops=3, weight=0, upstream=False):
+        """Breadth first walk from sources, following connections downstream (or upstream).
+
+        Each neuron is visited once, on the first hop it is reached, and each hop is a single sparse row slice of
+        the current frontier.
+
+        :param sources: A neuron ID or list of IDs.
+        :param max_hops: Optional. Maximum number of synapses to cross. Default 3.
+        :param weight: Optional. Only follow connections of >= weight synapses. Default 0.
+        :param upstream: Optional. Follow connections upstream instead of downstream. Default `False`
+        :return: List of numpy arrays of the positions first reached on each hop (sources first).
+        """
+        m = self.thresholded(weight)
+        m = m.T.tocsr() if upstream else m
+        frontier = np.unique(self.positions(sources))
+        seen = np.zeros(len(self.ids), dtype=bool)
+        seen[frontier] = True
+        layers = [frontier]
+        for hop in range(max_hops):
+            reached = np.unique(m[frontier].indices)
+            frontier = reached[~seen[reached]]
+            if not frontier.size:
+                break
+            seen[frontier] = True
+            layers.append(frontier)
+        return layers
+
+    def covers(self, sources, max_hops=3, weight=0):
+        """Whether the matrix holds every downstream connection within max_hops of sources.
+
+        This is the case if it was loaded with min_weight <= weight and every neuron a walk of max_hops would
+        leave from is a member (see members), so a matrix of the connections between a set of neurons, or a walk
+        that leaves a dataset, is not covered.
+
+        :param sources: A neuron ID or list of IDs.
+        :param max_hops: Optional. Maximum number of synapses to cross. Default 3.
+        :param weight: Optional. Only follow connections of >= weight synapses. Default 0.
+        :return: bool
+        """
+        sources = [sources] if isinstance(sources, str) else sources
+        if self.members is None or weight < self.min_weight or not all(s in self.index for s in sources):
+            return False
+        expanded = np.concatenate(self.layers(sources, max_hops - 1, weight))
+        return bool(self.members[expanded].all())
+
+    def reachable(self, sources, max_hops=3, weight=0, upstream=False, return_dataframe=True):
+        """Neurons reachable from sources within max_hops synapses, with the fewest hops needed to reach each.
+
+        :param sources: A neuron ID or list of IDs.
+        :param max_hops: Optional. Maximum number of synapses to cross. Default 3.
+        :param weight: Optional. Only follow connections of >= weight synapses. Default 0.
+        :param upstream: Optional. Follow connections upstream instead of downstream. Default `False`
+        :param return_dataframe: Optional. Returns pandas DataFrame if `True`, otherwise returns list of dicts. Default `True`.
+        :return: A DataFrame or list of neuron_id, neuron_name and hop (0 for the sources), by hop.
+        """
+        rows = [(self.ids[i], self.labels[i], hop) for hop, layer in enumerate(self.layers(sources, max_hops, weight, upstream))
+                for i in layer]
+        columns = ['neuron_id', 'neuron_name', 'hop']
+        if return_dataframe:
+            return pd.DataFrame.from_records(rows, columns=columns)
+        return [dict(zip(columns, row)) for row in rows]
+
+    def paths(self, sources, targets, max_hops=3, weight=0, weighted=False, return_dataframe=True):
+        """Shortest downstream paths from each source to each target within max_hops synapses.
+
+        Paths are the fewest hops or, if weighted, those with the lowest total cost where crossing a connection
+        costs 1/weight (so strong connections are preferred). Paths are found with Dijkstra's algorithm on the
+        sparse matrix (breadth first search if not weighted). A weighted path of more than max_hops synapses is not
+        reported even if a weaker, shorter one exists.
+
+        :param sources: A neuron ID or list of IDs.
+        :param targets: A neuron ID or list of IDs.
+        :param max_hops: Optional. Maximum number of synapses to cross. Default 3.
+        :param weight: Optional. Only follow connections of >= weight synapses. Default 0.
+        :param weighted: Optional. Find the strongest rather than the shortest paths. Default `False`
+        :param return_dataframe: Optional. Returns pandas DataFrame if `True`, otherwise returns list of dicts. Default `True`.
+        :return: A DataFrame or list with a row per connected source and target: source_id, source_name, target_id,
+            target_name, hops, path (list of IDs), path_names, weights (along the path), min_weight and cost.
+        """
+        m = self.thresholded(weight)
+        source_positions = np.unique(self.positions(sources))
+        target_positions = np.unique(self.positions(targets))
+        rows = []
+        if source_positions.size and target_positions.size:
+            graph = m.astype(np.float64)
+            if weighted:
+                graph.data = 1.0 / graph.data
+            costs, predecessors = dijkstra(graph, directed=True, indices=source_positions, unweighted=not weighted,
+                                           return_predecessors=True, limit=np.inf if weighted else max_hops)
+            for row, source in enumerate(source_positions):
+                for target in target_positions:
+                    if target == source or not np.isfinite(costs[row, target]):
+                        continue
+                    path = [target]
+                    while path[-1] != source:
+                        path.append(predecessors[row, path[-1]])
+                    path.reverse()
+                    if len(path) - 1 > max_hops:
+                        continue
+                    weights = [int(m[a, b]) for a, b in zip(path[:-1], path[1:])]
+                    rows.append((self.ids[source], self.labels[source], self.ids[target], self.labels[target],
+                                 len(path) - 1, [self.ids[i] for i in path], [self.labels[i] for i in path],
+                                 weights, min(weights), float(costs[row, target])))
+        if return_dataframe:
+            return pd.DataFrame.from_records(rows, columns=PATH_COLUMNS)
+        return [dict(zip(PATH_COLUMNS, row)) for row in rows]
+
+    def subset(self, neurons):
+        """Connectivity between a subset of the neurons.
+
+        :param neurons: List of neuron IDs (unknown IDs are skipped).
+        :return: ConnectivityMatrix
+        """
+        p = self.positions(list(dict.fromkeys(neurons)))
+        sub = self.matrix[p][:, p].tocoo()
+        return ConnectivityMatrix([self.ids[i] for i in p], [self.labels[i] for i in p], sub.row, sub.col, sub.data,
+                                  dataset=self.dataset, min_weight=self.min_weight, release=self.release,
+                                  timestamp=self.timestamp)
+
+    def to_dataframe(self, weight=0):
+        """All connections as an edge list.
+
+        :param weight: Optional. Minimum weight. Default 0.
+        :return: DataFrame of upstream_neuron_id, downstream_neuron_id and weight.
+        """
+        m = self.matrix.tocoo()
+        keep = m.data >= weight
+        ids = np.array(self.ids, dtype=object)
+        return pd.DataFrame({'upstream_neuron_id': ids[m.row[keep]], 'downstream_neuron_id': ids[m.col[keep]],
+                             'weight': m.data[keep]})
+
+
+def aggregate_by_type(edges, upstream_types, downstream_types=None):
+    """Aggregate neuron to neuron connections to connections between types.
+
+    Neurons may have any number of types (e.g. their direct types and superclasses), so a connection counts
+    towards every pair of an upstream type and a downstream type. IDs are factorised to integer codes and the
+    grouping done on those.
+
+    :param edges: DataFrame of connections with upstream_neuron_id, downstream_neuron_id and weight columns.
+    :param upstream_types: DataFrame of neuron_id, class_id pairs for upstream neurons.
+    :param downstream_types: Optional. DataFrame of neuron_id, class_id pairs for downstream neurons.
+        Default: upstream_types.
+    :return: DataFrame with a row per upstream_class_id, downstream_class_id pair and the number of connections,
+        total weight and number of distinct upstream and downstream neurons, by total weight.
+    """
+    downstream_types = upstream_types if downstream_types is None else downstream_types
+    columns = ['upstream_class_id', 'downstream_class_id', 'connections', 'weight', 'upstream_neurons',
+               'downstream_neurons']
+    if edges.empty or upstream_types.empty or downstream_types.empty:
+        return pd.DataFrame(columns=columns)
+    neurons = pd.Index(pd.unique(np.concatenate([edges['upstream_neuron_id'].values, edges['downstream_neuron_id'].values,
+                                                 upstream_types['neuron_id'].values, downstream_types['neuron_id'].values])))
+    classes = pd.Index(pd.unique(np.concatenate([upstream_types['class_id'].values, downstream_types['class_id'].values])))
+    coded = pd.DataFrame({'up': neurons.get_indexer(edges['upstream_neuron_id']),
+                          'down': neurons.get_indexer(edges['downstream_neuron_id']),
+                          'weight': edges['weight'].values})
+    up_types = pd.DataFrame({'up': neurons.get_indexer(upstream_types['neuron_id']),
+                             'up_class': classes.get_indexer(upstream_types['class_id'])}).drop_duplicates()
+    down_types = pd.DataFrame({'down': neurons.get_indexer(downstream_types['neuron_id']),
+                               'down_class': classes.get_indexer(downstream_types['class_id'])}).drop_duplicates()
+    typed = coded.merge(up_types, on='up').merge(down_types, on='down')
+    out = typed.groupby(['up_class', 'down_class'], sort=False).agg(
+        connections=('weight', 'size'), weight=('weight', 'sum'),
+        upstream_neurons=('up', 'nunique'), downstream_neurons=('down', 'nunique')).reset_index()
+    out.insert(0, 'upstream_class_id', classes[out.pop('up_class').values])
+    out.insert(1, 'downstream_class_id', classes[out.pop('down_class').values])
+    return out.sort_values('weight', ascending=False, ignore_index=True)[columns]
+
+
+def type_matrix(aggregated, value='weight', labels=None):
+    """Pivot aggregated type connectivity (see aggregate_by_type) into an upstream type x downstream type matrix.
+
+    :param aggregated: DataFrame from aggregate_by_type.
+    :param value: Optional. Column to use: weight, connections, upstream_neurons or downstream_neurons. Default weight.
+    :param labels: Optional. dict of class_id: label used to name the rows and columns.
+    :return: DataFrame with upstream types as rows and downstream types as columns (0 where unconnected).
+    """
+    matrix = aggregated.pivot(index='upstream_class_id', columns='downstream_class_id', values=value).fillna(0)
+    matrix = matrix.astype(aggregated[value].dtype) if len(aggregated) else matrix
+    if labels:
+        matrix = matrix.rename(index=labels, columns=labels)
+    matrix.index.name = 'upstream_class'
+    matrix.columns.name = 'downstream_class'
+    return matrix
@@ -0,0 +1,268 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from .neo4j_tools import chunks, cypher_statement
+from .connectivity_matrix import encode_strings, decode_strings
+
+EXPRESSION_VALUES = ['level', 'extent']
+CLUSTER_FIELDS = ['cluster_ids', 'cluster_labels', 'cell_type_ids', 'cell_type_labels', 'dataset_ids']
+
+
+class ExpressionMatrix:
+
+    """scRNAseq gene expression (Cluster expresses Gene edges) held locally as sparse cluster x gene matrices.
+
+    Rows are clusters and columns genes, with a matrix for each of expression level and extent. Cluster and gene IDs
+    are mapped to row/column positions by index, and the cell type (composed_primarily_of) and dataset of each
+    cluster are kept for grouping.
+
+        :param cluster_ids: Sequence of cluster short_forms; positions in this list are used in the row array.
+        :param cluster_labels: Sequence of cluster labels (same order as cluster_ids).
+        :param cell_type_ids: Sequence of the cell type short_form of each cluster.
+        :param cell_type_labels: Sequence of the cell type label of each cluster.
+        :param dataset_ids: Sequence of the dataset short_form of each cluster.
+        :param gene_ids: Sequence of gene short_forms; positions in this list are used in the column array.
+        :param gene_labels: Sequence of gene labels (same order as gene_ids).
+        :param rows: Integer array of cluster positions, one per expression record.
+        :param cols: Integer array of gene positions, one per expression record.
+        :param level: Array of expression levels, one per expression record.
+        :param extent: Array of expression extents, one per expression record.
+        :param release: Optional. Identifier of the data release the matrix was built from.
+        :param timestamp: Time the matrix was built (seconds since the epoch)."""
+
+    def __init__(self, cluster_ids, cluster_labels, cell_type_ids, cell_type_labels, dataset_ids, gene_ids,
+                 gene_labels, rows, cols, level, extent, release=None, timestamp=None):
+        self.cluster_ids = list(cluster_ids)
+        self.cluster_labels = [label if label else '' for label in cluster_labels]
+        self.cell_type_ids = [id if id else '' for id in cell_type_ids]
+        self.cell_type_labels = [label if label else '' for label in cell_type_labels]
+        self.dataset_ids = [id if id else '' for id in dataset_ids]
+        self.gene_ids = list(gene_ids)
+        self.gene_labels = [label if label else '' for label in gene_labels]
+        self.cluster_index = {id: i for i, id in enumerate(self.cluster_ids)}
+        self.gene_index = {id: i for i, id in enumerate(self.gene_ids)}
+        self.release = release
+        self.timestamp = timestamp if timestamp else time.time()
+        shape = (len(self.cluster_ids), len(self.gene_ids))
+        rows, cols = np.asarray(rows, dtype=np.int32), np.asarray(cols, dtype=np.int32)
+        self.level = csr_matrix((np.asarray(level, dtype=np.float32), (rows, cols)), shape=shape)
+        self.extent = csr_matrix((np.asarray(extent, dtype=np.float32), (rows, cols)), shape=shape)
+
+    @classmethod
+    def from_neo(cls, nc, cell_types, genes=None, no_subtypes=False, chunk_size=100, release=None, verbose=False):
+        """Load the expression of all clusters of a set of cell types from a VFB neo4j (PDB) connection.
+
+        :param nc: A Neo4jConnect object.
+        :param cell_types: List of cell type short_forms; clusters of their subtypes are included unless no_subtypes.
+        :param genes: Optional. List of gene short_forms to load. Default all genes.
+        :param no_subtypes: Optional. Only load clusters annotated with exactly the cell types. Default `False`
+        :param chunk_size: Optional. Number of cell types per query. Default 100.
+        :param release: Optional. Release identifier to record with the matrix.
+        :param verbose: Print progress if `True`.
+        :return: ExpressionMatrix
+        """
+        parameters = {}
+        query = "UNWIND $cell_types AS cell_type " \
+                "MATCH (clus:Cluster:Individual)-[:composed_primarily_of]->(c2:Class)-[:SUBCLASSOF*0..]->" \
+                "(c1:Class {short_form: cell_type}) "
+        if no_subtypes:
+            query += "WHERE c1.short_form = c2.short_form "
+        query += "WITH DISTINCT clus, c2 " \
+                 "OPTIONAL MATCH (clus)-[:has_source]->(ds:DataSet:Individual) " \
+                 "WITH clus, c2, head(collect(ds.short_form)) AS dataset " \
+                 "MATCH (clus)-[e:expresses]->(g:Gene:Class) "
+        if genes is not None:
+            parameters['genes'] = list(genes)
+            query += "WHERE g.short_form IN $genes "
+        query += "RETURN clus.short_form, clus.label, c2.short_form, c2.label, dataset, g.short_form, g.label, " \
+                 "toFloat(e.expression_level[0]), toFloat(e.expression_extent[0])"
+        clusters = {}
+        gene_labels = {}
+        records = {}
+        print("Loading expression for %d cell types from %s..." % (len(cell_types), nc.base_uri)) if verbose else None
+        for chunk in chunks(list(dict.fromkeys(cell_types)), chunk_size):
+            r = nc.commit_list([cypher_statement(query, dict(parameters, cell_types=chunk))])
+            if r is False:
+                raise ValueError("Failed to load expression for cell types starting with %s" % chunk[0])
+            for cluster, cluster_label, cell_type, cell_type_label, dataset, gene, gene_label, level, extent in \
+                    (d['row'] for d in r[0]['data']):
+                clusters.setdefault(cluster, (cluster_label, cell_type, cell_type_label, dataset))
+                gene_labels.setdefault(gene, gene_label)
+                # A cluster reached from several cell types is only recorded once
+                records[(cluster, gene)] = (level, extent)
+            print("Loaded %d expression records for %d clusters" % (len(records), len(clusters))) if verbose else None
+        cluster_index = {id: i for i, id in enumerate(clusters)}
+        gene_index = {id: i for i, id in enumerate(gene_labels)}
+        values = np.array([v for v in records.values()], dtype=np.float32).reshape(-1, 2)
+        metadata = list(zip(*clusters.values())) if clusters else [[], [], [], []]
+        return cls(list(clusters), metadata[0], metadata[1], metadata[2], metadata[3], list(gene_labels),
+                   list(gene_labels.values()), [cluster_index[c] for c, g in records],
+                   [gene_index[g] for c, g in records], np.nan_to_num(values[:, 0]), np.nan_to_num(values[:, 1]),
+                   release=release)
+
+    def save(self, path):
+        """Save the matrix as a compressed numpy archive.
+
+        :param path: File path (.npz).
+        """
+        level, extent = self.level.tocoo(), self.extent.tocoo()
+        arrays = {field: encode_strings(getattr(self, field)) for field in CLUSTER_FIELDS + ['gene_ids', 'gene_labels']}
+        np.savez_compressed(path, n_clusters=len(self.cluster_ids), n_genes=len(self.gene_ids),
+                            level_row=level.row, level_col=level.col, level=level.data,
+                            extent_row=extent.row, extent_col=extent.col, extent=extent.data,
+                            release=self.release if self.release else '', timestamp=self.timestamp, **arrays)
+
+    @classmethod
+    def load(cls, path, max_age=None, release=None):
+        """Load a matrix saved with save.
+
+        :param path: File path (.npz).
+        :param max_age: Optional maximum age in seconds; older matrices are not loaded.
+        :param release: Optional release identifier; a matrix from a different release is not loaded.
+        :return: ExpressionMatrix or None if the file is missing, too old or from a different release.
+        """
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            timestamp = float(data['timestamp'])
+            if max_age and time.time() - timestamp > max_age:
+                return None
+            if release is not None and str(data['release']) != release:
+                return None
+            n_clusters, n_genes = int(data['n_clusters']), int(data['n_genes'])
+            m = cls.__new__(cls)
+            for field in CLUSTER_FIELDS:
+                setattr(m, field, decode_strings(data[field], n_clusters))
+            m.gene_ids = decode_strings(data['gene_ids'], n_genes)
+            m.gene_labels = decode_strings(data['gene_labels'], n_genes)
+            m.cluster_index = {id: i for i, id in enumerate(m.cluster_ids)}
+            m.gene_index = {id: i for i, id in enumerate(m.gene_ids)}
+            m.release = str(data['release']) or None
+            m.timestamp = timestamp
+            shape = (n_clusters, n_genes)
+            m.level = csr_matrix((data['level'], (data['level_row'], data['level_col'])), shape=shape)
+            m.extent = csr_matrix((data['extent'], (data['extent_row'], data['extent_col'])), shape=shape)
+        return m
+
+    def __len__(self):
+        return len(self.cluster_ids)
+
+    def __repr__(self):
+        return "ExpressionMatrix(clusters=%d, cell_types=%d, genes=%d, records=%d)" % (
+            len(self.cluster_ids), len(set(self.cell_type_ids)), len(self.gene_ids), self.nnz)
+
+    @property
+    def nnz(self):
+        """Number of expression records."""
+        return self.level.nnz
+
+    def matrix(self, value='level'):
+        """The cluster x gene matrix of expression level or extent.
+
+        :param value: Optional. 'level' or 'extent'. Default 'level'.
+        :return: scipy.sparse.csr_matrix
+        """
+        if value not in EXPRESSION_VALUES:
+            raise ValueError("value must be one of %s, not '%s'" % (', '.join(EXPRESSION_VALUES), value))
+        return getattr(self, value)
+
+    @staticmethod
+    def _values_at(m, rows, cols):
+        """Values of a sparse matrix at (row, col) positions as a flat array (empty if there are none)."""
+        if not len(rows):
+            return np.zeros(0, dtype=m.dtype)
+        return np.asarray(m[rows, cols]).ravel()
+
+    def by_cell_type(self, value='level', agg='max'):
+        """Aggregate cluster rows to one row per cell type.
+
+        :param value: Optional. 'level' or 'extent'. Default 'level'.
+        :param agg: Optional. 'max' or 'mean' over the cell type's clusters (missing records count as 0 for the
+            mean). Default 'max'.
+        :return: Tuple of (cell type x gene csr_matrix, list of cell type IDs).
+        """
+        m = self.matrix(value)
+        codes, cell_types = pd.factorize(pd.Series(self.cell_type_ids))
+        if agg == 'mean':
+            counts = np.bincount(codes, minlength=len(cell_types)).astype(np.float32)
+            grouping = csr_matrix((np.ones(len(codes), dtype=np.float32), (codes, np.arange(len(codes)))),
+                                  shape=(len(cell_types), len(codes)))
+            aggregated = csr_matrix(grouping @ m).multiply(1 / counts[:, None]).tocsr()
+        elif agg == 'max':
+            coo = m.tocoo()
+            df = pd.DataFrame({'row': codes[coo.row], 'col': coo.col, 'value': coo.data})
+            df = df.groupby(['row', 'col'], sort=False)['value'].max().reset_index()
+            aggregated = csr_matrix((df['value'].values, (df['row'].values, df['col'].values)),
+                                    shape=(len(cell_types), m.shape[1]))
+        else:
+            raise ValueError("agg must be 'max' or 'mean', not '%s'" % agg)
+        return aggregated, list(cell_types)
+
+    def subset(self, cell_types=None, genes=None):
+        """Expression of a subset of cell types (clusters annotated with them) and/or genes.
+
+        :param cell_types: Optional. List of cell type IDs. Default all.
+        :param genes: Optional. List of gene IDs (unknown IDs are skipped). Default all.
+        :return: ExpressionMatrix
+        """
+        if cell_types is None:
+            rows = np.arange(len(self.cluster_ids))
+        else:
+            cell_types = set(cell_types)
+            rows = np.array([i for i, c in enumerate(self.cell_type_ids) if c in cell_types], dtype=np.int64)
+        if genes is None:
+            cols = np.arange(len(self.gene_ids))
+        else:
+            cols = np.array([self.gene_index[g] for g in dict.fromkeys(genes) if g in self.gene_index], dtype=np.int64)
+        level = self.level[rows][:, cols].tocoo()
+        extent = self.extent[rows][:, cols].tocsr()
+        return ExpressionMatrix(*[[getattr(self, field)[i] for i in rows] for field in CLUSTER_FIELDS],
+                                [self.gene_ids[i] for i in cols], [self.gene_labels[i] for i in cols],
+                                level.row, level.col, level.data, self._values_at(extent, level.row, level.col),
+                                release=self.release, timestamp=self.timestamp)
+
+    def to_dataframe(self, value='level', by='cluster', agg='max', use_labels=False, sparse=True):
+        """The matrix as a DataFrame with categorical row and column indices.
+
+        :param value: Optional. 'level' or 'extent'. Default 'level'.
+        :param by: Optional. 'cluster' for a row per cluster, or 'cell_type' for a row per cell type
+            (see by_cell_type). Default 'cluster'.
+        :param agg: Optional. Aggregation of clusters for by='cell_type', 'max' or 'mean'. Default 'max'.
+        :param use_labels: Optional. Index by labels rather than IDs. Default `False`
+        :param sparse: Optional. Return a DataFrame with sparse columns (0 for no record). Default `True`
+        :return: pandas.DataFrame of rows x genes.
+        """
+        if by == 'cluster':
+            m = self.matrix(value)
+            rows = self.cluster_labels if use_labels else self.cluster_ids
+        elif by == 'cell_type':
+            m, cell_types = self.by_cell_type(value, agg=agg)
+            labels = dict(zip(self.cell_type_ids, self.cell_type_labels))
+            rows = [labels[c] for c in cell_types] if use_labels else cell_types
+        else:
+            raise ValueError("by must be 'cluster' or 'cell_type', not '%s'" % by)
+        index = pd.CategoricalIndex(rows, name=by)
+        columns = pd.CategoricalIndex(self.gene_labels if use_labels else self.gene_ids, name='gene')
+        if sparse:
+            # Sparse columns with 0 for missing records (from_spmatrix may use a NaN fill value)
+            return pd.DataFrame.sparse.from_spmatrix(m, index=index, columns=columns).astype(pd.SparseDtype(m.dtype, 0))
+        return pd.DataFrame(m.toarray(), index=index, columns=columns)
+
+    def to_long(self):
+        """All expression records in long format.
+
+        :return: DataFrame of cluster_id, cluster, cell_type_id, cell_type, dataset_id, gene_id, gene, level and extent.
+        """
+        level = self.level.tocoo()
+        extent = self._values_at(self.extent, level.row, level.col)
+        rows, cols = level.row, level.col
+        return pd.DataFrame({'cluster_id': np.array(self.cluster_ids, dtype=object)[rows],
+                             'cluster': np.array(self.cluster_labels, dtype=object)[rows],
+                             'cell_type_id': np.array(self.cell_type_ids, dtype=object)[rows],
+                             'cell_type': np.array(self.cell_type_labels, dtype=object)[rows],
+                             'dataset_id': np.array(self.dataset_ids, dtype=object)[rows],
+                             'gene_id': np.array(self.gene_ids, dtype=object)[cols],
+                             'gene': np.array(self.gene_labels, dtype=object)[cols],
+                             'level': level.data, 'extent': extent})
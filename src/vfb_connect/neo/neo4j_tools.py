@@ -8,6 +8,7 @@ from datetime import timedelta
 import math
 import argparse
 from ..default_servers import get_default_servers
+from ..retry_policy import RetryPolicy
 import os
 
 
@@ -80,14 +81,20 @@ class Neo4jConnect:
 
     :param endpoint: a neo4j REST endpoint
     :param usr: username (content ignored if credentials not rqd)
-    :param pwd: password (content ignored if credentials not rqd)"""
+    :param pwd: password (content ignored if credentials not rqd)
+    :param retry_policy: Optional RetryPolicy for failed requests. Default: a new RetryPolicy.
+    :param profiler: Optional QueryProfiler to record statement timings. Default: None (no profiling)."""
     # Return results might be better handled in the case of multiple statements - especially when chunked.
     # Not connection with original query is kept.
 
     def __init__(self, endpoint = get_default_servers()['neo_endpoint'],
                  usr=get_default_servers()['neo_credentials'][0],
-                 pwd=get_default_servers()['neo_credentials'][1]):
+                 pwd=get_default_servers()['neo_credentials'][1],
+                 retry_policy=None,
+                 profiler=None):
         self.base_uri = endpoint
+        self.retry_policy = retry_policy if retry_policy else RetryPolicy(name='Neo4j')
+        self.profiler = profiler
         self.usr = usr
         self.pwd = pwd
         self.commit = "/db/neo4j/tx/commit"
@@ -103,32 +110,35 @@ class Neo4jConnect:
         """Commit a list of statements to neo4J DB via REST API.
         Errors prompt warnings (STDERR), not exceptions, and cause return = FALSE.
 
-        :param: statements: A list of cypher statements.
+        :param: statements: A list of cypher statements. Each may be a string or a dict of
+            {'statement': cypher, 'parameters': {name: value}} using $name parameters in the cypher, so the server
+            can reuse its query plan and values need no escaping.
         :param: return_graphs: Optional. Boolean. Returns graphs under 'graph' key if True. Default: False
         :Return: List of results or False if any errors are encountered.
         """
-
-        cstatements = []
-        if return_graphs:
-            for s in statements:
-                cstatements.append({'statement': s, "resultDataContents" : [ "row", "graph" ]})
-        else:
-            for s in statements:
-                cstatements.append({'statement': s}) # rows an columns are returned by default.
-        payload = {'statements': cstatements}
+        payload = {'statements': [cypher_statement(s, return_graphs=return_graphs) for s in statements]}
+        profiler = self.profiler
+        if profiler:
+            payload['statements'] = profiler.instrument(payload['statements'])
+            start = time.perf_counter()
         try:
-            response = requests.post(url = "%s%s"
+            response = self.retry_policy.call(requests.post, url = "%s%s"
                                  % (self.base_uri, self.commit), auth = (self.usr, self.pwd) ,
                                   data = json.dumps(payload), headers = self.headers)
         except requests.exceptions.RequestException as e:
             print("\033[31mConnection Error:\033[0m %s" % e)
-            print("Retrying in 10 seconds...")
-            time.sleep(10)
-            return self.commit_list(statements)
-        if self.rest_return_check(response):
-            return response.json()['results']
-        else:
+            if profiler:
+                profiler.record(payload['statements'], time.perf_counter() - start, error=str(e))
             return False
+        ok = self.rest_return_check(response)
+        results = response.json()['results'] if ok else False
+        if profiler:
+            error = None
+            if not ok:
+                error = "Query error" if response.status_code == 200 else "Status %s" % response.status_code
+            profiler.record(payload['statements'], time.perf_counter() - start, len(response.content), results,
+                            error=error)
+        return results
 
     def commit_list_in_chunks(self, statements, verbose=False, chunk_length=1000):
 
@@ -433,6 +443,26 @@ class Neo4jConnect:
             except Exception as e:
                 print(f"Failed to save cache lookup to disk: {e}")
 
+def cypher_statement(statement, parameters=None, return_graphs=False):
+    """Build a statement for the neo4j transactional REST API.
+
+    :param statement: A cypher string or a dict with 'statement' and optional 'parameters' keys.
+    :param parameters: Optional dict of parameters for a cypher string.
+    :param return_graphs: Optional. Also request graphs if True. Default: False
+    :return: dict
+    """
+    if isinstance(statement, dict):
+        out = {'statement': statement['statement']}
+        parameters = statement.get('parameters', parameters)
+    else:
+        out = {'statement': statement}
+    if parameters:
+        out['parameters'] = parameters
+    if return_graphs:
+        out['resultDataContents'] = ["row", "graph"]  # rows and columns are returned by default.
+    return out
+
+
 def dict_cursor(results):
     """Takes JSON results from a neo4J query and turns them into a list of dicts.
 
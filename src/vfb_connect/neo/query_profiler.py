@@ -0,0 +1,163 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+import pandas as pd
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Frames that only pass statements on to the server; the caller is looked for above these
+SKIP_FUNCTIONS = ('commit_list', 'commit_list_in_chunks')
+SKIP_FILES = (os.path.abspath(__file__), os.path.join(PACKAGE_DIR, 'retry_policy.py'))
+ENTRY_POINT_CLASSES = ('VfbConnect', 'AsyncVfbConnect')
+# Statements that cannot (or need not) be prefixed with PROFILE
+UNPROFILABLE = re.compile(r'^\s*(EXPLAIN|PROFILE|USING|:)', re.IGNORECASE)
+
+
+def db_hits(plan):
+    """Total database hits in a neo4j PROFILE plan (summed over the operator tree).
+
+    :param plan: The 'profile' dict returned for a profiled statement.
+    :return: int
+    """
+    if not plan:
+        return 0
+    return plan.get('dbHits', 0) + sum(db_hits(c) for c in plan.get('children', []))
+
+
+def calling_method(frame):
+    """Name the vfb_connect method a query came from, as Class.method.
+
+    The outermost VfbConnect (or AsyncVfbConnect) method in the call stack is used, so a query issued by a helper is
+    attributed to the public method that was called. Otherwise the innermost vfb_connect method above commit_list
+    is used (e.g. for a QueryWrapper used directly).
+
+    :param frame: Frame to start from.
+    :return: str or None
+    """
+    caller = None
+    while frame is not None:
+        code = frame.f_code
+        filename = os.path.abspath(code.co_filename)
+        if filename.startswith(PACKAGE_DIR) and filename not in SKIP_FILES and code.co_name not in SKIP_FUNCTIONS:
+            obj = frame.f_locals.get('self')
+            if obj is not None:
+                cls = type(obj)
+                name = "%s.%s" % (cls.__name__, code.co_name)
+                if any(c.__name__ in ENTRY_POINT_CLASSES for c in cls.__mro__):
+                    caller = name
+                elif caller is None:
+                    caller = name
+        frame = frame.f_back
+    return caller
+
+
+class QueryProfiler:
+
+    """Opt-in instrumentation for the Cypher statements sent by Neo4jConnect.commit_list.
+
+    Each statement is recorded with the calling vfb_connect method, wall time, bytes received, row count, whether it
+    succeeded and, if profile_db_hits is set, the database hits from running it with PROFILE. Statements sent
+    together in one request share its wall time and bytes equally (VfbConnect sends most queries one per request,
+    so these are usually exact). Records can be viewed with to_dataframe/report, and hooks are called with each
+    record as it is made (e.g. to forward timings to an external metrics system).
+
+        :param profile_db_hits: Run statements with PROFILE and record database hits. This adds server side overhead.
+        :param max_records: Maximum number of records kept (oldest are dropped first).
+        :param hooks: Optional list of callables, each called with every record dict."""
+
+    def __init__(self, profile_db_hits=False, max_records=10000, hooks=None):
+        self.profile_db_hits = profile_db_hits
+        self.hooks = list(hooks) if hooks else []
+        self._records = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    def instrument(self, statements):
+        """Prepare statements (as sent to the transactional REST API) for profiling.
+
+        :param statements: List of {'statement': cypher, ...} dicts.
+        :return: List of statement dicts, prefixed with PROFILE if profile_db_hits is set.
+        """
+        if not self.profile_db_hits:
+            return statements
+        return [dict(s, statement='PROFILE ' + s['statement']) if not UNPROFILABLE.match(s['statement']) else s
+                for s in statements]
+
+    def record(self, statements, elapsed, n_bytes=0, results=None, error=None):
+        """Record a request to the server.
+
+        :param statements: List of statement dicts sent.
+        :param elapsed: Wall time of the request in seconds.
+        :param n_bytes: Size of the response body in bytes.
+        :param results: List of results returned for the statements, if any.
+        :param error: Optional. Description of the error if the request failed.
+        :return: List of the record dicts made.
+        """
+        caller = calling_method(sys._getframe(1))
+        n = max(len(statements), 1)
+        results = results if results else []
+        records = []
+        for i, s in enumerate(statements):
+            result = results[i] if i < len(results) else {}
+            statement = s['statement']
+            if self.profile_db_hits and statement.startswith('PROFILE '):
+                statement = statement[len('PROFILE '):]
+            records.append({'timestamp': time.time(),
+                            'caller': caller,
+                            'statement': statement,
+                            'parameters': s.get('parameters'),
+                            'time': elapsed / n,
+                            'bytes': n_bytes / n,
+                            'rows': len(result.get('data', [])),
+                            'db_hits': db_hits(result.get('profile')) if 'profile' in result else None,
+                            'batch_size': len(statements),
+                            'success': error is None,
+                            'error': error})
+        with self._lock:
+            self._records.extend(records)
+        for r in records:
+            for hook in self.hooks:
+                try:
+                    hook(r)
+                except Exception as e:
+                    print("\033[33mWarning:\033[0m Query profiler hook %s failed: %s" % (getattr(hook, '__name__', hook), e))
+        return records
+
+    @property
+    def records(self):
+        """List of the record dicts kept, oldest first."""
+        with self._lock:
+            return list(self._records)
+
+    def reset(self):
+        """Discard all records."""
+        with self._lock:
+            self._records.clear()
+
+    def to_dataframe(self):
+        """All records as a DataFrame, one row per statement sent.
+
+        :return: pandas.DataFrame
+        """
+        return pd.DataFrame.from_records(self.records, columns=['timestamp', 'caller', 'statement', 'parameters',
+                                                                 'time', 'bytes', 'rows', 'db_hits', 'batch_size',
+                                                                 'success', 'error'])
+
+    def report(self, by='statement', top=None):
+        """Summarise records by calling method and statement (or just method), slowest in total first.
+
+        :param by: Optional. 'statement' to group by caller and statement text, 'caller' to group by caller only.
+        :param top: Optional. Only return this many rows.
+        :return: pandas.DataFrame with calls, total/mean/max time, total rows, bytes and db hits, and failures.
+        """
+        df = self.to_dataframe()
+        keys = ['caller', 'statement'] if by == 'statement' else ['caller']
+        df['caller'] = df['caller'].fillna('')
+        df['failures'] = ~df['success'].astype(bool)
+        summary = df.groupby(keys).agg(calls=('time', 'size'), total_time=('time', 'sum'),
+                                       mean_time=('time', 'mean'), max_time=('time', 'max'),
+                                       rows=('rows', 'sum'), bytes=('bytes', 'sum'),
+                                       db_hits=('db_hits', 'sum'), failures=('failures', 'sum'))
+        summary = summary.sort_values('total_time', ascending=False).reset_index()
+        return summary.head(top) if top else summary
@@ -4,8 +4,6 @@ import re
 import shutil
 import traceback
 from inspect import getfullargspec
-from string import Template
-from time import sleep
 from xml.sax import saxutils
 import pandas as pd
 import pkg_resources
@@ -17,7 +15,8 @@ from itertools import chain
 
 
 # from jsonpath_rw import parse as parse_jpath
-from vfb_connect.neo.neo4j_tools import chunks, Neo4jConnect, dict_cursor, escape_string
+from vfb_connect.neo.neo4j_tools import chunks, Neo4jConnect, dict_cursor, cypher_statement
+from vfb_connect.retry_policy import RetryPolicy
 
 # Connect to the VFB SOLR server
 vfb_solr = pysolr.Solr('http://solr.virtualflybrain.org/solr/vfb_json/', always_commit=False, timeout=990)
@@ -247,7 +246,7 @@ def _populate_summary(TermInfo):
 
 def gen_simple_report(terms, dataframe=True):
     nc = Neo4jConnect("https://pdb.virtualflybrain.org", "neo4j", "neo4j")
-    query = """MATCH (n:Class) WHERE n.iri in %s WITH n 
+    query = """MATCH (n:Class) WHERE n.iri in $terms WITH n 
                 OPTIONAL MATCH  (n)-[r]->(p:pub) WHERE r.typ = 'syn' 
                 WITH n, 
                 COLLECT({ synonym: r.synonym, PMID: 'PMID:' + p.PMID, 
@@ -259,8 +258,8 @@ def gen_simple_report(terms, dataframe=True):
                 RETURN n.short_form as short_form, n.label as label, 
                 n.description as description, syns, pubs,
                 super.label, super.short_form
-                 """ % str(terms)
-    q = nc.commit_list([query])
+                 """
+    q = nc.commit_list([cypher_statement(query, {'terms': list(terms)})])
     # add check
     if not q:
         raise Exception('Query failed.')
@@ -271,8 +270,10 @@ def gen_simple_report(terms, dataframe=True):
 
 class QueryWrapper(Neo4jConnect):
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, solr_retry_policy=None, **kwargs):
         super(QueryWrapper, self).__init__(*args, **kwargs)
+        self.solr_retry_policy = solr_retry_policy if solr_retry_policy else RetryPolicy(
+            name='SOLR', retry_on_exceptions=(pysolr.SolrError, requests.exceptions.ConnectionError, requests.exceptions.Timeout))
         query_json = pkg_resources.resource_filename(
                             "vfb_connect",
                             "resources/VFB_TermInfo_queries.json")
@@ -282,8 +283,8 @@ class QueryWrapper(Neo4jConnect):
 #    def get_sites(self):
 #        return
 
-    def _query(self, q):
-        qr = self.commit_list([q])
+    def _query(self, q, parameters=None):
+        qr = self.commit_list([cypher_statement(q, parameters)])
         if not qr:
             raise Exception(f'Query failed: {q}')
         else:
@@ -397,7 +398,7 @@ class QueryWrapper(Neo4jConnect):
                          "RETURN i.short_form as sf")
         short_forms = [d['sf'] for d in dc]
         if include_symbols:
-            dc = self._query("MATCH (i:Individual:Template:Anatomy) ",
+            dc = self._query("MATCH (i:Individual:Template:Anatomy) "
                              "WHERE exists(i.symbol) and not i.symbol[0] = '' "
                              "RETURN i.symbol[0] as s")
             short_forms.extend([d['s'] for d in dc if d['s']])
@@ -417,13 +418,13 @@ class QueryWrapper(Neo4jConnect):
         """
         vfb_id = list(set(vfb_id))
         match = "MATCH (s:Individual)<-[r:database_cross_reference]-(i:Entity) " \
-                "WHERE i.short_form in %s" % str(vfb_id)
+                "WHERE i.short_form in $ids"
         clause1 = ''
         if db:
-            clause1 = "AND s.short_form = '%s'" % db
+            clause1 = "AND s.short_form = $db"
         clause2 = ''
         if id_type:
-            clause2 = "AND r.id_type = '%s'" % id_type
+            clause2 = "AND r.id_type = $id_type"
         if datasource_only:
             clause2 = "AND s.is_data_source = [True]"
         ret = "RETURN i.short_form as key, " \
@@ -433,7 +434,7 @@ class QueryWrapper(Neo4jConnect):
                   "collect({ db: CASE WHEN s.symbol IS NOT NULL AND size(s.symbol) > 0 AND NOT s.symbol[0] = '' THEN s.symbol[0] ELSE s.short_form END, vfb_id: i.short_form }) as mapping"
         q = ' '.join([match, clause1, clause2, ret])
         print(q) if verbose else None
-        dc = self._query(q)
+        dc = self._query(q, {'ids': vfb_id, 'db': db, 'id_type': id_type})
         print(dc) if verbose else None
         mapping = {d['key']: d['mapping'] for d in dc}
         print(mapping) if verbose else None
@@ -464,11 +465,11 @@ class QueryWrapper(Neo4jConnect):
         conditions = ["NOT s:Deprecated"]
         if not (acc is None):
             acc = [str(a) for a in set(acc)]
-            conditions.append("r.accession[0] in %s" % str(acc))
+            conditions.append("r.accession[0] in $acc")
         if db:
-            conditions.append("s.short_form = '%s'" % db)
+            conditions.append("s.short_form = $db")
         if id_type:
-            conditions.append("r.id_type = '%s'" % id_type)
+            conditions.append("r.id_type = $id_type")
         condition_clauses = ' AND '.join(conditions)
         ret = "RETURN r.accession[0] as key, " \
               "collect({ db: s.short_form, vfb_id: i.short_form }) as mapping"
@@ -477,7 +478,7 @@ class QueryWrapper(Neo4jConnect):
                   "collect({ db: s.short_form, acc: r.accession[0]}) as mapping"
         q = ' '.join([match, condition_clauses, ret])
         print(q) if verbose else None
-        dc = self._query(q)
+        dc = self._query(q, {'acc': acc, 'db': db, 'id_type': id_type})
         print(dc) if verbose else None
         return {d['key']: d['mapping'] for d in dc}
 
@@ -517,11 +518,11 @@ class QueryWrapper(Neo4jConnect):
         Optionally restrict by dataset (improves speed)"""
         m = "MATCH (ds:DataSet)<-[has_source]-(ai:Individual)<-[:depicts]" \
             "-(channel:Individual)-[irw:in_register_with]-(tc:Template)"
-        w = "WHERE irw.filename[0]in %s" % str([escape_string(f) for f in filenames])
+        w = "WHERE irw.filename[0] in $filenames"
         if dataset:
-            w += "AND ds.short_form = '%s'" % dataset
+            w += " AND ds.short_form = $dataset"
         r = "RETURN ai.short_form"
-        dc = self._query(' '.join([m, w, r]))
+        dc = self._query(' '.join([m, w, r]), {'filenames': list(filenames), 'dataset': dataset})
         return self.get_anatomical_individual_TermInfo([d['ai.short_form']
                                                         for d in dc], summary=summary, return_dataframe=return_dataframe)
 
@@ -570,9 +571,9 @@ class QueryWrapper(Neo4jConnect):
                 return self.get_TermInfo(short_forms, summary=summary, cache=False, return_dataframe=return_dataframe, limit=limit)
         print("Pulling results from VFB PDB (Neo4j): http://pdb.virtualflybrain.org") if verbose else None
         pre_query = "MATCH (e:Entity) " \
-                    "WHERE e.short_form in %s " \
-                    "RETURN e.short_form as short_form, labels(e) as labs " % str(short_forms)
-        r = self._query(pre_query)
+                    "WHERE e.short_form in $ids " \
+                    "RETURN e.short_form as short_form, labels(e) as labs "
+        r = self._query(pre_query, {'ids': list(short_forms)})
         out = []
         for e in r:
             if 'class' in e['labs'] and 'Neuron' in e['labs']:
@@ -612,13 +613,13 @@ class QueryWrapper(Neo4jConnect):
         print(f"Checking cache for results: short_forms={short_forms}") if verbose else None
         print(f"Looking for {len(short_forms)} results.") if verbose else None
         try:
-            result = vfb_solr.search('*', **{'fl': 'term_info','df': 'id', 'defType': 'edismax', 'q.op': 'OR','rows': len(short_forms)+10,'fq':'{!terms f=id}'+ ','.join(short_forms)})
+            result = self.solr_retry_policy.call(vfb_solr.search, '*', **{'fl': 'term_info','df': 'id', 'defType': 'edismax', 'q.op': 'OR','rows': len(short_forms)+10,'fq':'{!terms f=id}'+ ','.join(short_forms)})
         except Exception as e:
+            # Returning nothing makes get_TermInfo fall back to the PDB
             print(f"\033[33mWarning:\033[0m Cache query failed for {short_forms}. Error: {e}")
             if verbose:
                 print(f"Stack trace:\n{traceback.format_exc()}")
-            sleep(15) # Sleep for 15 seconds to avoid overloading the server
-            return self._get_Cached_TermInfo(short_forms, summary=summary, return_dataframe=return_dataframe, verbose=verbose)
+            return []
         results = self._serialize_solr_output(result)
         print(f"Got {len(results)} results.") if verbose else None
         if len(short_forms) != len(results):
@@ -631,24 +632,24 @@ class QueryWrapper(Neo4jConnect):
 
     @batch_query
     def _get_TermInfo(self, short_forms: iter, typ, show_query=False, summary=True, return_dataframe=True):
-        short_forms = list(short_forms)
-        sfl = "', '".join(short_forms)
-        qs = Template(self.queries[typ]).substitute(ID=sfl)
+        # The query text is the same for every call; the IDs are sent as a parameter
+        parameters = {'ids': list(short_forms)}
+        qs = self.queries[typ]
         if show_query:
-            print(qs)
+            print(qs, parameters)
         if summary:
-            return self._termInfo_2_summary(self._query(qs), typ=typ)
+            return self._termInfo_2_summary(self._query(qs, parameters), typ=typ)
         else:
-            return self._query(qs)
+            return self._query(qs, parameters)
 
     def _get_anatomical_individual_TermInfo_by_type(self, classification, summary=True, return_dataframe=True, limit=None, verbose=False):
         # TODO use the limit parameter
         typ = 'Get JSON for Individual:Anatomy_by_type'
-        qs = Template(self.queries[typ]).substitute(ID=classification)
+        qs = self.queries[typ]
         if summary:
-            return self._termInfo_2_summary(self._query(qs), typ='Get JSON for Individual', verbose=verbose)
+            return self._termInfo_2_summary(self._query(qs, {'id': classification}), typ='Get JSON for Individual', verbose=verbose)
         else:
-            return self._query(qs)
+            return self._query(qs, {'id': classification})
 
     def _termInfo_2_summary(self, TermInfo, typ, verbose=False):
         # type_2_summary = {
@@ -0,0 +1,355 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from .neo4j_tools import cypher_statement
+from .connectivity_matrix import encode_strings, decode_strings
+
+MATCH_COLUMNS = ['query_neuron_id', 'query_neuron_name', 'id', 'label', 'dataset', 'score']
+
+
+class SimilarityMatrix:
+
+    """Morphological similarity scores (e.g. has_similar_morphology_to NBLAST_score) held locally as a sparse matrix.
+
+    The matrix is square and symmetric over all neurons (those exported and those they match), so a row holds a
+    neuron's scored matches. Neuron IDs are mapped to positions by index, and the dataset of each neuron is kept for
+    cross dataset matching.
+
+        :param ids: Sequence of neuron short_forms; positions in this list are used in the score arrays.
+        :param labels: Sequence of neuron labels (same order as ids).
+        :param datasets: Sequence of the dataset short_form of each neuron ('' if unknown).
+        :param rows: Integer array of neuron positions, one per score.
+        :param cols: Integer array of matched neuron positions, one per score.
+        :param scores: Array of scores. Each pair is stored once, in either order; the highest score is kept.
+        :param dataset: Optional. short_form of the dataset the matrix was exported for.
+        :param similarity_score: Optional. Name of the score. Default 'NBLAST_score'.
+        :param min_score: Optional. Minimum score used when loading scores.
+        :param release: Optional. Identifier of the data release the matrix was built from.
+        :param timestamp: Time the matrix was built (seconds since the epoch)."""
+
+    def __init__(self, ids, labels, datasets, rows, cols, scores, dataset=None, similarity_score='NBLAST_score',
+                 min_score=None, release=None, timestamp=None):
+        self.ids = list(ids)
+        self.labels = [label if label else '' for label in labels]
+        self.datasets = [ds if ds else '' for ds in datasets]
+        self.index = {id: i for i, id in enumerate(self.ids)}
+        self.dataset = dataset
+        self.similarity_score = similarity_score
+        self.min_score = min_score
+        self.release = release
+        self.timestamp = timestamp if timestamp else time.time()
+        n = len(self.ids)
+        pairs = pd.DataFrame({'row': np.asarray(rows, dtype=np.int64), 'col': np.asarray(cols, dtype=np.int64),
+                              'score': np.asarray(scores, dtype=np.float32)})
+        pairs = pairs[pairs['row'] != pairs['col']]
+        # Symmetrise, keeping the best score where a pair is scored in both directions
+        pairs = pd.concat([pairs, pairs.rename(columns={'row': 'col', 'col': 'row'})], ignore_index=True)
+        pairs = pairs.groupby(['row', 'col'], sort=False)['score'].max().reset_index()
+        self.matrix = csr_matrix((pairs['score'].values, (pairs['row'].values, pairs['col'].values)), shape=(n, n))
+
+    @classmethod
+    def _from_rows(cls, rows, labels, datasets, **kwargs):
+        """Build from (id, matched id, score) rows and dicts of id: label and id: dataset."""
+        rows = list(rows)
+        index = {}
+        for id in labels:
+            index.setdefault(id, len(index))
+        pairs = np.array([[index.setdefault(a, len(index)), index.setdefault(b, len(index))] for a, b, s in rows],
+                         dtype=np.int64).reshape(-1, 2)
+        scores = np.array([s for a, b, s in rows], dtype=np.float32)
+        ids = list(index.keys())
+        return cls(ids, [labels.get(id, '') for id in ids], [datasets.get(id, '') for id in ids],
+                   pairs[:, 0], pairs[:, 1], scores, **kwargs)
+
+    @classmethod
+    def from_neo(cls, nc, dataset, similarity_score='NBLAST_score', min_score=None, page_size=5000, release=None,
+                 verbose=False):
+        """Export the has_similar_morphology_to scores of a dataset's neurons from a VFB neo4j (PDB) connection.
+
+        The dataset's neurons are paged through in short_form order, and all their scored matches (in any dataset)
+        loaded with the dataset of each match.
+
+        :param nc: A Neo4jConnect object.
+        :param dataset: short_form of a dataset.
+        :param similarity_score: Optional. The similarity score to load. Default 'NBLAST_score'.
+        :param min_score: Optional. Minimum score to load. Default all.
+        :param page_size: Optional. Number of neurons per query. Default 5000.
+        :param release: Optional. Release identifier to record with the matrix.
+        :param verbose: Print progress if `True`.
+        :return: SimilarityMatrix
+        """
+        query = "MATCH (ds:DataSet)<-[:has_source]-(n1:Individual) " \
+                "WHERE ds.short_form = $dataset AND n1.short_form > $last_neuron " \
+                "WITH n1 ORDER BY n1.short_form LIMIT $page_size " \
+                "OPTIONAL MATCH (n1)-[r:has_similar_morphology_to]-(n2:Individual) WHERE exists(r.%s) " % similarity_score
+        if min_score is not None:
+            query += "AND r.%s[0] >= $min_score " % similarity_score
+        query += "OPTIONAL MATCH (n2)-[:has_source]->(ds2:DataSet) " \
+                 "WITH n1, n2, r, head(collect(ds2.short_form)) AS ds2 " \
+                 "RETURN n1.short_form, n1.label, n2.short_form, n2.label, ds2, r.%s[0]" % similarity_score
+        parameters = {'dataset': dataset, 'page_size': page_size}
+        if min_score is not None:
+            parameters['min_score'] = min_score
+        rows = []
+        labels = {}
+        datasets = {}
+        last = ''
+        print("Loading %s scores from %s..." % (similarity_score, nc.base_uri)) if verbose else None
+        while True:
+            r = nc.commit_list([cypher_statement(query, dict(parameters, last_neuron=last))])
+            if r is False:
+                raise ValueError("Failed to load %s scores for %s after %s" % (similarity_score, dataset, last))
+            page = [d['row'] for d in r[0]['data']]
+            if not page:
+                break
+            for id, label, match, match_label, match_dataset, score in page:
+                labels[id] = label
+                datasets[id] = dataset
+                if match is not None:
+                    labels.setdefault(match, match_label)
+                    datasets.setdefault(match, match_dataset)
+                    rows.append((id, match, score))
+            last = max(row[0] for row in page)
+            print("Loaded %d scores for %d neurons" % (len(rows), len(labels))) if verbose else None
+            if len(set(row[0] for row in page)) < page_size:
+                break
+        return cls._from_rows(rows, labels, datasets, dataset=dataset, similarity_score=similarity_score,
+                              min_score=min_score, release=release)
+
+    @classmethod
+    def from_dataframe(cls, df, query='query_neuron_id', match='id', score='score', labels=None, datasets=None,
+                       similarity_score='NBLAST_score'):
+        """Build from a table of scores, e.g. the output of VfbConnect.get_similar_neurons_many.
+
+        :param df: DataFrame with a row per score.
+        :param query: Optional. Column of query neuron IDs. Default 'query_neuron_id'
+        :param match: Optional. Column of matched neuron IDs. Default 'id'
+        :param score: Optional. Column of scores. Default 'score'
+        :param labels: Optional. dict of neuron ID: label. Default: from query_neuron_name and label columns if present.
+        :param datasets: Optional. dict of neuron ID: dataset.
+        :param similarity_score: Optional. Name of the score. Default 'NBLAST_score'.
+        :return: SimilarityMatrix
+        """
+        if labels is None:
+            labels = {}
+            if 'query_neuron_name' in df.columns:
+                labels.update(zip(df[query], df['query_neuron_name']))
+            if 'label' in df.columns:
+                labels.update(zip(df[match], df['label']))
+        rows = zip(df[query].astype(str), df[match].astype(str), df[score])
+        return cls._from_rows(rows, dict(labels), dict(datasets) if datasets else {},
+                              similarity_score=similarity_score)
+
+    def save(self, path):
+        """Save the matrix as a compressed numpy archive.
+
+        :param path: File path (.npz).
+        """
+        m = self.matrix
+        np.savez_compressed(path,
+                            ids=encode_strings(self.ids),
+                            labels=encode_strings(self.labels),
+                            datasets=encode_strings(self.datasets),
+                            n=len(self.ids),
+                            indptr=m.indptr, indices=m.indices, data=m.data,
+                            dataset=self.dataset if self.dataset else '',
+                            similarity_score=self.similarity_score,
+                            min_score=np.nan if self.min_score is None else self.min_score,
+                            release=self.release if self.release else '',
+                            timestamp=self.timestamp)
+
+    @classmethod
+    def load(cls, path, max_age=None, release=None):
+        """Load a matrix saved with save.
+
+        :param path: File path (.npz).
+        :param max_age: Optional maximum age in seconds; older matrices are not loaded.
+        :param release: Optional release identifier; a matrix from a different release is not loaded.
+        :return: SimilarityMatrix or None if the file is missing, too old or from a different release.
+        """
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            timestamp = float(data['timestamp'])
+            if max_age and time.time() - timestamp > max_age:
+                return None
+            if release is not None and str(data['release']) != release:
+                return None
+            n = int(data['n'])
+            m = cls.__new__(cls)
+            m.ids = decode_strings(data['ids'], n)
+            m.labels = decode_strings(data['labels'], n)
+            m.datasets = decode_strings(data['datasets'], n)
+            m.index = {id: i for i, id in enumerate(m.ids)}
+            m.dataset = str(data['dataset']) or None
+            m.similarity_score = str(data['similarity_score'])
+            min_score = float(data['min_score'])
+            m.min_score = None if np.isnan(min_score) else min_score
+            m.release = str(data['release']) or None
+            m.timestamp = timestamp
+            m.matrix = csr_matrix((data['data'], data['indices'], data['indptr']), shape=(n, n))
+        return m
+
+    def __contains__(self, id):
+        return id in self.index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __repr__(self):
+        return "SimilarityMatrix(dataset=%s, score=%s, neurons=%d, pairs=%d)" % (
+            self.dataset, self.similarity_score, len(self), self.nnz // 2)
+
+    @property
+    def nnz(self):
+        """Number of stored scores (each pair is stored in both directions)."""
+        return self.matrix.nnz
+
+    def positions(self, neurons):
+        """Positions of neurons (unknown IDs are skipped).
+
+        :param neurons: A neuron ID or list of IDs.
+        :return: numpy array of positions.
+        """
+        neurons = [neurons] if isinstance(neurons, str) else neurons
+        return np.array([self.index[n] for n in neurons if n in self.index], dtype=np.int64)
+
+    def in_dataset(self, datasets):
+        """Positions of the neurons in one or more datasets.
+
+        :param datasets: A dataset short_form or list of short_forms.
+        :return: numpy array of positions.
+        """
+        datasets = {datasets} if isinstance(datasets, str) else set(datasets)
+        return np.array([i for i, ds in enumerate(self.datasets) if ds in datasets], dtype=np.int64)
+
+    def nearest(self, neurons=None, top_k=10, min_score=None, datasets=None, exclude_own_dataset=False,
+                return_dataframe=True):
+        """The best scoring matches of one or more neurons, best first.
+
+        :param neurons: Optional. A neuron ID or list of IDs. Default: all neurons of the exported dataset (or all).
+        :param top_k: Optional. Number of matches per neuron; None for all. Default 10.
+        :param min_score: Optional. Only return matches scoring >= min_score.
+        :param datasets: Optional. Only return matches in this dataset (or list of datasets).
+        :param exclude_own_dataset: Optional. Only return matches from other datasets than the query neuron's.
+            Default `False`
+        :param return_dataframe: Optional. Returns pandas DataFrame if `True`, otherwise returns list of dicts. Default `True`.
+        :return: A DataFrame or list of matches (query_neuron_id, query_neuron_name, id, label, dataset, score),
+            grouped by query neuron, as VfbConnect.get_similar_neurons_many.
+        """
+        positions = self._query_positions(neurons)
+        allowed = None
+        if datasets is not None:
+            allowed = np.zeros(len(self.ids), dtype=bool)
+            allowed[self.in_dataset(datasets)] = True
+        codes = pd.factorize(pd.Series(self.datasets))[0] if exclude_own_dataset else None
+        rows = []
+        m = self.matrix
+        for i in positions:
+            start, end = m.indptr[i], m.indptr[i + 1]
+            matches, scores = m.indices[start:end], m.data[start:end]
+            keep = np.ones(len(matches), dtype=bool)
+            if min_score is not None:
+                keep &= scores >= min_score
+            if allowed is not None:
+                keep &= allowed[matches]
+            if exclude_own_dataset and self.datasets[i]:
+                keep &= codes[matches] != codes[i]
+            matches, scores = matches[keep], scores[keep]
+            order = np.argsort(-scores, kind='stable')[:top_k]
+            rows.extend((self.ids[i], self.labels[i], self.ids[j], self.labels[j], self.datasets[j], float(s))
+                        for j, s in zip(matches[order], scores[order]))
+        if return_dataframe:
+            return pd.DataFrame.from_records(rows, columns=MATCH_COLUMNS)
+        return [dict(zip(MATCH_COLUMNS, row)) for row in rows]
+
+    def _query_positions(self, neurons):
+        if neurons is not None:
+            return self.positions(neurons)
+        if self.dataset:
+            return self.in_dataset(self.dataset)
+        return np.arange(len(self.ids))
+
+    def clusters(self, min_score, neurons=None, min_size=2):
+        """Groups of neurons linked by scores >= min_score (single linkage, i.e. connected components).
+
+        :param min_score: Minimum score for two neurons to be linked.
+        :param neurons: Optional. Only cluster these neurons (a neuron ID or list of IDs). Default: all neurons of
+            the exported dataset (or all).
+        :param min_size: Optional. Smallest cluster to report. Default 2.
+        :return: DataFrame of neuron_id, neuron_name, dataset, cluster and cluster_size, largest clusters first.
+        """
+        p = self._query_positions(neurons)
+        m = self.matrix[p][:, p]
+        m.data[m.data < min_score] = 0
+        m.eliminate_zeros()
+        n, labels = connected_components(m, directed=False)
+        sizes = np.bincount(labels, minlength=n)
+        # Renumber clusters from largest to smallest
+        order = np.argsort(-sizes, kind='stable')
+        rank = np.empty(n, dtype=np.int64)
+        rank[order] = np.arange(n)
+        df = pd.DataFrame({'neuron_id': [self.ids[i] for i in p], 'neuron_name': [self.labels[i] for i in p],
+                           'dataset': [self.datasets[i] for i in p], 'cluster': rank[labels],
+                           'cluster_size': sizes[labels]})
+        df = df[df['cluster_size'] >= min_size]
+        return df.sort_values(['cluster', 'neuron_id'], kind='stable').reset_index(drop=True)
+
+    def cross_dataset_matches(self, datasets=None, neurons=None, top_k=1, min_score=None, mutual=False,
+                              return_dataframe=True):
+        """The best matches of neurons among neurons of other datasets, e.g. to find the same cell in two
+        connectomes.
+
+        :param datasets: Optional. Only match to neurons in this dataset (or list of datasets). Default: any other
+            dataset.
+        :param neurons: Optional. A neuron ID or list of IDs. Default: all neurons of the exported dataset (or all).
+        :param top_k: Optional. Number of matches per neuron. Default 1.
+        :param min_score: Optional. Only return matches scoring >= min_score.
+        :param mutual: Optional. Only return pairs where each neuron is among the other's top_k matches from the
+            query neuron's dataset. Default `False`
+        :param return_dataframe: Optional. Returns pandas DataFrame if `True`, otherwise returns list of dicts. Default `True`.
+        :return: A DataFrame or list of matches as nearest.
+        """
+        matches = self.nearest(neurons, top_k=top_k, min_score=min_score, datasets=datasets,
+                               exclude_own_dataset=True, return_dataframe=False)
+        if mutual and matches:
+            back = set()
+            for ds in set(self.datasets[self.index[r['query_neuron_id']]] for r in matches):
+                sources = [r['id'] for r in matches if self.datasets[self.index[r['query_neuron_id']]] == ds]
+                back.update((r['id'], r['query_neuron_id'])
+                            for r in self.nearest(list(dict.fromkeys(sources)), top_k=top_k, min_score=min_score,
+                                                  datasets=ds or None, exclude_own_dataset=True,
+                                                  return_dataframe=False))
+            matches = [r for r in matches if (r['query_neuron_id'], r['id']) in back]
+        if return_dataframe:
+            return pd.DataFrame.from_records(matches, columns=MATCH_COLUMNS)
+        return matches
+
+    def subset(self, neurons):
+        """Scores between a subset of the neurons.
+
+        :param neurons: List of neuron IDs (unknown IDs are skipped).
+        :return: SimilarityMatrix
+        """
+        p = self.positions(list(dict.fromkeys(neurons)))
+        sub = self.matrix[p][:, p].tocoo()
+        return SimilarityMatrix([self.ids[i] for i in p], [self.labels[i] for i in p],
+                                [self.datasets[i] for i in p], sub.row, sub.col, sub.data, dataset=self.dataset,
+                                similarity_score=self.similarity_score, min_score=self.min_score,
+                                release=self.release, timestamp=self.timestamp)
+
+    def to_dataframe(self, min_score=None):
+        """All scored pairs (each once) as an edge list.
+
+        :param min_score: Optional. Minimum score.
+        :return: DataFrame of neuron_id, match_id and score.
+        """
+        m = self.matrix.tocoo()
+        keep = m.row < m.col
+        if min_score is not None:
+            keep &= m.data >= min_score
+        ids = np.array(self.ids, dtype=object)
+        return pd.DataFrame({'neuron_id': ids[m.row[keep]], 'match_id': ids[m.col[keep]], 'score': m.data[keep]})
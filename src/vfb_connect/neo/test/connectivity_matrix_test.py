@@ -0,0 +1,105 @@
+import os
+import tempfile
+import unittest
+import pandas as pd
+from ..connectivity_matrix import ConnectivityMatrix, aggregate_by_type, type_matrix
+
+
+class ConnectivityMatrixTest(unittest.TestCase):
+
+    def setUp(self):
+        # a -> b (10), a -> c (3), b -> c (7), c -> a (1); d has no connections
+        self.cm = ConnectivityMatrix(['VFB_a', 'VFB_b', 'VFB_c', 'VFB_d'], ['A', 'B', 'C', 'D'],
+                                     upstream=[0, 0, 1, 2], downstream=[1, 2, 2, 0], weights=[10, 3, 7, 1],
+                                     dataset='ds', release='4:VFB_d')
+
+    def test_partners(self):
+        down = self.cm.downstream('VFB_a')
+        self.assertEqual(list(down['partner_neuron_id']), ['VFB_b', 'VFB_c'])
+        self.assertEqual(list(down['weight']), [10, 3])
+        self.assertEqual(list(down.columns), ['query_neuron_id', 'query_neuron_name', 'partner_neuron_id',
+                                              'partner_neuron_name', 'weight'])
+        up = self.cm.upstream(['VFB_c', 'VFB_d', 'VFB_x'], weight=5, return_dataframe=False)
+        self.assertEqual(up, [{'query_neuron_id': 'VFB_c', 'query_neuron_name': 'C', 'partner_neuron_id': 'VFB_b',
+                               'partner_neuron_name': 'B', 'weight': 7}])
+
+    def test_subset(self):
+        sub = self.cm.subset(['VFB_b', 'VFB_c', 'VFB_x'])
+        self.assertEqual(sub.ids, ['VFB_b', 'VFB_c'])
+        self.assertEqual(sub.nnz, 1)
+        self.assertEqual(list(sub.downstream('VFB_b')['weight']), [7])
+
+    def test_from_dataframe(self):
+        df = self.cm.to_dataframe(weight=3)
+        self.assertEqual(len(df), 3)
+        cm = ConnectivityMatrix.from_dataframe(df, labels={'VFB_a': 'A'})
+        self.assertEqual(cm.nnz, 3)
+        self.assertEqual(cm.downstream('VFB_a')['query_neuron_name'][0], 'A')
+        self.assertTrue(isinstance(cm.to_dataframe(), pd.DataFrame))
+
+    def test_save_load(self):
+        path = os.path.join(tempfile.mkdtemp(), 'connectivity.npz')
+        self.cm.save(path)
+        loaded = ConnectivityMatrix.load(path, release='4:VFB_d')
+        self.assertEqual(loaded.ids, self.cm.ids)
+        self.assertEqual(loaded.labels, self.cm.labels)
+        self.assertEqual(loaded.dataset, 'ds')
+        self.assertEqual((loaded.matrix != self.cm.matrix).nnz, 0)
+        self.assertIsNone(ConnectivityMatrix.load(path, release='5:VFB_e'))
+
+    def test_aggregate_by_type(self):
+        types = pd.DataFrame({'neuron_id': ['VFB_a', 'VFB_b', 'VFB_c', 'VFB_c', 'VFB_d'],
+                              'class_id': ['FBbt_1', 'FBbt_1', 'FBbt_2', 'FBbt_3', 'FBbt_2']})
+        agg = aggregate_by_type(self.cm.to_dataframe(), types)
+        rows = {(r.upstream_class_id, r.downstream_class_id): (r.connections, r.weight, r.upstream_neurons,
+                                                                r.downstream_neurons) for r in agg.itertuples()}
+        self.assertEqual(rows, {('FBbt_1', 'FBbt_1'): (1, 10, 1, 1), ('FBbt_1', 'FBbt_2'): (2, 10, 2, 1),
+                                ('FBbt_1', 'FBbt_3'): (2, 10, 2, 1), ('FBbt_2', 'FBbt_1'): (1, 1, 1, 1),
+                                ('FBbt_3', 'FBbt_1'): (1, 1, 1, 1)})
+        self.assertEqual(agg['weight'].iloc[0], 10)
+        matrix = type_matrix(agg, value='connections', labels={'FBbt_1': 'one'})
+        self.assertEqual(matrix.loc['one', 'FBbt_2'], 2)
+        self.assertEqual(matrix.loc['FBbt_2', 'FBbt_3'], 0)
+        self.assertTrue(aggregate_by_type(self.cm.to_dataframe(weight=100), types).empty)
+
+
+    def test_reachable(self):
+        hops = dict(zip(*[self.cm.reachable('VFB_a')[c] for c in ['neuron_id', 'hop']]))
+        self.assertEqual(hops, {'VFB_a': 0, 'VFB_b': 1, 'VFB_c': 1})
+        hops = self.cm.reachable(['VFB_a'], weight=5, return_dataframe=False)
+        self.assertEqual([(r['neuron_id'], r['hop']) for r in hops], [('VFB_a', 0), ('VFB_b', 1), ('VFB_c', 2)])
+        self.assertEqual(len(self.cm.reachable('VFB_a', weight=5, max_hops=1)), 2)
+        up = self.cm.reachable('VFB_a', upstream=True, return_dataframe=False)
+        self.assertEqual([r['neuron_id'] for r in up], ['VFB_a', 'VFB_c', 'VFB_b'])
+
+    def test_paths(self):
+        p = self.cm.paths('VFB_a', ['VFB_c', 'VFB_d'], return_dataframe=False)
+        self.assertEqual(len(p), 1)
+        self.assertEqual((p[0]['path'], p[0]['hops'], p[0]['weights']), (['VFB_a', 'VFB_c'], 1, [3]))
+        # The strongest path goes through b
+        p = self.cm.paths('VFB_a', 'VFB_c', weighted=True, return_dataframe=False)
+        self.assertEqual((p[0]['path'], p[0]['min_weight']), (['VFB_a', 'VFB_b', 'VFB_c'], 7))
+        self.assertAlmostEqual(p[0]['cost'], 1 / 10 + 1 / 7)
+        self.assertTrue(self.cm.paths('VFB_a', 'VFB_c', weighted=True, max_hops=1).empty)
+        self.assertEqual(self.cm.paths('VFB_a', 'VFB_c', weight=5)['path'][0], ['VFB_a', 'VFB_b', 'VFB_c'])
+
+    def test_covers(self):
+        # Only a and b are dataset members, so the out-edges of c (a partner outside the dataset) may be missing
+        cm = ConnectivityMatrix(self.cm.ids, self.cm.labels, upstream=[0, 0, 1, 2], downstream=[1, 2, 2, 0],
+                                weights=[10, 3, 7, 1], dataset='ds', min_weight=3, members=[True, True, False, False])
+        self.assertTrue(cm.covers(['VFB_a'], max_hops=1, weight=3))
+        self.assertTrue(cm.covers(['VFB_a'], max_hops=3, weight=8))
+        self.assertFalse(cm.covers(['VFB_a'], max_hops=2, weight=3))
+        self.assertFalse(cm.covers(['VFB_a'], max_hops=1, weight=0))
+        self.assertFalse(cm.covers(['VFB_x'], max_hops=1, weight=3))
+        # Connections between a set of neurons, or a subset, never cover a walk
+        self.assertFalse(self.cm.covers(['VFB_a'], max_hops=1))
+        self.assertFalse(cm.subset(['VFB_a', 'VFB_b']).covers(['VFB_a'], max_hops=1, weight=3))
+        path = os.path.join(tempfile.mkdtemp(), 'connectivity.npz')
+        cm.save(path)
+        self.assertEqual(list(ConnectivityMatrix.load(path).members), [True, True, False, False])
+        self.cm.save(path)
+        self.assertIsNone(ConnectivityMatrix.load(path).members)
+
+if __name__ == '__main__':
+    unittest.main()
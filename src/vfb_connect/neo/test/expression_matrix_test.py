@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+from ..expression_matrix import ExpressionMatrix
+
+
+class ExpressionMatrixTest(unittest.TestCase):
+
+    def setUp(self):
+        # clusters c1 and c2 are FBbt_1, c3 is FBbt_2
+        self.em = ExpressionMatrix(['VFBc_1', 'VFBc_2', 'VFBc_3'], ['c1', 'c2', 'c3'],
+                                   ['FBbt_1', 'FBbt_1', 'FBbt_2'], ['one', 'one', 'two'], ['ds', 'ds', 'ds'],
+                                   ['FBgn_a', 'FBgn_b'], ['a', 'b'],
+                                   rows=[0, 0, 1, 2], cols=[0, 1, 0, 1], level=[2.0, 1.0, 4.0, 3.0],
+                                   extent=[0.5, 0.1, 0.9, 0.2], release='3:VFBc_3')
+
+    def test_to_dataframe(self):
+        df = self.em.to_dataframe()
+        self.assertEqual(df.loc['VFBc_2', 'FBgn_a'], 4.0)
+        self.assertEqual(df.loc['VFBc_2', 'FBgn_b'], 0)
+        self.assertEqual(df.index.dtype, 'category')
+        df = self.em.to_dataframe(value='extent', by='cell_type', use_labels=True, sparse=False)
+        self.assertEqual(list(df.index), ['one', 'two'])
+        self.assertAlmostEqual(df.loc['one', 'a'], 0.9, places=5)
+        df = self.em.to_dataframe(by='cell_type', agg='mean', sparse=False)
+        self.assertAlmostEqual(df.loc['FBbt_1', 'FBgn_a'], 3.0)
+        self.assertAlmostEqual(df.loc['FBbt_1', 'FBgn_b'], 0.5)
+        with self.assertRaises(ValueError):
+            self.em.matrix('mean')
+
+    def test_subset_and_long(self):
+        sub = self.em.subset(cell_types=['FBbt_1'], genes=['FBgn_b', 'FBgn_x'])
+        self.assertEqual(sub.cluster_ids, ['VFBc_1', 'VFBc_2'])
+        self.assertEqual(sub.nnz, 1)
+        long = self.em.to_long()
+        self.assertEqual(len(long), 4)
+        row = long[(long['cluster_id'] == 'VFBc_3')].iloc[0]
+        self.assertEqual((row['cell_type'], row['gene']), ('two', 'b'))
+        self.assertAlmostEqual(row['extent'], 0.2, places=5)
+
+    def test_empty(self):
+        sub = self.em.subset(genes=['FBgn_x'])
+        self.assertEqual((len(sub), sub.nnz, sub.gene_ids), (3, 0, []))
+        self.assertTrue(sub.to_long().empty)
+        sub = self.em.subset(cell_types=['FBbt_x'])
+        self.assertEqual((len(sub), sub.nnz), (0, 0))
+        self.assertTrue(sub.to_dataframe(by='cell_type', sparse=False).empty)
+        empty = ExpressionMatrix([], [], [], [], [], [], [], rows=[], cols=[], level=[], extent=[])
+        long = empty.to_long()
+        self.assertTrue(long.empty)
+        self.assertIn('extent', long.columns)
+
+    def test_save_load(self):
+        path = os.path.join(tempfile.mkdtemp(), 'expression.npz')
+        self.em.save(path)
+        loaded = ExpressionMatrix.load(path, release='3:VFBc_3')
+        self.assertEqual(loaded.cell_type_labels, self.em.cell_type_labels)
+        self.assertEqual(loaded.gene_ids, self.em.gene_ids)
+        self.assertEqual((loaded.extent != self.em.extent).nnz, 0)
+        self.assertIsNone(ExpressionMatrix.load(path, release='4:VFBc_4'))
+
+
+if __name__ == '__main__':
+    unittest.main()
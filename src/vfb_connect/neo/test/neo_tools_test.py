@@ -89,5 +89,11 @@ class Neo4jConnectTest(unittest.TestCase):
         lookup = self.nc.get_lookup(limit_type_by_prefix=['FBbt'], include_individuals=False, include_synonyms=False)
         self.assertIsNotNone(lookup)  # Added an assertion to validate the lookup
 
+    def test_commit_list_parameters(self):
+        r = self.nc.commit_list([{'statement': "MATCH (n:Class) WHERE n.short_form IN $ids RETURN n.label",
+                                  'parameters': {'ids': ['FBbt_00003748', "O'Brien"]}}])
+        self.assertTrue(r)
+        self.assertEqual([d['row'][0] for d in r[0]['data']], ['medulla'])
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+from ..query_profiler import QueryProfiler, db_hits
+
+
+class VfbConnect:
+    """Stands in for the entry point class a query is attributed to."""
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def get_thing(self):
+        return Helper(self.profiler).run()
+
+
+class Helper:
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def run(self):
+        return self.profiler.record([{'statement': 'MATCH (n) RETURN n'}], 0.5, 100,
+                                    [{'columns': ['n'], 'data': [{'row': [1]}, {'row': [2]}]}])
+
+
+class QueryProfilerTest(unittest.TestCase):
+
+    def test_record(self):
+        qp = QueryProfiler()
+        seen = []
+        qp.hooks.append(seen.append)
+        r = qp.record([{'statement': 'A', 'parameters': {'id': 'x'}}, {'statement': 'B'}], 1.0, 10,
+                      [{'data': [{'row': [1]}]}, {'data': []}])
+        self.assertEqual(len(r), 2)
+        self.assertEqual(seen, r)
+        self.assertEqual(r[0]['caller'], 'QueryProfilerTest.test_record')
+        self.assertEqual((r[0]['time'], r[0]['bytes'], r[0]['rows'], r[1]['rows']), (0.5, 5, 1, 0))
+        self.assertIsNone(r[0]['db_hits'])
+        qp.record([{'statement': 'A'}], 2.0, error='Query error')
+        df = qp.to_dataframe()
+        self.assertEqual(len(df), 3)
+        report = qp.report()
+        self.assertEqual(list(report['statement']), ['A', 'B'])
+        self.assertEqual(report.iloc[0]['calls'], 2)
+        self.assertEqual(report.iloc[0]['failures'], 1)
+        qp.reset()
+        self.assertEqual(qp.records, [])
+
+    def test_caller(self):
+        qp = QueryProfiler()
+        r = VfbConnect(qp).get_thing()
+        self.assertEqual(r[0]['caller'], 'VfbConnect.get_thing')
+        self.assertEqual(r[0]['rows'], 2)
+
+    def test_profile_db_hits(self):
+        qp = QueryProfiler(profile_db_hits=True)
+        s = qp.instrument([{'statement': 'MATCH (n) RETURN n'}, {'statement': 'EXPLAIN MATCH (n) RETURN n'}])
+        self.assertEqual([x['statement'] for x in s], ['PROFILE MATCH (n) RETURN n', 'EXPLAIN MATCH (n) RETURN n'])
+        plan = {'dbHits': 3, 'children': [{'dbHits': 4, 'children': []}, {'dbHits': 1}]}
+        self.assertEqual(db_hits(plan), 8)
+        r = qp.record(s[:1], 0.1, 10, [{'data': [], 'profile': plan}])
+        self.assertEqual(r[0]['statement'], 'MATCH (n) RETURN n')
+        self.assertEqual(r[0]['db_hits'], 8)
+
+    def test_failing_hook(self):
+        def hook(record):
+            raise ValueError('down')
+        qp = QueryProfiler(hooks=[hook], max_records=2)
+        for i in range(3):
+            qp.record([{'statement': str(i)}], 0.1)
+        self.assertEqual([r['statement'] for r in qp.records], ['1', '2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+import pandas as pd
+from ..similarity_matrix import SimilarityMatrix
+
+
+class SimilarityMatrixTest(unittest.TestCase):
+
+    def setUp(self):
+        # a, b and c are in ds1, d and e in ds2; a-d is scored in both directions
+        self.sm = SimilarityMatrix(['VFB_a', 'VFB_b', 'VFB_c', 'VFB_d', 'VFB_e'], ['A', 'B', 'C', 'D', 'E'],
+                                   ['ds1', 'ds1', 'ds1', 'ds2', 'ds2'],
+                                   rows=[0, 0, 3, 1, 2, 1], cols=[1, 3, 0, 4, 4, 3], scores=[0.9, 0.6, 0.7, 0.8, 0.3, 0.5],
+                                   dataset='ds1', release='5:VFB_e')
+
+    def test_nearest(self):
+        self.assertEqual(self.sm.nnz, 10)
+        near = self.sm.nearest('VFB_a', top_k=2)
+        self.assertEqual(list(near['id']), ['VFB_b', 'VFB_d'])
+        self.assertAlmostEqual(near['score'][1], 0.7, places=5)
+        self.assertEqual(list(near.columns), ['query_neuron_id', 'query_neuron_name', 'id', 'label', 'dataset', 'score'])
+        near = self.sm.nearest(['VFB_b', 'VFB_x'], min_score=0.6, datasets='ds2', return_dataframe=False)
+        self.assertEqual([(r['query_neuron_id'], r['id']) for r in near], [('VFB_b', 'VFB_e')])
+        # Defaults to the neurons of the exported dataset
+        self.assertEqual(set(self.sm.nearest()['query_neuron_id']), {'VFB_a', 'VFB_b', 'VFB_c'})
+
+    def test_clusters(self):
+        clusters = self.sm.clusters(0.75)
+        self.assertEqual(list(clusters['neuron_id']), ['VFB_a', 'VFB_b'])
+        clusters = self.sm.clusters(0.75, neurons=self.sm.ids)
+        self.assertEqual(list(clusters['cluster_size']), [3, 3, 3])
+        self.assertEqual(len(self.sm.clusters(0.2, min_size=1)), 3)
+
+    def test_cross_dataset_matches(self):
+        matches = self.sm.cross_dataset_matches(return_dataframe=False)
+        self.assertEqual([(r['query_neuron_id'], r['id']) for r in matches],
+                         [('VFB_a', 'VFB_d'), ('VFB_b', 'VFB_e'), ('VFB_c', 'VFB_e')])
+        # e's best match in ds1 is b
+        mutual = self.sm.cross_dataset_matches(mutual=True)
+        self.assertEqual(list(zip(mutual['query_neuron_id'], mutual['id'])), [('VFB_a', 'VFB_d'), ('VFB_b', 'VFB_e')])
+
+    def test_from_dataframe(self):
+        df = pd.DataFrame({'query_neuron_id': ['VFB_a', 'VFB_a'], 'query_neuron_name': ['A', 'A'],
+                           'id': ['VFB_b', 'VFB_c'], 'label': ['B', 'C'], 'score': [0.5, 0.4]})
+        sm = SimilarityMatrix.from_dataframe(df)
+        self.assertEqual(sm.ids, ['VFB_a', 'VFB_b', 'VFB_c'])
+        self.assertEqual(list(sm.nearest('VFB_c')['label']), ['A'])
+        self.assertEqual(len(sm.to_dataframe()), 2)
+
+    def test_save_load(self):
+        path = os.path.join(tempfile.mkdtemp(), 'similarity.npz')
+        self.sm.save(path)
+        loaded = SimilarityMatrix.load(path, release='5:VFB_e')
+        self.assertEqual(loaded.ids, self.sm.ids)
+        self.assertEqual(loaded.datasets, self.sm.datasets)
+        self.assertEqual(loaded.dataset, 'ds1')
+        self.assertIsNone(loaded.min_score)
+        self.assertEqual((loaded.matrix != self.sm.matrix).nnz, 0)
+        self.assertIsNone(SimilarityMatrix.load(path, release='6:VFB_f'))
+        sub = loaded.subset(['VFB_a', 'VFB_d'])
+        self.assertEqual(sub.nnz, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
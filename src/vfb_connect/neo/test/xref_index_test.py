@@ -0,0 +1,36 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from ..xref_index import XrefIndex
+
+
+class XrefIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        # 300 maps to two VFB IDs and VFB_c has two accessions
+        self.index = XrefIndex('db', [200, '100', '300', '300', '400'],
+                               ['VFB_b', 'VFB_a', 'VFB_d', 'VFB_c', 'VFB_c'], release='5:VFB_d')
+
+    def test_to_vfb_ids(self):
+        self.assertEqual(list(self.index.to_vfb_ids(['100', 200, '999', '300'])), ['VFB_a', 'VFB_b', None, 'VFB_c'])
+        self.assertEqual(self.index.vfb_id_mapping(['300', '999']), {'300': ['VFB_c', 'VFB_d']})
+
+    def test_to_accessions(self):
+        self.assertEqual(list(self.index.to_accessions(['VFB_c', 'VFB_x'])), ['300', None])
+        self.assertEqual(self.index.accession_mapping(['VFB_c', 'VFB_a']), {'VFB_c': ['300', '400'], 'VFB_a': ['100']})
+        self.assertEqual(list(XrefIndex('db', [], []).to_accessions(['VFB_a'])), [None])
+
+    def test_save_load(self):
+        path = os.path.join(tempfile.mkdtemp(), 'db')
+        self.index.save(path)
+        loaded = XrefIndex.load(path, release='5:VFB_d')
+        self.assertTrue(isinstance(loaded.accessions, np.memmap))
+        self.assertEqual(len(loaded), 5)
+        self.assertEqual(list(loaded.to_vfb_ids(['400', '100'])), ['VFB_c', 'VFB_a'])
+        self.assertIsNone(XrefIndex.load(path, release='6:VFB_e'))
+        self.assertIsNone(XrefIndex.load(os.path.join(path, 'missing')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+import json
+import os
+import time
+import numpy as np
+from .neo4j_tools import cypher_statement
+
+
+class XrefIndex:
+
+    """Cross references (database_cross_reference accessions) of one data source held locally as sorted arrays.
+
+    Accessions and VFB short_forms are each kept sorted with the matching ID of the other kind aligned, so both
+    directions are looked up by binary search (numpy.searchsorted) over whole arrays at once. Saved indexes are plain
+    .npy files that are memory-mapped on load.
+
+        :param db: short_form of the data source (Site), e.g. 'neuprint_JRC_Hemibrain_1point2point1'.
+        :param accessions: Sequence of accessions, one per cross reference.
+        :param vfb_ids: Sequence of VFB short_forms (same order as accessions).
+        :param release: Optional. Identifier of the data release the index was built from.
+        :param timestamp: Time the index was built (seconds since the epoch)."""
+
+    def __init__(self, db, accessions, vfb_ids, release=None, timestamp=None):
+        self.db = db
+        self.release = release
+        self.timestamp = timestamp if timestamp else time.time()
+        accessions = np.asarray([str(a) for a in accessions], dtype=str)
+        vfb_ids = np.asarray(list(vfb_ids), dtype=str)
+        order = np.lexsort((vfb_ids, accessions))
+        self.accessions, self.accession_vfb_ids = accessions[order], vfb_ids[order]
+        order = np.lexsort((accessions, vfb_ids))
+        self.vfb_ids, self.vfb_id_accessions = vfb_ids[order], accessions[order]
+
+    @classmethod
+    def from_neo(cls, nc, db, page_size=50000, release=None, verbose=False):
+        """Export all cross references of a data source from a VFB neo4j (PDB) connection, paged by VFB short_form.
+
+        :param nc: A Neo4jConnect object.
+        :param db: short_form of the data source.
+        :param page_size: Optional. Number of VFB entities per query. Default 50000.
+        :param release: Optional. Release identifier to record with the index.
+        :param verbose: Print progress if `True`.
+        :return: XrefIndex
+        """
+        query = "MATCH (s:Individual {short_form: $db})<-[:database_cross_reference]-(i:Entity) " \
+                "WHERE i.short_form > $last " \
+                "WITH DISTINCT s, i ORDER BY i.short_form LIMIT $page_size " \
+                "MATCH (s)<-[r:database_cross_reference]-(i) " \
+                "RETURN i.short_form, r.accession[0]"
+        accessions, vfb_ids = [], []
+        last = ''
+        print("Loading %s cross references from %s..." % (db, nc.base_uri)) if verbose else None
+        while True:
+            r = nc.commit_list([cypher_statement(query, {'db': db, 'last': last, 'page_size': page_size})])
+            if r is False:
+                raise ValueError("Failed to load cross references for %s after %s" % (db, last))
+            page = [d['row'] for d in r[0]['data'] if d['row'][1] is not None]
+            if not page:
+                break
+            for id, acc in page:
+                vfb_ids.append(id)
+                accessions.append(acc)
+            last = max(row[0] for row in page)
+            print("Loaded %d cross references" % len(accessions)) if verbose else None
+            if len(set(row[0] for row in page)) < page_size:
+                break
+        return cls(db, accessions, vfb_ids, release=release)
+
+    def save(self, path):
+        """Save the index as .npy arrays and a meta.json file in a directory.
+
+        :param path: Directory path (created if needed).
+        """
+        os.makedirs(path, exist_ok=True)
+        for name in ['accessions', 'accession_vfb_ids', 'vfb_ids', 'vfb_id_accessions']:
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'db': self.db, 'release': self.release, 'timestamp': self.timestamp}, f)
+
+    @classmethod
+    def load(cls, path, max_age=None, release=None, mmap=True):
+        """Load an index saved with save.
+
+        :param path: Directory path.
+        :param max_age: Optional maximum age in seconds; older indexes are not loaded.
+        :param release: Optional release identifier; an index from a different release is not loaded.
+        :param mmap: Optional. Memory-map the arrays rather than reading them into memory. Default `True`
+        :return: XrefIndex or None if the index is missing, too old or from a different release.
+        """
+        meta_file = os.path.join(path, 'meta.json')
+        if not os.path.exists(meta_file):
+            return None
+        with open(meta_file) as f:
+            meta = json.load(f)
+        if max_age and time.time() - meta['timestamp'] > max_age:
+            return None
+        if release is not None and meta['release'] != release:
+            return None
+        index = cls.__new__(cls)
+        index.db = meta['db']
+        index.release = meta['release']
+        index.timestamp = meta['timestamp']
+        for name in ['accessions', 'accession_vfb_ids', 'vfb_ids', 'vfb_id_accessions']:
+            setattr(index, name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r' if mmap else None))
+        return index
+
+    def __len__(self):
+        return len(self.accessions)
+
+    def __repr__(self):
+        return "XrefIndex(db=%s, xrefs=%d)" % (self.db, len(self))
+
+    @staticmethod
+    def _search(keys, queries):
+        """Binary search of queries in sorted keys; returns the start and end of the matching range of each."""
+        queries = np.asarray([str(q) for q in queries], dtype=str)
+        return np.searchsorted(keys, queries, side='left'), np.searchsorted(keys, queries, side='right')
+
+    def _first(self, keys, values, queries):
+        start, end = self._search(keys, queries)
+        found = end > start
+        out = np.full(len(start), None, dtype=object)
+        if len(keys):
+            out[found] = values[start[found]]
+        return out
+
+    def _all(self, keys, values, queries):
+        start, end = self._search(keys, queries)
+        return {str(q): [str(v) for v in values[s:e]] for q, s, e in zip(queries, start, end) if e > s}
+
+    def to_vfb_ids(self, accessions):
+        """VFB short_forms of accessions (the first, if an accession maps to several).
+
+        :param accessions: Sequence of accessions (ints are converted to strings).
+        :return: numpy object array of short_forms, None for unknown accessions.
+        """
+        return self._first(self.accessions, self.accession_vfb_ids, accessions)
+
+    def to_accessions(self, vfb_ids):
+        """Accessions of VFB short_forms (the first, if a short_form has several).
+
+        :param vfb_ids: Sequence of VFB short_forms.
+        :return: numpy object array of accessions, None for unknown short_forms.
+        """
+        return self._first(self.vfb_ids, self.vfb_id_accessions, vfb_ids)
+
+    def vfb_id_mapping(self, accessions):
+        """All VFB short_forms of each known accession.
+
+        :param accessions: Sequence of accessions.
+        :return: dict of accession: list of short_forms (unknown accessions are left out).
+        """
+        return self._all(self.accessions, self.accession_vfb_ids, accessions)
+
+    def accession_mapping(self, vfb_ids):
+        """All accessions of each known VFB short_form.
+
+        :param vfb_ids: Sequence of VFB short_forms.
+        :return: dict of short_form: list of accessions (unknown short_forms are left out).
+        """
+        return self._all(self.vfb_ids, self.vfb_id_accessions, vfb_ids)
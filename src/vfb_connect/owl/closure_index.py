@@ -0,0 +1,176 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from scipy.sparse import csr_matrix
+from ..neo.neo4j_tools import cypher_statement
+
+
+class ClosureIndex:
+
+    """Local index of the SUBCLASSOF/INSTANCEOF hierarchy for answering named class queries without the reasoner.
+
+    Entities are held as IRIs mapped to integer positions, with the direct edges stored as sparse adjacency
+    matrices (child -> parent for SUBCLASSOF, individual -> class for INSTANCEOF). Transitive closures are
+    computed by a breadth first walk over the sparse rows and memoised per entity (least recently used first out).
+
+        :param iris: Sequence of entity IRIs; positions in this list are used in the edge arrays.
+        :param subclass_edges: (n, 2) integer array of (child, parent) positions.
+        :param instance_edges: (n, 2) integer array of (individual, class) positions.
+        :param timestamp: Time the index was built (seconds since the epoch).
+        :param cache_size: Maximum number of closures kept in memory. Default 10000."""
+
+    def __init__(self, iris, subclass_edges, instance_edges=None, timestamp=None, cache_size=10000):
+        self.iris = list(iris)
+        self.index = {iri: i for i, iri in enumerate(self.iris)}
+        self.timestamp = timestamp if timestamp else time.time()
+        n = len(self.iris)
+        self._subclass_edges = np.asarray(subclass_edges, dtype=np.int32).reshape(-1, 2)
+        self._instance_edges = np.asarray(instance_edges if instance_edges is not None else [], dtype=np.int32).reshape(-1, 2)
+        self._parents = self._adjacency(self._subclass_edges[:, 0], self._subclass_edges[:, 1], n)
+        self._children = self._parents.T.tocsr()
+        self._types = self._adjacency(self._instance_edges[:, 0], self._instance_edges[:, 1], n)
+        self._instances = self._types.T.tocsr()
+        self.cache_size = cache_size
+        self._closure_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    @staticmethod
+    def _adjacency(rows, cols, n):
+        return csr_matrix((np.ones(len(rows), dtype=bool), (rows, cols)), shape=(n, n))
+
+    @staticmethod
+    def _edges_from_neo(nc, query, page_size, verbose=False):
+        """Page through (short_form, iri, related iri) rows of query in short_form order (keyset pagination)."""
+        edges = []
+        last = ''
+        while True:
+            r = nc.commit_list([cypher_statement(query, {'last': last, 'page_size': page_size})])
+            if r is False:
+                raise ValueError("Failed to load the class hierarchy for the closure index after %s" % last)
+            page = [d['row'] for d in r[0]['data']]
+            if not page:
+                break
+            edges.extend((a, b) for _, a, b in page if b is not None)
+            last = max(row[0] for row in page)
+            print("Loaded %d edges" % len(edges)) if verbose else None
+            if len(set(row[0] for row in page)) < page_size:
+                break
+        return edges
+
+    @classmethod
+    def from_neo(cls, nc, include_instances=True, page_size=50000, verbose=False):
+        """Build the index in bulk from a VFB neo4j (PDB) connection.
+
+        Classes (and individuals) are paged through in short_form order, loading the edges of page_size entities
+        per query.
+
+        :param nc: A Neo4jConnect object.
+        :param include_instances: Optional. Index INSTANCEOF edges so instance queries can be answered. Default `True`
+        :param page_size: Optional. Number of entities per query. Default 50000.
+        :param verbose: Print progress if `True`.
+        :return: ClosureIndex
+        """
+        print("Building local closure index from %s..." % nc.base_uri) if verbose else None
+        # The same statement is sent for every page so the server plans it once
+        subclasses = cls._edges_from_neo(nc, "MATCH (c:Class) WHERE c.short_form > $last "
+                                             "WITH c ORDER BY c.short_form LIMIT $page_size "
+                                             "OPTIONAL MATCH (c)-[:SUBCLASSOF]->(p:Class) "
+                                             "RETURN c.short_form, c.iri, p.iri", page_size, verbose)
+        instances = cls._edges_from_neo(nc, "MATCH (i:Individual) WHERE i.short_form > $last "
+                                            "WITH i ORDER BY i.short_form LIMIT $page_size "
+                                            "OPTIONAL MATCH (i)-[:INSTANCEOF]->(c:Class) "
+                                            "RETURN i.short_form, i.iri, c.iri", page_size, verbose) if include_instances else None
+        index = {}
+
+        def positions(rows):
+            return np.array([[index.setdefault(a, len(index)), index.setdefault(b, len(index))] for a, b in rows],
+                            dtype=np.int32).reshape(-1, 2)
+
+        subclass_edges = positions(subclasses)
+        instance_edges = positions(instances) if include_instances else None
+        print("Indexed %d entities, %d subclass and %d instance edges" % (
+            len(index), len(subclass_edges), len(instance_edges) if instance_edges is not None else 0)) if verbose else None
+        return cls(list(index.keys()), subclass_edges, instance_edges)
+
+    def save(self, path):
+        """Save the index as a compressed numpy archive.
+
+        :param path: File path (.npz).
+        """
+        np.savez_compressed(path,
+                            iris=np.frombuffer('\n'.join(self.iris).encode('utf-8'), dtype=np.uint8),
+                            subclass_edges=self._subclass_edges,
+                            instance_edges=self._instance_edges,
+                            timestamp=self.timestamp)
+
+    @classmethod
+    def load(cls, path, max_age=None):
+        """Load an index saved with save.
+
+        :param path: File path (.npz).
+        :param max_age: Optional maximum age in seconds; older indexes are not loaded.
+        :return: ClosureIndex or None if the file is missing or too old.
+        """
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            timestamp = float(data['timestamp'])
+            if max_age and time.time() - timestamp > max_age:
+                return None
+            iris = data['iris'].tobytes().decode('utf-8').split('\n')
+            return cls(iris, data['subclass_edges'], data['instance_edges'], timestamp=timestamp)
+
+    def __contains__(self, iri):
+        return iri in self.index
+
+    def __len__(self):
+        return len(self.iris)
+
+    def _walk(self, matrix, start, direct):
+        """Positions reachable from start by following matrix rows (one step if direct)."""
+        key = (id(matrix), start, direct)
+        with self._cache_lock:
+            if key in self._closure_cache:
+                self._closure_cache.move_to_end(key)
+                return self._closure_cache[key]
+        reached = matrix[start].indices
+        if not direct:
+            seen = np.zeros(matrix.shape[0], dtype=bool)
+            seen[reached] = True
+            frontier = reached
+            while frontier.size:
+                step = np.unique(matrix[frontier].indices)
+                frontier = step[~seen[step]]
+                seen[frontier] = True
+            seen[start] = False
+            reached = np.flatnonzero(seen)
+        with self._cache_lock:
+            self._closure_cache[key] = reached
+            while len(self._closure_cache) > self.cache_size:
+                self._closure_cache.popitem(last=False)
+        return reached
+
+    def subclasses(self, iri, direct=False):
+        """IRIs of the (direct) subclasses of a class."""
+        return [self.iris[i] for i in self._walk(self._children, self.index[iri], direct)]
+
+    def superclasses(self, iri, direct=False):
+        """IRIs of the (direct) superclasses of a class."""
+        return [self.iris[i] for i in self._walk(self._parents, self.index[iri], direct)]
+
+    def instances(self, iri, direct=False):
+        """IRIs of the (direct) instances of a class, including instances of its subclasses unless direct."""
+        start = self.index[iri]
+        classes = [start] if direct else [start] + list(self._walk(self._children, start, False))
+        found = np.unique(self._instances[classes].indices)
+        return [self.iris[i] for i in found]
+
+    def types(self, iri, direct=False):
+        """IRIs of the (direct) types of an individual, including their superclasses unless direct."""
+        classes = list(self._types[self.index[iri]].indices)
+        if not direct:
+            for c in list(classes):
+                classes.extend(self._walk(self._parents, c, False))
+        return [self.iris[i] for i in dict.fromkeys(classes)]
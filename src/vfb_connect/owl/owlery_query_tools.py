@@ -1,8 +1,18 @@
-from time import sleep
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+import atexit
+import os
+import pickle
+import tempfile
+import threading
+import weakref
 import requests
+from requests.adapters import HTTPAdapter
 import re
 import json
 from ..default_servers import get_default_servers
+from ..retry_policy import RetryPolicy
 
 
 def gen_short_form(iri):
@@ -14,6 +24,18 @@ def gen_short_form(iri):
     """
     return re.split('/|#', iri)[-1]
 
+# Owlery query types and the key each returns its results under
+QUERY_RETURN_TYPES = {'subclasses': 'superClassOf',
+                      'superclasses': 'subClassOf',
+                      'instances': 'hasInstance',
+                      'equivalent': 'equivalentClasses',
+                      'types': 'hasType'}
+
+# Quoted labels in Manchester syntax, allowing backslash-escaped internal quotes
+QUOTED_LABEL = re.compile(r"'((?:[^'\\]|\\.)+)'")
+# Short form IDs that can be converted straight to CURIEs without a lookup
+ID_PATTERN = re.compile(r"^(CARO|BFO|UBERON|GENO|CL|FB[a-z]*|VFB|VFBexp|VFBext|GO|SO|RO|PATO|CHEBI|PR|NCBITaxon|ENVO|OBI|IAO)_\w+$")
+
 class OWLeryConnect:
 
     """Wrapper class for querying the VFB OWLery endpoint.
@@ -25,15 +47,55 @@ class OWLeryConnect:
         :param lookup: Dict of name: ID;
         :param: obo_curies: list of prefixes for generation of OBO curies.
             Default: ('FBbt', 'RO')
-        :param: curies: Dict of curies"""
+        :param: curies: Dict of curies
+        :param: cache_size: Maximum number of query results kept in memory (least recently used are dropped).
+            Default: 256. Set to 0 to disable caching.
+        :param: cache_ttl: Age in seconds after which cached results are discarded. Default: one week.
+        :param: cache_file: Optional path to persist cached results between sessions.
+        :param: cache_save_delay: Seconds to wait after a result is cached before writing the cache file, so that
+            results arriving together are saved in one write. The file is also written at exit. Default: 5.
+        :param: cache_release: Optional release identifier, or a function returning one; a persisted cache from a
+            different release is discarded. A function is only called when the cache file is first read or written.
+        :param: closure_index: Optional ClosureIndex used to answer queries for a single named class locally.
+        :param: resolver: Optional function resolving labels missing from lookup to CURIEs
+            (e.g. VfbConnect.lookup_id with return_curie=True).
+        :param: retry_policy: Optional RetryPolicy for failed requests. Default: a new RetryPolicy.
+        :param: compiled_cache_size: Maximum number of label-substituted query strings kept by labels_2_ids
+            (least recently used are dropped). Default: 4096."""
 
     def __init__(self,
                  endpoint=get_default_servers()['owlery_endpoint'],
                  lookup=None,
                  obo_curies=('FBbt', 'RO', 'BFO'),
                  curies=None,
-                 obo_format=True):
+                 obo_format=True,
+                 cache_size=256,
+                 cache_ttl=7 * 24 * 60 * 60,
+                 cache_file=None,
+                 cache_save_delay=5,
+                 cache_release=None,
+                 closure_index=None,
+                 resolver=None,
+                 retry_policy=None,
+                 compiled_cache_size=4096):
         self.owlery_endpoint = endpoint
+        self.retry_policy = retry_policy if retry_policy else RetryPolicy(name='OWLery')
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.cache_file = cache_file
+        self.cache_save_delay = cache_save_delay
+        self.cache_release = cache_release
+        self._cache_loaded = False
+        self._query_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._save_timer = None
+        self._cache_dirty = False
+        self._session = None
+        self.closure_index = closure_index
+        self.resolver = resolver
+        self.compiled_cache_size = compiled_cache_size
+        self._compiled_lock = threading.Lock()
         if not (lookup):
             self.lookup = {}
         else:
@@ -44,6 +106,11 @@ class OWLeryConnect:
             self.curies = curies
         if obo_curies:
             self._add_obo_curies(obo_curies)
+        if self.cache_file:
+            # The cache file is read on first use (see _ensure_cache_loaded). Write any results still waiting for
+            # the save timer at exit, without keeping the object alive
+            ref = weakref.ref(self)
+            atexit.register(lambda: ref() and ref().flush_cache())
 
     def _add_obo_curies(self, prefixes):
 
@@ -51,6 +118,185 @@ class OWLeryConnect:
         c = {p : obolib + p + '_' for p in prefixes}
         self.curies.update(c)
 
+    @property
+    def cache_release(self):
+        """Release identifier stored with (and checked against) the cache file."""
+        if callable(self._cache_release):
+            self._cache_release = self._cache_release()
+        return self._cache_release
+
+    @cache_release.setter
+    def cache_release(self, cache_release):
+        self._cache_release = cache_release
+
+    @property
+    def lookup(self):
+        """Dict of name: ID used to resolve quoted labels."""
+        return self._lookup
+
+    @lookup.setter
+    def lookup(self, lookup):
+        self._lookup = lookup
+        self._compiled_queries = OrderedDict()
+
+    def _expression_iri(self, query):
+        """Return the IRI if query is a single named entity (<iri>, IRI or declared CURIE), otherwise None."""
+        expression = query.strip()
+        m = re.match(r"^<(\S+)>$", expression)
+        if m:
+            return m.group(1)
+        if re.match(r"^https?://\S+$", expression):
+            return expression
+        m = re.match(r"^([A-Za-z][\w.-]*):(\w+)$", expression)
+        if m and m.group(1) in self.curies:
+            return self.curies[m.group(1)] + m.group(2)
+        return None
+
+    def _query_closure_index(self, query_type, query, direct):
+        """Answer a single named class query from the local closure index, or return None to use the server."""
+        if query_type not in ('subclasses', 'superclasses', 'instances', 'types'):
+            return None
+        iri = self._expression_iri(query)
+        if not iri or iri not in self.closure_index:
+            return None
+        return getattr(self.closure_index, query_type)(iri, direct=direct)
+
+    def _cache_key(self, query_type, return_type, query, direct):
+        """Key for the query cache: whitespace-normalised expression plus everything else that changes the result."""
+        return (self.owlery_endpoint, query_type, return_type, ' '.join(query.split()), bool(direct), json.dumps(self.curies, sort_keys=True))
+
+    def _get_cached(self, key):
+        """Return a cached result for key, or None if missing or expired."""
+        self._ensure_cache_loaded()
+        with self._cache_lock:
+            entry = self._query_cache.get(key)
+            if entry is None:
+                return None
+            if time() - entry[0] > self.cache_ttl:
+                del self._query_cache[key]
+                return None
+            self._query_cache.move_to_end(key)
+            return list(entry[1])
+
+    def _set_cached(self, key, result):
+        """Add a result to the cache, dropping the least recently used entries over cache_size."""
+        if not self.cache_size:
+            return
+        self._ensure_cache_loaded()
+        with self._cache_lock:
+            self._query_cache[key] = (time(), list(result))
+            self._query_cache.move_to_end(key)
+            while len(self._query_cache) > self.cache_size:
+                self._query_cache.popitem(last=False)
+            if self.cache_file:
+                self._cache_dirty = True
+                if self._save_timer is None:
+                    self._save_timer = threading.Timer(self.cache_save_delay, self.flush_cache)
+                    self._save_timer.daemon = True
+                    self._save_timer.start()
+
+    @property
+    def session(self):
+        """Pooled HTTP session shared by all queries (and threads) on this connection."""
+        if self._session is None:
+            self._session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+            self._session.mount('http://', adapter)
+            self._session.mount('https://', adapter)
+        return self._session
+
+    def _ensure_cache_loaded(self):
+        """Read the cache file (and resolve cache_release) the first time the cache is used."""
+        if self._cache_loaded or not self.cache_file:
+            return
+        with self._save_lock:
+            if not self._cache_loaded:
+                self._load_query_cache()
+                self._cache_loaded = True
+
+    def _load_query_cache(self):
+        """Load unexpired results from the cache file if it matches the current release."""
+        release = self.cache_release
+        try:
+            if os.path.exists(self.cache_file):
+                with open(self.cache_file, 'rb') as f:
+                    cached_data = pickle.load(f)
+                if cached_data.get('cache_release') != release:
+                    print("OWLery cache is from a different release, ignoring it.")
+                    return
+                now = time()
+                with self._cache_lock:
+                    for key, entry in cached_data.get('query_data', {}).items():
+                        if now - entry[0] <= self.cache_ttl:
+                            self._query_cache.setdefault(key, entry)
+                    while len(self._query_cache) > self.cache_size:
+                        self._query_cache.popitem(last=False)
+        except Exception as e:
+            print(f"Failed to load OWLery cache from disk: {e}")
+
+    def flush_cache(self):
+        """Write the query cache to the cache file now if results have been added since it was last written.
+
+        The cache is copied under the cache lock but written outside it, to a temporary file that then replaces
+        the cache file, so queries are not held up and a partly written file is never left behind.
+        """
+        if not self.cache_file:
+            return
+        with self._save_lock:
+            with self._cache_lock:
+                if self._save_timer is not None:
+                    self._save_timer.cancel()
+                    self._save_timer = None
+                if not self._cache_dirty:
+                    return
+                self._cache_dirty = False
+                cache_data = {
+                    'cache_timestamp': time(),
+                    'cache_release': self.cache_release,
+                    'query_data': dict(self._query_cache)
+                }
+            try:
+                fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.cache_file)),
+                                                 suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        pickle.dump(cache_data, f)
+                    os.replace(temp_file, self.cache_file)
+                except BaseException:
+                    os.remove(temp_file)
+                    raise
+            except Exception as e:
+                print(f"Failed to save OWLery cache to disk: {e}")
+
+    def clear_cache(self):
+        """Clear cached query results from memory and disk."""
+        with self._save_lock:
+            with self._cache_lock:
+                self._query_cache.clear()
+                self._cache_dirty = False
+                if self._save_timer is not None:
+                    self._save_timer.cancel()
+                    self._save_timer = None
+            if self.cache_file and os.path.exists(self.cache_file):
+                os.remove(self.cache_file)
+
+    def _query_locally(self, query_type, return_type, query, direct, verbose=False):
+        """Answer a (label resolved) query from the closure index or the query cache if possible.
+
+        :return: (list of IRIs or None if the endpoint must be queried, cache key for the result)
+        """
+        if self.closure_index is not None:
+            local = self._query_closure_index(query_type, query, direct)
+            if local is not None:
+                if verbose:
+                    print("\033[32mLocal closure index results:\033[0m " + str(len(local)))
+                return local, None
+        key = self._cache_key(query_type, return_type, query, direct)
+        cached = self._get_cached(key)
+        if cached is not None and verbose:
+            print("\033[32mCached results:\033[0m " + str(len(cached)))
+        return cached, key
+
     def query(self, query_type, return_type,
               query, query_by_label=True, direct=False, verbose=False):
         """
@@ -65,32 +311,78 @@ class OWLeryConnect:
         :param query_by_label: Boolean. Default False.
         :param direct: Boolean. Default False. Determines T/F
         :param verbose - print verbose output to stdout for debugging purposes.
-        :return: list of IRIs.
+        :return: list of IRIs. Successful results are cached (see cache_size/cache_ttl).
         """
         owl_endpoint = self.owlery_endpoint + query_type +"?"
         if query_by_label:
             query = self.labels_2_ids(query)
         if verbose:
             print("Running query: " + query)
+        local, key = self._query_locally(query_type, return_type, query, direct, verbose)
+        if local is not None:
+            return local
         payload = {'object': query, 'prefixes': json.dumps(self.curies),
                    'direct': direct}
         # print(payload)
         try:
-            r = requests.get(url=owl_endpoint, params=payload)
+            r = self.retry_policy.call(self.session.get, url=owl_endpoint, params=payload)
         except requests.exceptions.RequestException as e:
             print("\033[31mConnection Error:\033[0m " + str(e))
-            sleep(15)
-            return query(query_type, return_type, query, query_by_label, direct, verbose)
+            return False
         if verbose:
             print("Query URL: " + r.url)
         if r.status_code == 200:
             if verbose:
                 print("\033[32mQuery results:\033[0m " + str(len(r.json()[return_type])))
-            return r.json()[return_type]
+            result = r.json()[return_type]
+            self._set_cached(key, result)
+            return result
         else:
             print("\033[31mConnection Error:\033[0m " + str(r.content))
             return False
 
+    def query_many(self, queries, query_type='subclasses', query_by_label=True, direct=False, return_short_forms=True,
+                   max_workers=8, verbose=False):
+        """Run many queries of the same type concurrently.
+
+        Duplicate queries are only run once, cached results are reused and the remaining queries are sent in
+        parallel over a pooled session, at most max_workers at a time.
+
+        :param queries: An iterable of Manchester syntax queries (see query).
+        :param query_type: Options: subclasses, superclasses, instances, equivalent, types. Default subclasses.
+        :param query_by_label: Optional.  If `False``, queries take CURIEs instead of labels.  Default `True`
+        :param direct: Return direct results only.  Default `False`
+        :param return_short_forms: Optional.  If `True`, returns short_forms instead of IRIs. Default `True`
+        :param max_workers: Maximum number of concurrent requests. Default 8.
+        :param verbose: print verbose output to stdout for debugging purposes.
+        :return: Dict of query: list of IRIs or short_forms. Failed queries map to an empty list.
+        :rtype: dict
+        """
+        if query_type not in QUERY_RETURN_TYPES:
+            raise ValueError("Unknown query_type '%s'. Options: %s" % (query_type, ', '.join(QUERY_RETURN_TYPES)))
+        unique = list(dict.fromkeys(queries))
+        if verbose:
+            print("Running %d unique %s queries" % (len(unique), query_type))
+
+        def run(q):
+            try:
+                return self.query(query_type=query_type, return_type=QUERY_RETURN_TYPES[query_type],
+                                  query=q, query_by_label=query_by_label, direct=direct, verbose=verbose)
+            except ValueError as e:
+                print("\033[33mWarning:\033[0m " + str(e))
+                return False
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = dict(zip(unique, executor.map(run, unique)))
+        out = {}
+        for q, result in results.items():
+            if not isinstance(result, list):
+                print("\033[33mWarning:\033[0m No results! This is likely due to a query error")
+                print("Query: " + q)
+                result = []
+            out[q] = list(map(gen_short_form, result)) if return_short_forms else result
+        return out
+
     def get_subclasses(self, query, query_by_label=True, direct=False, return_short_forms=True, verbose=False):
         """Generate list of IDs of all subclasses of class_expression.
 
@@ -170,22 +462,40 @@ class OWLeryConnect:
     def labels_2_ids(self, query_string):
         """Substitutes labels for CURIEs in a query string
 
+        The expression is parsed once, all distinct labels are resolved together (exact lookup matches and IDs
+        directly, anything else via the resolver) and the compiled expression is cached by input string (up to
+        compiled_cache_size strings, least recently used first out).
+
         :param query_string: A OWL class expression in which all labels of OWL entities are single-quoted.  Internal
         single quotes should be escaped with a backslash.
         :return: query string in which labels have been converted to unquoted CURIEs.
         """
-        from vfb_connect import vfb
-        def subgp1_or_fail(m):
-            out = vfb.lookup_id(m.group(1), return_curie=True)
+        with self._compiled_lock:
+            if query_string in self._compiled_queries:
+                self._compiled_queries.move_to_end(query_string)
+                return self._compiled_queries[query_string]
+        labels = dict.fromkeys(m.group(1) for m in QUOTED_LABEL.finditer(query_string))
+        resolved = {}
+        unknown = []
+        for quoted in labels:
+            label = quoted.replace("\\'", "'")
+            if label in self.lookup:
+                out = self.lookup[label]
+            elif ID_PATTERN.match(label):
+                out = label
+            elif self.resolver:
+                out = self.resolver(label, return_curie=True)
+            else:
+                out = None
             if not out:
-                raise ValueError("Query includes unknown term label: " + query_string)
+                unknown.append(label)
             else:
-                return out
-
-        # This doesn't deal well with failure -> lambda too separate function
-        return re.sub(r"'(.+?)'", lambda m: subgp1_or_fail(m), query_string)
-
-
-
-
-
+                resolved[quoted] = out.replace('_', ':') if ID_PATTERN.match(out) else out
+        if unknown:
+            raise ValueError("Query includes unknown term label(s) %s: %s" % (unknown, query_string))
+        compiled = QUOTED_LABEL.sub(lambda m: resolved[m.group(1)], query_string)
+        with self._compiled_lock:
+            self._compiled_queries[query_string] = compiled
+            while len(self._compiled_queries) > self.compiled_cache_size:
+                self._compiled_queries.popitem(last=False)
+        return compiled
@@ -0,0 +1,69 @@
+import os
+import tempfile
+import unittest
+from ..closure_index import ClosureIndex
+
+
+class FakeHierarchyNeo:
+    """Answers the paged closure index queries from in-memory edges."""
+
+    base_uri = 'fake'
+
+    def __init__(self, subclass_of, instance_of):
+        self.edges = {'c.short_form': subclass_of, 'i.short_form': instance_of}
+        self.statements = []
+
+    def commit_list(self, statements):
+        self.statements.extend(statements)
+        s = statements[0]
+        edges = self.edges['c.short_form' if 'MATCH (c:Class) WHERE' in s['statement'] else 'i.short_form']
+        page = sorted(k for k in edges if k > s['parameters']['last'])[:s['parameters']['page_size']]
+        return [{'data': [{'row': [k, k, p]} for k in page for p in (edges[k] or [None])]}]
+
+
+class ClosureIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        # 1 <- 2 <- {3, 4} <- 5 with individuals a (of 5) and b (of 2)
+        self.iris = ['FBbt_1', 'FBbt_2', 'FBbt_3', 'FBbt_4', 'FBbt_5', 'VFB_a', 'VFB_b']
+        self.ci = ClosureIndex(self.iris,
+                               subclass_edges=[[1, 0], [2, 1], [3, 1], [4, 3], [4, 2]],
+                               instance_edges=[[5, 4], [6, 1]])
+
+    def test_subclasses(self):
+        self.assertEqual(set(self.ci.subclasses('FBbt_2')), {'FBbt_3', 'FBbt_4', 'FBbt_5'})
+        self.assertEqual(set(self.ci.subclasses('FBbt_2', direct=True)), {'FBbt_3', 'FBbt_4'})
+
+    def test_superclasses(self):
+        self.assertEqual(set(self.ci.superclasses('FBbt_5')), {'FBbt_1', 'FBbt_2', 'FBbt_3', 'FBbt_4'})
+
+    def test_instances(self):
+        self.assertEqual(set(self.ci.instances('FBbt_1')), {'VFB_a', 'VFB_b'})
+        self.assertEqual(self.ci.instances('FBbt_2', direct=True), ['VFB_b'])
+
+    def test_save_load(self):
+        path = os.path.join(tempfile.mkdtemp(), 'closure_index.npz')
+        self.ci.save(path)
+        loaded = ClosureIndex.load(path)
+        self.assertEqual(loaded.iris, self.iris)
+        self.assertEqual(set(loaded.subclasses('FBbt_1')), set(self.ci.subclasses('FBbt_1')))
+
+    def test_from_neo(self):
+        nc = FakeHierarchyNeo({'FBbt_1': [], 'FBbt_2': ['FBbt_1'], 'FBbt_3': ['FBbt_2'], 'FBbt_4': ['FBbt_2'],
+                               'FBbt_5': ['FBbt_3', 'FBbt_4']},
+                              {'VFB_a': ['FBbt_5'], 'VFB_b': ['FBbt_2']})
+        ci = ClosureIndex.from_neo(nc, page_size=2)
+        self.assertGreater(len(nc.statements), 2)
+        self.assertEqual(set(ci.subclasses('FBbt_2')), {'FBbt_3', 'FBbt_4', 'FBbt_5'})
+        self.assertEqual(set(ci.instances('FBbt_1')), {'VFB_a', 'VFB_b'})
+
+    def test_cache_size(self):
+        ci = ClosureIndex(self.iris, subclass_edges=[[1, 0], [2, 1], [3, 1], [4, 3], [4, 2]], cache_size=2)
+        for id in ['FBbt_1', 'FBbt_2', 'FBbt_3']:
+            ci.subclasses(id)
+        self.assertEqual(len(ci._closure_cache), 2)
+        self.assertEqual(set(ci.subclasses('FBbt_1')), {'FBbt_2', 'FBbt_3', 'FBbt_4', 'FBbt_5'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,5 @@
+import os
+import tempfile
 import unittest
 from ..owlery_query_tools import OWLeryConnect
 
@@ -31,6 +33,24 @@ class OwleryConnectTest(unittest.TestCase):
         except:
             pass
 
+    def test_labels_2_ids_compiled(self):
+        # A separate connection, so the shared one keeps its lookup
+        oc = OWLeryConnect(lookup={'overlaps': 'RO_0002131', "Kenyon's cell": 'FBbt_00003686'})
+        query = "'overlaps' some 'Kenyon\\'s cell' and 'overlaps' some 'FBbt_00003679'"
+        self.assertEqual(oc.labels_2_ids(query),
+                         "RO:0002131 some FBbt:00003686 and RO:0002131 some FBbt:00003679")
+        self.assertIn(query, oc._compiled_queries)
+        with self.assertRaises(ValueError):
+            oc.labels_2_ids("'overlaps' some 'not a real term label'")
+        # Replacing the lookup clears the compiled queries
+        oc.lookup = {'overlaps': 'RO_0002131'}
+        self.assertEqual(oc._compiled_queries, {})
+        # Only the most recently used compiled queries are kept
+        oc.compiled_cache_size = 2
+        for id in ['FBbt_1', 'FBbt_2', 'FBbt_1', 'FBbt_3']:
+            oc.labels_2_ids("'overlaps' some '%s'" % id)
+        self.assertEqual(list(oc._compiled_queries), ["'overlaps' some 'FBbt_1'", "'overlaps' some 'FBbt_3'"])
+
     def test_get_subclasses(self):
         ofb = self.oc.get_subclasses(query=self.test_query)
         self.assertTrue(ofb, "Query failed.")
@@ -42,6 +62,45 @@ class OwleryConnectTest(unittest.TestCase):
         self.assertTrue(ofb, "Query failed.")
         self.assertTrue(set(ofb) == set(ofbl))
 
+    def test_query_cache(self):
+        self.oc.clear_cache()
+        ofb = self.oc.get_subclasses(query=self.test_query, query_by_label=False)
+        self.assertTrue(ofb, "Query failed.")
+        self.assertEqual(len(self.oc._query_cache), 1)
+        # Whitespace differences share a cache entry
+        cached = self.oc.get_subclasses(query="RO:0002131  some FBbt:00003679", query_by_label=False)
+        self.assertEqual(len(self.oc._query_cache), 1)
+        self.assertEqual(ofb, cached)
+
+    def test_cache_file(self):
+        cache_file = os.path.join(tempfile.mkdtemp(), 'owlery_cache.pkl')
+        oc = OWLeryConnect(cache_file=cache_file, cache_save_delay=60, cache_release='1:2')
+        key = oc._cache_key('subclasses', 'superClassOf', self.test_query, False)
+        oc._set_cached(key, ['FBbt_00003680'])
+        # Saving waits for the timer (or exit)
+        self.assertFalse(os.path.exists(cache_file))
+        oc.flush_cache()
+        self.assertEqual(os.listdir(os.path.dirname(cache_file)), ['owlery_cache.pkl'])
+        self.assertEqual(OWLeryConnect(cache_file=cache_file, cache_release='1:2')._get_cached(key), ['FBbt_00003680'])
+        self.assertIsNone(OWLeryConnect(cache_file=cache_file, cache_release='1:3')._get_cached(key))
+        # A release function is only called once the cache is used
+        calls = []
+        oc2 = OWLeryConnect(cache_file=cache_file, cache_release=lambda: calls.append(1) or '1:2')
+        self.assertEqual(calls, [])
+        self.assertEqual(oc2._get_cached(key), ['FBbt_00003680'])
+        oc2._get_cached(key)
+        self.assertEqual(calls, [1])
+        oc.clear_cache()
+        self.assertFalse(os.path.exists(cache_file))
+
+    def test_query_many(self):
+        queries = [self.test_query, "FBbt:00003679", self.test_query]
+        results = self.oc.query_many(queries, query_type='subclasses', query_by_label=False)
+        self.assertEqual(set(results.keys()), {self.test_query, "FBbt:00003679"})
+        self.assertGreater(len(results[self.test_query]), 150)
+        self.assertEqual(set(results[self.test_query]),
+                         set(self.oc.get_subclasses(query=self.test_query, query_by_label=False)))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,213 @@
+import asyncio
+import random
+import re
+import threading
+import time
+import requests
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of calling a server whose circuit breaker is open."""
+
+
+class RetryPolicy:
+
+    """Retry policy shared by the Neo4j, OWLery and SOLR clients.
+
+    Failed calls are retried with exponential backoff and full jitter, up to max_attempts and within a per-call
+    deadline. Connection errors/timeouts and responses with a status in retry_on_status are retried; anything else
+    (e.g. a 400 for a bad query) is returned or raised straight away. After failure_threshold consecutive failed
+    calls the circuit breaker opens and calls fail fast with CircuitOpenError for reset_timeout seconds, after which
+    it is half-open: a single trial call is let through and other calls are still rejected until the trial succeeds
+    (closing the breaker) or fails (opening it again).
+
+        :param max_attempts: Maximum number of attempts per call (including the first).
+        :param base_delay: Delay in seconds before the first retry; doubled for each further retry.
+        :param max_delay: Maximum delay in seconds between attempts.
+        :param deadline: Maximum time in seconds to spend on a call including retries. None for no limit.
+        :param retry_on_status: HTTP status codes that are retried.
+        :param retry_on_exceptions: Exception types that are retried.
+        :param failure_threshold: Consecutive failed calls that open the circuit breaker. 0 disables it.
+        :param reset_timeout: Seconds the circuit breaker stays open before a trial call.
+        :param name: Name used in messages (e.g. the server)."""
+
+    def __init__(self,
+                 max_attempts=4,
+                 base_delay=0.5,
+                 max_delay=8.0,
+                 deadline=60.0,
+                 retry_on_status=(429, 500, 502, 503, 504),
+                 retry_on_exceptions=(requests.exceptions.ConnectionError, requests.exceptions.Timeout),
+                 failure_threshold=5,
+                 reset_timeout=30.0,
+                 name=''):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retry_on_status = tuple(retry_on_status)
+        self.retry_on_exceptions = tuple(retry_on_exceptions)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.name = name
+        self._lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._trial = False
+        self.reset_metrics()
+
+    def reset_metrics(self):
+        """Reset the retry metrics."""
+        self._metrics = {'calls': 0, 'attempts': 0, 'retries': 0, 'failures': 0,
+                         'circuit_opened': 0, 'circuit_rejected': 0, 'sleep_time': 0.0}
+
+    @property
+    def metrics(self):
+        """Counts of calls, attempts, retries, failed calls, circuit breaker openings/rejections and time slept."""
+        with self._lock:
+            return dict(self._metrics)
+
+    @property
+    def circuit_open(self):
+        """True if calls are currently being rejected by the circuit breaker (open, or half-open with a trial call
+        in progress)."""
+        with self._lock:
+            return self._opened_at is not None and (time.time() - self._opened_at < self.reset_timeout or self._trial)
+
+    def backoff(self, attempt):
+        """Delay before retry number attempt (1 based): full jitter over an exponentially growing window."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self._metrics[key] += value
+
+    def _status_of(self, error):
+        """HTTP status of an exception if known (from its response or an 'HTTP nnn' message)."""
+        response = getattr(error, 'response', None)
+        if response is not None and getattr(response, 'status_code', None):
+            return response.status_code
+        if isinstance(getattr(error, 'status', None), int):
+            return error.status
+        m = re.search(r"HTTP (\d{3})", str(error))
+        return int(m.group(1)) if m else None
+
+    def _retryable_error(self, error):
+        if isinstance(error, CircuitOpenError) or not isinstance(error, self.retry_on_exceptions):
+            return False
+        status = self._status_of(error)
+        return status is None or status in self.retry_on_status
+
+    def _record(self, success):
+        with self._lock:
+            if success:
+                self._consecutive_failures = 0
+                self._opened_at = None
+                return
+            self._metrics['failures'] += 1
+            self._consecutive_failures += 1
+            if self.failure_threshold and self._consecutive_failures >= self.failure_threshold:
+                if self._opened_at is None or time.time() - self._opened_at >= self.reset_timeout:
+                    self._metrics['circuit_opened'] += 1
+                self._opened_at = time.time()
+
+    def _check_circuit(self):
+        """Admit a call or raise CircuitOpenError; returns True if the call is the trial call of a half-open breaker."""
+        with self._lock:
+            self._metrics['calls'] += 1
+            if self._opened_at is None:
+                return False
+            wait = self.reset_timeout - (time.time() - self._opened_at)
+            if wait <= 0 and not self._trial:
+                self._trial = True
+                return True
+            self._metrics['circuit_rejected'] += 1
+            failures = self._consecutive_failures
+        raise CircuitOpenError("Circuit breaker open for %s after %d consecutive failures; %s" % (
+            self.name or 'server', failures, "retry in %.0f seconds" % wait if wait > 0 else "trial call in progress"))
+
+    def _end_trial(self, trial):
+        """Let the next call be a trial again if a half-open breaker's trial ended without closing or reopening it."""
+        if trial:
+            with self._lock:
+                self._trial = False
+
+    def _retry_delay(self, attempt, start, error, result):
+        """Delay before retrying a failed attempt, or None (after recording the failure) if the call should give up."""
+        delay = self.backoff(attempt)
+        out_of_time = self.deadline is not None and time.time() - start + delay > self.deadline
+        if attempt >= self.max_attempts or out_of_time:
+            self._record(False)
+            return None
+        reason = str(error) if error is not None else "HTTP %s" % result.status_code
+        print("\033[33mWarning:\033[0m %s request failed (%s). Retry %d of %d in %.1f seconds..." % (
+            self.name or 'Server', reason, attempt, self.max_attempts - 1, delay))
+        self._count('retries')
+        self._count('sleep_time', delay)
+        return delay
+
+    def call(self, func, *args, **kwargs):
+        """Call func(*args, **kwargs) applying the policy.
+
+        :return: The return value of func. If it is a response whose status is still retryable when attempts run
+            out, that last response is returned.
+        :raises: The last exception if the call still fails, or CircuitOpenError if the circuit breaker is open.
+        """
+        trial = self._check_circuit()
+        try:
+            start = time.time()
+            attempt = 0
+            while True:
+                attempt += 1
+                self._count('attempts')
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as e:
+                    if not self._retryable_error(e):
+                        raise
+                    error, result = e, None
+                else:
+                    if getattr(result, 'status_code', None) not in self.retry_on_status:
+                        self._record(True)
+                        return result
+                    error = None
+                delay = self._retry_delay(attempt, start, error, result)
+                if delay is None:
+                    if error is not None:
+                        raise error
+                    return result
+                time.sleep(delay)
+        finally:
+            self._end_trial(trial)
+
+    async def call_async(self, func, *args, **kwargs):
+        """Await func(*args, **kwargs) applying the policy, sleeping with asyncio between attempts.
+
+        Coroutine equivalent of call for use with async HTTP clients.
+        """
+        trial = self._check_circuit()
+        try:
+            start = time.time()
+            attempt = 0
+            while True:
+                attempt += 1
+                self._count('attempts')
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception as e:
+                    if not self._retryable_error(e):
+                        raise
+                    error, result = e, None
+                else:
+                    if getattr(result, 'status_code', None) not in self.retry_on_status:
+                        self._record(True)
+                        return result
+                    error = None
+                delay = self._retry_delay(attempt, start, error, result)
+                if delay is None:
+                    if error is not None:
+                        raise error
+                    return result
+                await asyncio.sleep(delay)
+        finally:
+            self._end_trial(trial)
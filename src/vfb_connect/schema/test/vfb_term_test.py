@@ -1,7 +1,7 @@
 import unittest
 import time
 import functools
-from vfb_connect.schema.vfb_term import create_vfbterm_from_json, VFBTerms, VFBTerm, Score, Relations, Xref, ExpressionList, Expression
+from vfb_connect.schema.vfb_term import create_vfbterm_from_json, VFBTerms, VFBTerm, Score, Relations, Xref, ExpressionList, Expression, load_template_mesh, count_plot_nodes
 
 class TimedTestCase(unittest.TestCase):
     """Base test case that adds timing to all test methods"""
@@ -151,6 +151,26 @@ class VfbTermTest(TimedTestCase):
             print("plot3d expectedly failed with ", e)
         self.assertTrue(any(hasattr(term, 'skeleton') or hasattr(term, 'mesh') or hasattr(term, 'volume') for term in terms))
 
+    def test_VFBterms_plot_images_max_nodes(self):
+        terms = self.vfb.terms(['VFB_jrchjwj7', 'VFB_jrchjwim'])
+        full, template = terms._get_plot_images(template='JRC2018Unisex', verbose=True)
+        total = sum(count_plot_nodes(item) for item in full)
+        print(f"got {len(full)} items with {total} nodes in {template}")
+        self.assertTrue(total > 0)
+        reduced, template = terms._get_plot_images(template='JRC2018Unisex', max_nodes=total // 4)
+        print(f"downsampled to {sum(count_plot_nodes(item) for item in reduced)} nodes")
+        self.assertEqual(len(reduced), len(full))
+        self.assertLess(sum(count_plot_nodes(item) for item in reduced), total)
+
+    def test_VFBterms_plot_images_lod_cache(self):
+        ids = ['VFB_jrchjwj7', 'VFB_jrchjwim']
+        reduced, template = self.vfb.terms(ids)._get_plot_images(template='JRC2018Unisex', lod=4)
+        # Fresh terms use the cached variants without downloading the full resolution skeletons
+        terms = self.vfb.terms(ids)
+        cached, template = terms._get_plot_images(template='JRC2018Unisex', lod=4)
+        self.assertEqual([count_plot_nodes(item) for item in cached], [count_plot_nodes(item) for item in reduced])
+        self.assertTrue(all(term._skeleton is None for term in terms))
+
     def test_VFBterms_plot2d(self):
         terms = self.vfb.terms(['VFB_00000001','VFB_00010001'])
         self.assertTrue(isinstance(terms, VFBTerms))
@@ -162,6 +182,22 @@ class VfbTermTest(TimedTestCase):
             print("plot2d expectedly failed with ", e)
         self.assertTrue([True for term in terms if hasattr(term, 'skeleton') or hasattr(term, 'mesh') or hasattr(term, 'volume')])
 
+    def test_load_template_mesh_cached(self):
+        mesh = load_template_mesh('VFB_00101567', verbose=True)
+        print("got template mesh ", mesh)
+        self.assertTrue(mesh)
+        start_time = time.time()
+        again = load_template_mesh('VFB_00101567')
+        print(f"Time taken for cached template mesh: {time.time() - start_time:.4f} seconds")
+        self.assertIs(mesh, again)
+
+    def test_VFBterms_subtypes(self):
+        terms = self.vfb.terms(['FBbt_00003679', 'FBbt_00003678'])
+        subtypes = terms.subtypes
+        print(f"got {len(subtypes)} subtypes: {subtypes}")
+        self.assertTrue(isinstance(subtypes, VFBTerms))
+        self.assertEqual(set(subtypes.get_ids()), set(terms[0].subtypes.get_ids() + terms[1].subtypes.get_ids()))
+
     def test_VFBterms_addition(self):
         terms = self.vfb.terms(['VFB_jrchjwj7', 'VFB_jrchjwim', 'VFB_00004023', 'VFB_jrchk3b0', 'VFB_jrchk3b1', 'VFB_jrchk3b2', 'VFB_jrchk3b3', 'VFB_jrchk3b4', 'VFB_jrchk3b5', 'VFB_jrchk3b6', 'VFB_jrchk3b7', 'VFB_jrchk3b8', 'VFB_jrchk3b9', 'VFB_00007403', 'VFB_jrchk3ao', 'VFB_jrchk3ap', 'VFB_jrchk3aq', 'VFB_jrchk3ar', 'VFB_jrchk3as', 'VFB_jrchk3at', 'VFB_jrchk3au', 'VFB_jrchk3av', 'VFB_jrchk3aw', 'VFB_jrchk3ax', 'VFB_jrchk3ay', 'VFB_jrchk3az', 'VFB_jrchk3ba', 'VFB_jrchk3bb', 'VFB_jrchk3bc', 'VFB_jrchk3bd', 'VFB_jrchk3be', 'VFB_jrchk3bf', 'VFB_jrchk3bg', 'VFB_jrchk3bh', 'VFB_jrchk3bi', 'VFB_jrchk3bj', 'VFB_jrchk3bk', 'VFB_jrchk3bl', 'VFB_jrchk3bm', 'VFB_jrchk3bn', 'VFB_jrchk3bo', 'VFB_jrchk3bp', 'VFB_jrchk3bq', 'VFB_jrchk3br', 'VFB_jrchk3bs', 'VFB_jrchk3bt', 'VFB_jrchk3e0', 'VFB_jrchk3e1', 'VFB_jrchk3e2', 'VFB_jrchk3e3', 'VFB_jrchk3e4', 'VFB_jrchk3e5', 'VFB_001012bm', 'VFB_001012bk', 'VFB_001012bj', 'VFB_001012bi', 'VFB_001012bh', 'VFB_00013165', 'VFB_001001dr', 'VFB_00005531', 'VFB_00007701', 'VFB_jrchk8iq', 'VFB_jrchk3gx', 'VFB_jrchk3gy', 'VFB_jrchk3gz', 'VFB_jrchk3ha', 'VFB_jrchk3hb', 'VFB_jrchk3hc', 'VFB_jrchk3hd', 'VFB_jrchk3he', 'VFB_jrchk3hf', 'VFB_jrchk3hg', 'VFB_jrchk3hh', 'VFB_jrchk3hi', 'VFB_jrchk3hj', 'VFB_jrchk3hk', 'VFB_jrchk3hl', 'VFB_jrchk3hm', 'VFB_jrchk3hn', 'VFB_jrchk3j0', 'VFB_jrchk3ho', 'VFB_jrchk3j1', 'VFB_00005875', 'VFB_jrchk3j2', 'VFB_jrchk3hp', 'VFB_jrchk3hq', 'VFB_jrchk3j3', 'VFB_jrchk3hr', 'VFB_jrchk3j4', 'VFB_jrchk3j5', 'VFB_jrchk3hs', 'VFB_jrchk3ht', 'VFB_jrchk3j6', 'VFB_jrchk3j7', 'VFB_jrchk3hu', 'VFB_jrchk3j8', 'VFB_jrchk3hv', 'VFB_jrchk3j9', 'VFB_jrchk3hw', 'VFB_jrchk3hx'], verbose=True)
         # test addition of slices
@@ -435,6 +471,26 @@ class VfbTermTest(TimedTestCase):
         self.assertTrue(isinstance(xref[0], Xref))
         self.assertGreaterEqual(len(xref), 1)
 
+    def test_vfbterms_downstream_partners(self):
+        terms = self.vfb.terms(['VFB_jrchk00a', 'VFB_jrchk3bp'], query_by_label=False)
+        partners = terms.downstream_partners(weight=20)
+        self.assertEqual(set(partners.keys()), {'VFB_jrchk00a', 'VFB_jrchk3bp'})
+        single = terms[0].downstream_partners(weight=20)
+        self.assertEqual(set(p.id for p in partners['VFB_jrchk00a']), set(p.id for p in single))
+        df = terms.upstream_partners(weight=20, return_dataframe=True)
+        self.assertEqual(list(df.columns), ['query_neuron_id', 'query_neuron_name', 'partner_neuron_id',
+                                            'partner_neuron_name', 'weight'])
+
+    def test_vfbterms_potential_drivers_nblast(self):
+        terms = self.vfb.terms(['VGlut-F-000118', 'LPC1 (FlyEM-HB:1838269993)'])
+        drivers = terms.potential_drivers_nblast()
+        self.assertIn(terms[0].id, drivers)
+        self.assertTrue(isinstance(drivers[terms[0].id][0], Score))
+        # Complete results are cached on the terms
+        self.assertIs(terms[0].potential_drivers_nblast, drivers[terms[0].id])
+        df = terms.similar_neurons_nblast(top_k=3, return_dataframe=True)
+        self.assertTrue(len(df) <= 6)
+
     def test_vfbterms_transgene_expression(self):
         term = self.vfb.term('medulla')
         print("got terms ", term)
@@ -1,6 +1,11 @@
+import glob
 import json
 import os
+import pickle
 import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from typing import Iterable, List, Optional, Union
 import navis
 import numpy as np
@@ -24,6 +29,10 @@ neuron_containing_anatomy_tags = [
             "Ganglion",
         ]
 
+# Process-wide caches of template terms and their decoded meshes keyed by template short_form
+_template_terms = {}
+_template_meshes = {}
+
 def is_notebook():
     """Check if the environment is a Jupyter notebook."""
     try:
@@ -3060,9 +3069,8 @@ class VFBTerm:
             if self._skeleton:
                 print(f"Skeleton found for {self.name}") if verbose else None
                 if include_template:
-                    combined = VFBTerms([selected_template if selected_template else self.channel_images[0].image.template_anatomy.short_form], query_by_label=False) + self
-                    combined.plot3d(template=selected_template if selected_template else self.channel_images[0].image.template_anatomy.short_form, **kwargs)
-                    return
+                    template_mesh = load_template_mesh(selected_template if selected_template else self.channel_images[0].image.template_anatomy.short_form, verbose=verbose)
+                    return navis.plot3d([self._skeleton, template_mesh] if template_mesh else [self._skeleton], **kwargs)
                 return self._skeleton.plot3d(**kwargs)
             else:
                 print(f"No skeleton found for {self.name} check for a mesh") if verbose else None
@@ -3071,9 +3079,8 @@ class VFBTerm:
                 if self._mesh:
                     print(f"Mesh found for {self.name}") if verbose else None
                     if include_template:
-                        combined = VFBTerms([selected_template if selected_template else self.channel_images[0].image.template_anatomy.short_form], query_by_label=False) + self.term
-                        combined.plot3d(template=selected_template if selected_template else self.channel_images[0].image.template_anatomy.short_form, **kwargs)
-                        return
+                        template_mesh = load_template_mesh(selected_template if selected_template else self.channel_images[0].image.template_anatomy.short_form, verbose=verbose)
+                        return navis.plot3d([self._mesh, template_mesh] if template_mesh else [self._mesh], **kwargs)
                     return self._mesh.plot3d(**kwargs)
                 else:
                     print(f"No mesh found for {self.name} check for a volume") if verbose else None
@@ -3082,9 +3089,8 @@ class VFBTerm:
                     if self._volume:
                         print(f"Volume found for {self.name}") if verbose else None
                         if include_template:
-                            combined = VFBTerms([selected_template if selected_template else self.channel_images[0].image.template_anatomy.short_form], query_by_label=False) + self.term
-                            combined.plot3d(template=selected_template if selected_template else self.channel_images[0].image.template_anatomy.short_form, **kwargs)
-                            return
+                            template_mesh = load_template_mesh(selected_template if selected_template else self.channel_images[0].image.template_anatomy.short_form, verbose=verbose)
+                            return navis.plot3d([self._volume, template_mesh] if template_mesh else [self._volume], **kwargs)
                         return self._volume.plot3d(**kwargs)
                     else:
                         print(f"No volume found for {self.name}") if verbose else None
@@ -3094,12 +3100,7 @@ class VFBTerm:
         self._return_type = 'full'
         if self.instances and len(self._instances) > 0:
             print(f"Loading instances for {self.name}") if verbose else None
-            if include_template:
-                combined = VFBTerms([selected_template if selected_template else self.instances[0].channel_images[0].image.template_anatomy.short_form], query_by_label=False) + self.instances
-                combined.plot3d(template=selected_template if selected_template else self.instances[0].channel_images[0].image.template_anatomy.short_form, **kwargs)
-                self._return_type = temp
-                return
-            self.instances.plot3d(template=template, verbose=verbose, query_by_label=query_by_label, force_reload=force_reload, **kwargs)
+            self.instances.plot3d(template=template, verbose=verbose, query_by_label=query_by_label, force_reload=force_reload, include_template=include_template, **kwargs)
             self._return_type = temp
             return
         self._return_type = temp
@@ -3373,6 +3374,147 @@ class VFBTerms:
             self._summary = self.get_summaries()
         return self._summary
 
+    def _load_owl_property(self, attribute, expression, query_type='subclasses', verbose=False):
+        """
+        Load a reasoner backed property (e.g. subtypes) for every type in the list in one go.
+
+        The queries for all terms that have not loaded the property yet are run concurrently with
+        OWLeryConnect.query_many and all results are pulled from VFB in a single bulk load, then shared out to
+        each term's cache.
+
+        :param attribute: The private attribute caching the property on each VFBTerm (e.g. '_subtypes').
+        :param expression: The query with an {id} placeholder for the term id.
+        :param query_type: The Owlery query type (subclasses or instances).
+        :param verbose: Print additional information if True.
+        :return: A VFBTerms object of the combined, de-duplicated results.
+        """
+        types = [term for term in self.terms if hasattr(term, attribute)]
+        pending = [term for term in types if getattr(term, attribute) is None]
+        if pending:
+            print(f"Loading {attribute.strip('_')} for {len(pending)} terms...") if verbose else None
+            results = self.vfb.oc.query_many([expression.format(id=term.id) for term in pending], query_type=query_type, verbose=verbose)
+            ids = list(dict.fromkeys(id for result in results.values() for id in result))
+            loaded = {term.id: term for term in VFBTerms(ids, query_by_label=False, verbose=verbose).terms} if ids else {}
+            for term in pending:
+                setattr(term, attribute, VFBTerms([loaded[id] for id in results[expression.format(id=term.id)] if id in loaded]))
+        combined = {}
+        for term in types:
+            for result in getattr(term, attribute).terms:
+                combined.setdefault(result.id, result)
+        return VFBTerms(list(combined.values()))
+
+    @property
+    def subtypes(self):
+        """
+        Get the subtypes of all types in the list.
+        """
+        return self._load_owl_property('_subtypes', "'{id}'")
+
+    @property
+    def subparts(self):
+        """
+        Get the subparts of all types in the list.
+        """
+        return self._load_owl_property('_subparts', "'is part of' some '{id}'")
+
+    @property
+    def children(self):
+        """
+        Get the children (subtypes and subparts) of all types in the list.
+        """
+        return self.subtypes + self.subparts
+
+    def _partners(self, direction, weight=0, classification=None, return_dataframe=False, verbose=False):
+        """
+        Get the partners of all neurons in the list in batched queries (see VfbConnect.get_neurons_downstream_of_many).
+
+        :param direction: 'downstream' or 'upstream'.
+        :param weight: Minimum number of synapses. Default 0.
+        :param classification: Optional. Restrict partners to neurons of a specified classification.
+        :param return_dataframe: Return a single long format DataFrame if True. Default False.
+        :param verbose: Print additional information if True.
+        :return: A dict of term id to a list of Partner objects (as VFBTerm.downstream_partners), or a DataFrame.
+        """
+        print(f"Getting {direction} partners for {len(self.terms)} terms") if verbose else None
+        results = self.vfb._get_neurons_connected_to_many(neurons=self.get_ids(), weight=weight, direction=direction,
+                                                          classification=classification, query_by_label=False,
+                                                          return_dataframe=return_dataframe, verbose=verbose)
+        if return_dataframe:
+            return results
+        partners = {id: [] for id in self.get_ids()}
+        for item in results:
+            partners[item['query_neuron_id']].append(Partner(weight=item['weight'], partner=item['partner_neuron_id'],
+                                                             partner_name=item['partner_neuron_name']))
+        return partners
+
+    def downstream_partners(self, weight=0, classification=None, return_dataframe=False, verbose=False):
+        """
+        Get neurons downstream of each neuron in the list, with one query per 1000 neurons. Based on individual connectomic data.
+        """
+        return self._partners('downstream', weight=weight, classification=classification,
+                              return_dataframe=return_dataframe, verbose=verbose)
+
+    def upstream_partners(self, weight=0, classification=None, return_dataframe=False, verbose=False):
+        """
+        Get neurons upstream of each neuron in the list, with one query per 1000 neurons. Based on individual connectomic data.
+        """
+        return self._partners('upstream', weight=weight, classification=classification,
+                              return_dataframe=return_dataframe, verbose=verbose)
+
+    def _scores(self, kind, method, tag, top_k=None, min_score=None, return_dataframe=False, verbose=False):
+        """
+        Get similarity scores for all neurons in the list in batched queries (see VfbConnect.get_similar_neurons_many).
+
+        Without top_k or min_score the results are complete, so they are also cached on each term for the
+        corresponding VFBTerm property.
+
+        :param kind: 'similar_neurons' or 'potential_drivers'.
+        :param method: The similarity score to use, e.g. 'NBLAST_score' or 'neuronbridge_score'.
+        :param tag: Only neurons with this tag are queried, e.g. 'NBLAST'.
+        :param top_k: Optional. Only return the top_k best scores per neuron.
+        :param min_score: Optional. Only return scores >= min_score.
+        :param return_dataframe: Return a single long format DataFrame if True. Default False.
+        :param verbose: Print additional information if True.
+        :return: A dict of term id to a list of Score objects, or a DataFrame.
+        """
+        neurons = [term for term in self.terms if term.is_neuron and term.has_tag(tag)]
+        print(f"Getting {method} {kind.replace('_', ' ')} for {len(neurons)} of {len(self.terms)} terms") if verbose else None
+        query = self.vfb.get_similar_neurons_many if kind == 'similar_neurons' else self.vfb.get_potential_drivers_many
+        results = query(neurons=[term.id for term in neurons], similarity_score=method, top_k=top_k,
+                        min_score=min_score, query_by_label=False, return_dataframe=return_dataframe, verbose=verbose)
+        if return_dataframe:
+            return results
+        scores = {term.id: [] for term in neurons}
+        for item in results:
+            scores[item['query_neuron_id']].append(Score(score=item['score'], method=method, term=item['id']))
+        if top_k is None and min_score is None:
+            cache = '_%s_%s' % (kind, 'nblast' if method == 'NBLAST_score' else 'neuronbridge')
+            for term in neurons:
+                if hasattr(term, cache):
+                    setattr(term, cache, scores[term.id])
+        return scores
+
+    def similar_neurons_nblast(self, top_k=None, min_score=None, return_dataframe=False, verbose=False):
+        """
+        Get neurons similar to each neuron in the list based on NBLAST scores, with one query per 1000 neurons.
+        """
+        return self._scores('similar_neurons', 'NBLAST_score', 'NBLAST', top_k=top_k, min_score=min_score,
+                            return_dataframe=return_dataframe, verbose=verbose)
+
+    def potential_drivers_nblast(self, top_k=None, min_score=None, return_dataframe=False, verbose=False):
+        """
+        Get potential drivers of each neuron in the list based on NBLAST scores, with one query per 1000 neurons.
+        """
+        return self._scores('potential_drivers', 'NBLAST_score', 'NBLASTexp', top_k=top_k, min_score=min_score,
+                            return_dataframe=return_dataframe, verbose=verbose)
+
+    def potential_drivers_neuronbridge(self, top_k=None, min_score=None, return_dataframe=False, verbose=False):
+        """
+        Get potential drivers of each neuron in the list based on NeuronBridge scores, with one query per 1000 neurons.
+        """
+        return self._scores('potential_drivers', 'neuronbridge_score', 'neuronbridge', top_k=top_k,
+                            min_score=min_score, return_dataframe=return_dataframe, verbose=verbose)
+
     def __repr__(self):
         return f"VFBTerms(terms={self.terms})"
 
@@ -3957,7 +4099,7 @@ class VFBTerms:
         for term in self.terms:
             term.load_volume(template=template, verbose=verbose, query_by_label=query_by_label, force_reload=force_reload)
 
-    def plot3d(self, template=None, verbose=False, query_by_label=True, force_reload=False, include_template=False, limit=False, **kwargs):
+    def plot3d(self, template=None, verbose=False, query_by_label=True, force_reload=False, include_template=False, limit=False, lod=None, max_nodes=None, **kwargs):
         """
         Plot the 3D representation of any neuron or expression.
 
@@ -3968,9 +4110,13 @@ class VFBTerms:
         :param verbose: Print additional information if True.
         :param query_by_label: Query by label if True.
         :param force_reload: Force reload of 3D representations if True.
+        :param include_template: Include the template in the plot if True.
+        :param limit: Maximum number of items to plot.
+        :param lod: Level of detail as a downsampling factor (e.g. 4 keeps roughly a quarter of the nodes/faces).
+        :param max_nodes: Maximum number of nodes across the whole plot; items are downsampled to fit.
         :param kwargs: Additional arguments for plotting.
         """
-        skeletons, selected_template = self._get_plot_images(template=template, verbose=verbose, query_by_label=query_by_label, force_reload=force_reload)
+        skeletons, selected_template = self._get_plot_images(template=template, verbose=verbose, query_by_label=query_by_label, force_reload=force_reload, lod=lod, max_nodes=max_nodes)
 
         if skeletons:
             if limit and len(skeletons) > limit:
@@ -3980,15 +4126,14 @@ class VFBTerms:
             print(f"Plotting 3D representation of {len(skeletons)} items")
             if include_template:
                 print(f"Adding template {selected_template} to the plot")
-                temp = VFBTerm(selected_template)
-                temp.load_mesh()
-                if hasattr(temp, 'mesh') and temp.mesh:
-                    skeletons.append(temp.mesh)
+                template_mesh = load_template_mesh(selected_template, verbose=verbose)
+                if template_mesh:
+                    skeletons.append(template_mesh)
             return navis.plot3d(skeletons, **kwargs)
         else:
             print("Nothing found to plot")
 
-    def plot2d(self, template=None, verbose=False, query_by_label=True, force_reload=False, include_template=False, limit=False, **kwargs):
+    def plot2d(self, template=None, verbose=False, query_by_label=True, force_reload=False, include_template=False, limit=False, lod=None, max_nodes=None, **kwargs):
         """
         Plot the 2D representation of any neuron or expression.
 
@@ -4000,9 +4145,12 @@ class VFBTerms:
         :param query_by_label: Query by label if True.
         :param force_reload: Force reload of 2D representations if True.
         :param include_template: Include the template in the plot if True.
+        :param limit: Maximum number of items to plot.
+        :param lod: Level of detail as a downsampling factor (e.g. 4 keeps roughly a quarter of the nodes/faces).
+        :param max_nodes: Maximum number of nodes across the whole plot; items are downsampled to fit.
         :param kwargs: Additional arguments for plotting.
         """
-        skeletons, selected_template = self._get_plot_images(template=template, verbose=verbose, query_by_label=query_by_label, force_reload=force_reload)
+        skeletons, selected_template = self._get_plot_images(template=template, verbose=verbose, query_by_label=query_by_label, force_reload=force_reload, lod=lod, max_nodes=max_nodes)
 
         if skeletons:
             if limit and len(skeletons) > limit:
@@ -4012,20 +4160,28 @@ class VFBTerms:
             print(f"Plotting 2D representation of {len(skeletons)} items")
             if include_template:
                 print(f"Adding template {selected_template} to the plot")
-                temp = VFBTerm(selected_template)
-                temp.load_mesh()
-                if hasattr(temp, 'mesh') and temp.mesh:
-                    skeletons.append(temp.mesh)
+                template_mesh = load_template_mesh(selected_template, verbose=verbose)
+                if template_mesh:
+                    skeletons.append(template_mesh)
             return navis.plot2d(skeletons, **kwargs)
 
-    def _get_plot_images(self, template=None, verbose=False, query_by_label=True, force_reload=False):
+    def _get_plot_images(self, template=None, verbose=False, query_by_label=True, force_reload=False, max_workers=8, lod=None, max_nodes=None):
         """
         Load and return images for navis plot
 
+        The display template and the best available representation for each term (skeleton, mesh or volume) are
+        chosen from the TermInfo image metadata before anything is downloaded, so each term is fetched exactly
+        once and the downloads run in parallel. When downsampling, level of detail variants cached on disk (see
+        downsample_for_plot) are used instead of downloading the full resolution item; with max_nodes this needs
+        the full resolution node counts of all items, which are recorded with the cached variants.
+
         :param template: The short form of the template to load images for.
         :param verbose: Print additional information if True.
         :param query_by_label: Query by label if True.
         :param force_reload: Force reload of images if True.
+        :param max_workers: Maximum number of parallel downloads.
+        :param lod: Level of detail as a downsampling factor applied to every item.
+        :param max_nodes: Maximum number of nodes across all items; raises the downsampling factor to fit.
         :return: A list of skeletons and the selected template.
         """
         selected_template = None
@@ -4034,65 +4190,132 @@ class VFBTerms:
             if query_by_label:
                 selected_template = self.vfb.lookup_id(template)
                 print("Template (", template, ") resolved to id ", selected_template) if verbose else None
-                query_by_label = False
             else:
                 selected_template = template
-        skeletons=[]
-        for term in VFBTerms.tqdm_with_threshold(self, self.terms, threshold=10, desc="Loading Images"):
+        instances = []
+        for term in self.terms:
             if term.has_tag('Individual'):
                 print(f"{term.name} is an instance") if verbose else None
+                instances.append(term)
             else:
                 print(f"{term.name} is not an instance soo won't have a skeleton, mesh or volume") if verbose else None
+        if not selected_template:
+            templates = Counter(ci.image.template_anatomy.short_form for term in instances if term.channel_images for ci in term.channel_images)
+            if templates:
+                selected_template = templates.most_common(1)[0][0]
+                if len(templates) > 1:
+                    print(f"Images found in {len(templates)} template spaces. Taking the most common as the space to plot in. Specify a template to avoid this.")
+                print(f"Enforcing the display template space as {selected_template}")
+
+        skeletons = [None] * len(instances)
+        kinds, sources = {}, {}
+        to_load = []
+        for i, term in enumerate(instances):
+            kind, image = self._select_plot_representation(term, selected_template)
+            if not kind:
+                print(f"No skeleton, mesh or volume found for {term.name} in {selected_template}") if verbose else None
                 continue
-            if not term._skeleton or force_reload:
-                term.load_skeleton(template=selected_template, verbose=verbose, query_by_label=query_by_label, force_reload=force_reload, allow_multiple=True)
-            if term._skeleton:
-                print(f"Skeleton found for {term.name}") if verbose else None
-                if not selected_template:
-                    if isinstance(term._skeleton, list):
-                        print("Multiple skeletons found for ", term.name, ". Arbitarily taking the first template as the space to plot in. Specify a template to avoid this.")
-                        selected_template = term.channel_images[0].image.template_anatomy.short_form
-                        print(f"Enforcing the display template space as {term.channel_images[0].image.template_anatomy.name}")
-                        term.load_skeleton(template=selected_template, verbose=verbose, query_by_label=query_by_label, force_reload=True)
-                    else:
-                        selected_template = term.channel_images[0].image.template_anatomy.short_form
-                        print(f"Enforcing the display template space as {term.channel_images[0].image.template_anatomy.name} from the first skeleton found. Specify a template to avoid this.")
-                skeletons.append(term._skeleton)
+            kinds[i], sources[i] = kind, image.image_folder
+            loaded = getattr(term, '_' + kind)
+            if loaded and not force_reload and not isinstance(loaded, list) and (kind != 'skeleton' or term._skeleton_template == selected_template):
+                print(f"Using loaded {kind} for {term.name}") if verbose else None
+                skeletons[i] = loaded
             else:
-                print(f"No skeleton found for {term.name} check for a mesh") if verbose else None
-                if not term._mesh or force_reload:
-                    term.load_mesh(template=selected_template, verbose=verbose, query_by_label=query_by_label, force_reload=force_reload, allow_multiple=True)
-                if term._mesh:
-                    print(f"Mesh found for {term.name}") if verbose else None
-                    if not selected_template:
-                        if isinstance(term._mesh, list):
-                            print("Multiple meshes found for ", term.name, ". Arbitarily taking the first template as the space to plot in. Specify a template to avoid this.")
-                            selected_template = term.channel_images[0].image.template_anatomy.short_form
-                            print(f"Enforcing the display template space as {term.channel_images[0].image.template_anatomy.name}")
-                            term.load_mesh(template=selected_template, verbose=verbose, query_by_label=query_by_label, force_reload=True)
-                        else:
-                            selected_template = term.channel_images[0].image.template_anatomy.short_form
-                            print(f"Enforcing the display template space as {term.channel_images[0].image.template_anatomy.name} from the first mesh found. Specify a template to avoid this.")
-                    skeletons.append(term._mesh)
+                to_load.append((i, term, kind, image))
+
+        def fit_factor(total, factor):
+            if max_nodes and total > max_nodes:
+                factor = max(factor, int(np.ceil(total / max_nodes)))
+                print(f"\033[32mINFO:\033[0m Downsampling {total} nodes by a factor of {factor} to fit max_nodes={max_nodes}")
+            return factor
+
+        factor = int(np.ceil(lod)) if lod else 1
+        factor_known = not max_nodes
+        if max_nodes and to_load:
+            # The factor can be set before downloading if cached variants record the node counts of all new items
+            counts = []
+            for i, term, kind, image in to_load:
+                variant = load_lod_variant(term.id, None, template=selected_template, kind=kind, source=sources[i])
+                if variant is None:
+                    break
+                counts.append(variant['nodes'])
+            if len(counts) == len(to_load):
+                factor = fit_factor(sum(counts) + sum(count_plot_nodes(item) for item in skeletons if item is not None), factor)
+                factor_known = True
+        reduced = set()
+        if factor_known and factor > 1 and not force_reload:
+            remaining = []
+            for i, term, kind, image in to_load:
+                variant = load_lod_variant(term.id, factor, template=selected_template, kind=kind, source=sources[i])
+                if variant is None:
+                    remaining.append((i, term, kind, image))
                 else:
-                    print(f"No mesh found for {term.name} check for a volume") if verbose else None
-                    if not term._volume or force_reload:
-                        term.load_volume(template=selected_template, verbose=verbose, query_by_label=query_by_label, force_reload=force_reload, allow_multiple=True)
-                    if term._volume:
-                        if not selected_template:
-                            if isinstance(term._volume, list):
-                                print("Multiple volumes found for ", term.name, ". Arbitarily taking the first template as the space to plot in. Specify a template to avoid this.")
-                                selected_template = term.channel_images[0].image.template_anatomy.short_form
-                                print(f"Enforcing the display template space as {term.channel_images[0].image.template_anatomy.name}")
-                                term.load_volume(template=selected_template, verbose=verbose, query_by_label=query_by_label, force_reload=True)
-                            elif isinstance(term._volume, navis.core.volumes.Volume):
-                                selected_template = term.channel_images[0].image.template_anatomy.short_form
-                                print(f"Enforcing the display template space as {term.channel_images[0].image.template_anatomy.name} from the first volume found. Specify a template to avoid this.")
-                        skeletons.append(term._volume)
-                    else:
-                        print(f"No volume found for {term.name}") if verbose else None
+                    print(f"Using cached level of detail {kind} for {term.name}") if verbose else None
+                    skeletons[i] = variant['item']
+                    reduced.add(i)
+            to_load = remaining
+
+        def load(item):
+            i, term, kind, image = item
+            print(f"Loading {kind} for {term.name}") if verbose else None
+            try:
+                if kind == 'skeleton':
+                    return image.get_skeleton(verbose=verbose)
+                if kind == 'mesh':
+                    return image.get_mesh(verbose=verbose, output='volume')
+                return image.get_volume(verbose=verbose)
+            except Exception as e:
+                print(f"\033[33mWarning:\033[0m Unable to load {kind} for {term.name}: {e}")
+                return None
+
+        if to_load:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = executor.map(load, to_load)
+                if len(to_load) > 10:
+                    results = tqdm(results, total=len(to_load), desc="Loading Images")
+                for (i, term, kind, image), result in zip(to_load, results):
+                    if result is None:
+                        print(f"No {kind} found for {term.name}") if verbose else None
+                        continue
+                    result.name = term.name
+                    result.label = term.name
+                    result.id = term.id
+                    setattr(term, '_' + kind, result)
+                    if kind == 'skeleton':
+                        term._skeleton_template = selected_template
+                    skeletons[i] = result
+        if not factor_known:
+            factor = fit_factor(sum(count_plot_nodes(item) for item in skeletons if item is not None), factor)
+        if factor > 1:
+            skeletons = [item if item is None or i in reduced else
+                         downsample_for_plot(item, factor, template=selected_template, kind=kinds[i], source=sources[i], verbose=verbose)
+                         for i, item in VFBTerms.tqdm_with_threshold(self, list(enumerate(skeletons)), threshold=10, desc="Downsampling")]
+        skeletons = [item for item in skeletons if item is not None]
         return (skeletons, selected_template)
 
+    @staticmethod
+    def _select_plot_representation(term, template):
+        """
+        Select the best available representation of a term in a template from its image metadata.
+
+        Neurons are loaded as skeletons (falling back to a neuron mesh or dotprops), other anatomy as a mesh
+        (OBJ or SWC) and otherwise as a volume (NRRD).
+
+        :param term: The VFBTerm to select a representation for.
+        :param template: The short form of the template the image must be aligned to.
+        :return: A tuple of the representation ('skeleton', 'mesh' or 'volume') and the Image, or (None, None).
+        """
+        images = [ci.image for ci in term.channel_images if ci.image.template_anatomy.short_form == template] if term.channel_images else []
+        for image in images:
+            has_obj = bool(image.image_obj and 'volume_man.obj' in image.image_obj)
+            if term.has_tag('Neuron') and (image.image_swc or has_obj or image.image_nrrd):
+                return ('skeleton', image)
+            if has_obj or image.image_swc:
+                return ('mesh', image)
+            if image.image_nrrd:
+                return ('volume', image)
+        return (None, None)
+
     def plot3d_by_type(self, template=None, verbose=False, query_by_label=True, force_reload=False, **kwargs):
         """
         Plot the 3D representation of any neuron or expression coloured by it's parent type.
@@ -4585,3 +4808,162 @@ def load_skeletons(vfb_term, template=None, verbose=False, query_by_label=True,
             print("Loading skeletons for ", vfb_term.name) if template == None else print("Loading skeleton for ", vfb_term.name, " aligned to ", template)
             term.load_skeleton(template=selected_template, verbose=verbose, query_by_label=query_by_label, force_reload=force_reload)
 
+def load_template_mesh(template, verbose=False, persist=True, force_reload=False):
+    """
+    Load the mesh for a template, reusing a process-wide cache.
+
+    The decoded mesh is kept in memory keyed by template short_form and, if persist is True, saved as a compressed
+    numpy .npz of vertices/faces so later sessions avoid the OBJ download and parse.
+
+    :param template: The short form of the template.
+    :param verbose: Print additional information if True.
+    :param persist: Read/write the on disk .npz cache if True.
+    :param force_reload: Ignore any cached mesh and reload from the server if True.
+    :return: The template mesh as a navis Volume or None if not found.
+    """
+    if not template:
+        return None
+    if not force_reload and template in _template_meshes:
+        print(f"Using cached mesh for template {template}") if verbose else None
+        return _template_meshes[template]
+    from vfb_connect import vfb
+    cache_file = os.path.join(vfb.get_cache_dir('templates'), f"{template}.npz") if persist else None
+    mesh = None
+    if cache_file and not force_reload and os.path.exists(cache_file):
+        try:
+            with np.load(cache_file) as data:
+                mesh = navis.Volume(data['vertices'], data['faces'], name=str(data['name']), id=template)
+            mesh.label = mesh.name
+            print(f"Loaded mesh for template {template} from {cache_file}") if verbose else None
+        except Exception as e:
+            print(f"\033[33mWarning:\033[0m Unable to read cached mesh {cache_file}: {e}")
+            mesh = None
+    if mesh is None:
+        if force_reload or template not in _template_terms:
+            _template_terms[template] = VFBTerm(template, verbose=verbose)
+        term = _template_terms[template]
+        term.load_mesh(verbose=verbose)
+        mesh = term._mesh
+        if isinstance(mesh, list):
+            mesh = mesh[0] if mesh else None
+        if cache_file and mesh is not None and hasattr(mesh, 'vertices') and hasattr(mesh, 'faces'):
+            try:
+                np.savez_compressed(cache_file, vertices=np.asarray(mesh.vertices, dtype=np.float32),
+                                    faces=np.asarray(mesh.faces, dtype=np.int32), name=str(mesh.name))
+                print(f"Saved mesh for template {template} to {cache_file}") if verbose else None
+            except Exception as e:
+                print(f"\033[31mError:\033[0m saving template mesh to {cache_file}: {e}")
+    if mesh is not None:
+        _template_meshes[template] = mesh
+    return mesh
+
+def count_plot_nodes(item):
+    """
+    Count the nodes (skeleton nodes, dotprops points or mesh vertices) a plot item will render.
+
+    :param item: A navis neuron or volume.
+    :return: The number of nodes.
+    :rtype: int
+    """
+    if isinstance(item, navis.TreeNeuron):
+        return item.n_nodes
+    if isinstance(item, navis.Dotprops):
+        return len(item.points)
+    if isinstance(item, (navis.MeshNeuron, navis.Volume)):
+        return len(item.vertices)
+    return 0
+
+def _lod_cache_file(item_id, factor, template=None, kind=None):
+    """Path of the on disk LOD cache entry for an item, template, representation and factor ('*' for any)."""
+    from vfb_connect import vfb
+    prefix = glob.escape(f"{template}_{item_id}_{kind}_") if factor == '*' else f"{template}_{item_id}_{kind}_"
+    return os.path.join(vfb.get_cache_dir('lod'), f"{prefix}{factor}.pkl")
+
+def load_lod_variant(item_id, factor, template=None, kind=None, source=None, verbose=False):
+    """
+    Load a level of detail variant saved by downsample_for_plot, without the full resolution item.
+
+    Variants more than three months old or made from a different source (image folder) are ignored.
+
+    :param item_id: The short form of the term.
+    :param factor: The downsampling factor, or None for a variant at any factor (e.g. to read the node count).
+    :param template: The short form of the template the item is aligned to.
+    :param kind: The representation ('skeleton', 'mesh' or 'volume').
+    :param source: The source the item is loaded from, e.g. the image folder.
+    :param verbose: Print additional information if True.
+    :return: A dict of the reduced 'item', the full resolution 'nodes' count, 'source' and 'timestamp', or None.
+    """
+    three_months_in_seconds = 3 * 30 * 24 * 60 * 60
+    if factor is None:
+        cache_files = glob.glob(_lod_cache_file(item_id, '*', template=template, kind=kind))
+    else:
+        cache_files = [_lod_cache_file(item_id, int(np.ceil(factor)), template=template, kind=kind)]
+    for cache_file in cache_files:
+        if not os.path.exists(cache_file):
+            continue
+        try:
+            with open(cache_file, 'rb') as f:
+                variant = pickle.load(f)
+        except Exception as e:
+            print(f"\033[33mWarning:\033[0m Unable to read LOD cache {cache_file}: {e}")
+            continue
+        if not isinstance(variant, dict) or variant.get('source') != source or \
+                time.time() - variant.get('timestamp', 0) > three_months_in_seconds:
+            print(f"Ignoring out of date LOD cache {cache_file}") if verbose else None
+            continue
+        return variant
+    return None
+
+def downsample_for_plot(item, factor, template=None, kind=None, source=None, verbose=False, persist=True):
+    """
+    Return a level of detail variant of a plot item.
+
+    Skeletons and dotprops are downsampled and meshes simplified by roughly the given factor. Variants are cached on
+    disk keyed by item id, template, representation and factor, with the source they were made from and the full
+    resolution node count, so repeated overview plots can skip both the download (see load_lod_variant) and the
+    reduction. Items that cannot be reduced (e.g. voxels or meshes without a simplification backend) are returned
+    unchanged.
+
+    :param item: A navis neuron or volume.
+    :param factor: The downsampling factor (> 1).
+    :param template: The short form of the template the item is aligned to.
+    :param kind: The representation ('skeleton', 'mesh' or 'volume'). Default: the type of item.
+    :param source: The source the item was loaded from, e.g. the image folder; cached variants from another
+        source are not used.
+    :param verbose: Print additional information if True.
+    :param persist: Read/write the on disk LOD cache if True.
+    :return: The reduced item or the original item.
+    """
+    factor = int(np.ceil(factor))
+    if factor <= 1 or not count_plot_nodes(item):
+        return item
+    item_id = getattr(item, 'id', None)
+    kind = kind if kind else type(item).__name__
+    cache_file = None
+    if persist and item_id:
+        variant = load_lod_variant(item_id, factor, template=template, kind=kind, source=source, verbose=verbose)
+        if variant is not None:
+            return variant['item']
+        cache_file = _lod_cache_file(item_id, factor, template=template, kind=kind)
+    if not isinstance(item, (navis.TreeNeuron, navis.Dotprops)) and not navis.meshes.available_backends(only_first=True):
+        print("\033[33mWarning:\033[0m No mesh simplification backend available (install e.g. `pyfqmr`), plotting meshes at full resolution") if verbose else None
+        return item
+    try:
+        if isinstance(item, (navis.TreeNeuron, navis.Dotprops)):
+            reduced = navis.downsample_neuron(item, downsampling_factor=factor, inplace=False)
+        else:
+            reduced = navis.simplify_mesh(item, F=1 / factor, inplace=False)
+    except Exception as e:
+        print(f"\033[33mWarning:\033[0m Unable to downsample {getattr(item, 'name', item_id)}, plotting at full resolution: {e}") if verbose else None
+        return item
+    for attr in ('name', 'label', 'id'):
+        if hasattr(item, attr):
+            setattr(reduced, attr, getattr(item, attr))
+    if cache_file:
+        try:
+            with open(cache_file, 'wb') as f:
+                pickle.dump({'item': reduced, 'nodes': count_plot_nodes(item), 'source': source,
+                             'timestamp': time.time()}, f)
+        except Exception as e:
+            print(f"\033[31mError:\033[0m saving LOD cache to {cache_file}: {e}")
+    return reduced
@@ -0,0 +1,247 @@
+import os
+import pickle
+import re
+import time
+from bisect import bisect_left, bisect_right
+import numpy as np
+from .neo.neo4j_tools import cypher_statement
+
+# Relative weights of the match types, scaled by the field weights (qf) below
+EXACT, PREFIX, TOKEN_PREFIX, INFIX = 4.0, 2.0, 1.0, 0.5
+LABEL, SYNONYM, SHORT_FORM = 0, 1, 2
+FIELD_WEIGHTS = np.array([110.0, 100.0, 50.0])
+# Same additive boosts (bq) as VfbConnect search, most specific prefix first
+SHORT_FORM_BOOSTS = (('FBbt_00003982', 100.0 + 2.0), ('VFBexp', 100.0 + 10.0), ('VFB', 100.0), ('FBbt', 100.0))
+HAS_TAG_BOOST = 10.0
+NOT_TAG_FACTOR = 0.001
+SEARCH_FIELDS = ('short_form', 'label', 'synonym', 'id', 'facets_annotation', 'unique_facets')
+# Node labels (with any further condition) covering the SOLR search filter:
+# (short_form:VFB* OR short_form:FB* OR facets_annotation:DataSet OR facets_annotation:pub) AND NOT short_form:VFBc_*
+SEARCH_LABELS = (('Entity', "AND (n.short_form STARTS WITH 'VFB' OR n.short_form STARTS WITH 'FB') "),
+                 ('DataSet', ''), ('pub', ''))
+
+
+def normalise(text):
+    """Lower case text and collapse anything but letters and digits to single spaces."""
+    return re.sub(r'[^0-9a-z]+', ' ', str(text).lower()).strip()
+
+
+class SearchIndex:
+
+    """In process search index for type-ahead search without SOLR.
+
+    Labels, synonyms and short_forms are normalised and held in a sorted array, so exact and prefix matches are a
+    binary search (the array acts as a compact prefix trie). Words are indexed in a token inverted index for
+    matches on any word, and word trigrams in an n-gram index for matches within words. Matches are scored with
+    the same field weights and boosts as VfbConnect.search (labels over synonyms, VFB*/FBbt* boosts, tag
+    up/down votes) and returned with the same fields as SOLR.
+
+        :param short_forms: Sequence of term short_forms.
+        :param labels: Sequence of term labels.
+        :param synonyms: Optional sequence of lists of synonyms (and symbols) for each term.
+        :param facets: Optional sequence of lists of facets (neo4j labels) for each term.
+        :param unique_facets: Optional sequence of lists of unique facets for each term.
+        :param timestamp: Time the index was built (seconds since the epoch)."""
+
+    def __init__(self, short_forms, labels, synonyms=None, facets=None, unique_facets=None, timestamp=None):
+        self.short_forms = list(short_forms)
+        n = len(self.short_forms)
+        self.labels = [label if label else '' for label in labels]
+        self.synonyms = [list(s) if s else [] for s in synonyms] if synonyms is not None else [[] for i in range(n)]
+        self.facets = [list(f) if f else [] for f in facets] if facets is not None else [[] for i in range(n)]
+        self.unique_facets = [list(f) if f else [] for f in unique_facets] if unique_facets is not None else [[] for i in range(n)]
+        self.timestamp = timestamp if timestamp else time.time()
+        self._tag_masks = {}
+        self._build()
+
+    def _build(self):
+        names = []
+        for i, (sf, label, synonyms) in enumerate(zip(self.short_forms, self.labels, self.synonyms)):
+            names.append((normalise(label), i, LABEL))
+            names.extend((normalise(s), i, SYNONYM) for s in set(synonyms))
+            names.append((normalise(sf), i, SHORT_FORM))
+        names = sorted(set(n for n in names if n[0]))
+        self._names = [n[0] for n in names]
+        self._name_entry = np.array([n[1] for n in names], dtype=np.int32)
+        self._name_field = np.array([n[2] for n in names], dtype=np.int8)
+        postings = {}
+        for pos, name in enumerate(self._names):
+            for token in set(name.split(' ')):
+                postings.setdefault(token, []).append(pos)
+        self._tokens = sorted(postings)
+        self._token_postings = [np.array(postings[t], dtype=np.int32) for t in self._tokens]
+        grams = {}
+        for ti, token in enumerate(self._tokens):
+            for g in set(token[j:j + 3] for j in range(len(token) - 2)):
+                grams.setdefault(g, []).append(ti)
+        self._grams = {g: np.array(v, dtype=np.int32) for g, v in grams.items()}
+        self._boost = np.zeros(len(self.short_forms))
+        for i, sf in enumerate(self.short_forms):
+            for prefix, boost in SHORT_FORM_BOOSTS:
+                if sf.startswith(prefix):
+                    self._boost[i] = boost
+                    break
+        self._label_length = np.array([len(label) for label in self.labels], dtype=np.int32)
+
+    @classmethod
+    def from_lookup(cls, lookup):
+        """Build an index from a VfbConnect name:ID lookup without any server queries.
+
+        The first name for each ID in the lookup (its label, as labels are loaded first) is used as the label and
+        the others as synonyms. Facets are not available from the lookup so results have none.
+
+        :param lookup: dict of name: short_form
+        :return: SearchIndex
+        """
+        names = {}
+        for name, sf in lookup.items():
+            names.setdefault(sf, []).append(name)
+        return cls(list(names.keys()), [n[0] for n in names.values()], [n[1:] for n in names.values()])
+
+    @classmethod
+    def from_neo(cls, nc, page_size=100000, verbose=False):
+        """Build the index in bulk from a VFB neo4j (PDB) connection, covering the same terms as VfbConnect.search.
+
+        The nodes of each label in SEARCH_LABELS are paged through in short_form order, so every query is a label
+        scan rather than a scan of the whole graph.
+
+        :param nc: A Neo4jConnect object.
+        :param page_size: Optional. Number of terms fetched per query. Default 100000.
+        :param verbose: Print progress if `True`.
+        :return: SearchIndex or None if the terms could not be loaded.
+        """
+        terms = {}
+        print("Building local search index from %s..." % nc.base_uri) if verbose else None
+        for label, condition in SEARCH_LABELS:
+            query = "MATCH (n:%s) WHERE n.short_form > $last AND EXISTS(n.label) %s" \
+                    "AND NOT n.short_form STARTS WITH 'VFBc_' " \
+                    "WITH n ORDER BY n.short_form LIMIT $page_size " \
+                    "RETURN n.short_form, n.label, coalesce(n.synonyms, []) + coalesce(n.symbol, []), " \
+                    "labels(n), coalesce(n.uniqueFacets, [])" % (label, condition)
+            last = ''
+            while True:
+                r = nc.commit_list([cypher_statement(query, {'last': last, 'page_size': page_size})])
+                if not r:
+                    return None
+                page = [d['row'] for d in r[0]['data']]
+                for row in page:
+                    terms.setdefault(row[0], row)
+                print("Loaded %d terms" % len(terms)) if verbose else None
+                if len(page) < page_size:
+                    break
+                last = page[-1][0]
+        rows = [terms[sf] for sf in sorted(terms)]
+        columns = list(zip(*rows)) if rows else [[]] * 5
+        return cls(columns[0], columns[1], columns[2], columns[3], [sorted(f) for f in columns[4]])
+
+    def save(self, path):
+        """Save the index (pickle).
+
+        :param path: File path.
+        """
+        state = {k: v for k, v in self.__dict__.items() if k != '_tag_masks'}
+        with open(path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path, max_age=None):
+        """Load an index saved with save.
+
+        :param path: File path.
+        :param max_age: Optional maximum age in seconds; older indexes are not loaded.
+        :return: SearchIndex or None if the file is missing or too old.
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if max_age and time.time() - state['timestamp'] > max_age:
+            return None
+        index = cls.__new__(cls)
+        index.__dict__.update(state)
+        index._tag_masks = {}
+        return index
+
+    def __len__(self):
+        return len(self.short_forms)
+
+    def _prefix_range(self, values, prefix):
+        return bisect_left(values, prefix), bisect_right(values, prefix + '\uffff')
+
+    def _token_matches(self, token, infix):
+        """Name positions with a word starting with (or, if infix, containing) token."""
+        start, end = self._prefix_range(self._tokens, token)
+        postings = self._token_postings[start:end]
+        if infix and len(token) >= 3:
+            candidates = None
+            for g in set(token[j:j + 3] for j in range(len(token) - 2)):
+                tokens = self._grams.get(g)
+                if tokens is None:
+                    candidates = np.array([], dtype=np.int32)
+                    break
+                candidates = tokens if candidates is None else np.intersect1d(candidates, tokens, assume_unique=True)
+            postings = postings + [self._token_postings[t] for t in candidates
+                                   if not self._tokens[t].startswith(token) and token in self._tokens[t]]
+        return np.unique(np.concatenate(postings)) if postings else np.array([], dtype=np.int32)
+
+    def _tag_mask(self, tag):
+        if tag not in self._tag_masks:
+            self._tag_masks[tag] = np.array([tag in f for f in self.facets], dtype=bool)
+        return self._tag_masks[tag]
+
+    def search(self, query, limit=150, filter_by_has_tag=None, filter_by_not_tag=['Deprecated'], fl=None):
+        """Search labels, synonyms and short_forms (see VfbConnect.search).
+
+        :param query: The search query.
+        :param limit: Optional. Maximum number of results; `None` for all. Default 150.
+        :param filter_by_has_tag: Optional. List of tags (facets) to boost if present.
+        :param filter_by_not_tag: Optional. List of tags (facets) to downvote if present.
+        :param fl: Optional. Fields to return, as a list or comma separated string. Default: short_form, label, synonym, id, facets_annotation, unique_facets.
+        :return: List of result dicts, best match first.
+        """
+        q = normalise(query)
+        if not q:
+            return []
+        matches = []
+        start, end = self._prefix_range(self._names, q)
+        prefix = np.arange(start, end, dtype=np.int32)
+        exact = prefix[:bisect_right(self._names, q, start, end) - start]
+        matches.append((exact, EXACT))
+        matches.append((prefix, PREFIX))
+        tokens = q.split(' ')
+        for infix, weight in ((False, TOKEN_PREFIX), (True, INFIX)):
+            if len(q) < 3 and len(prefix) >= (limit or len(self)):
+                # One or two characters match most words; whole name prefixes are enough to fill the results
+                break
+            positions = None
+            for token in tokens:
+                found = self._token_matches(token, infix)
+                positions = found if positions is None else np.intersect1d(positions, found, assume_unique=True)
+            matches.append((positions, weight))
+        positions = np.concatenate([m[0] for m in matches])
+        if not len(positions):
+            return []
+        entries = self._name_entry[positions]
+        scores = np.concatenate([np.full(len(m[0]), m[1]) for m in matches]) * FIELD_WEIGHTS[self._name_field[positions]]
+        # Best score per term
+        order = np.lexsort((-scores, entries))
+        entries, scores = entries[order], scores[order]
+        first = np.ones(len(entries), dtype=bool)
+        first[1:] = entries[1:] != entries[:-1]
+        entries, scores = entries[first], scores[first] + self._boost[entries[first]]
+        for tag in filter_by_has_tag or []:
+            scores = scores + HAS_TAG_BOOST * self._tag_mask(tag)[entries]
+        for tag in filter_by_not_tag or []:
+            scores = np.where(self._tag_mask(tag)[entries], scores * NOT_TAG_FACTOR, scores)
+        if limit and len(entries) > limit:
+            keep = np.argpartition(-scores, limit - 1)[:limit]
+            entries, scores = entries[keep], scores[keep]
+        ranked = entries[np.lexsort((self._label_length[entries], -scores))]
+        fields = fl.split(',') if isinstance(fl, str) else (fl if fl else SEARCH_FIELDS)
+        return [self._doc(i, fields) for i in ranked]
+
+    def _doc(self, i, fields):
+        """Result dict in the same form as a SOLR result document (empty lists are omitted, as in SOLR)."""
+        values = {'short_form': self.short_forms[i], 'id': self.short_forms[i], 'label': self.labels[i],
+                  'synonym': self.synonyms[i], 'facets_annotation': self.facets[i], 'unique_facets': self.unique_facets[i]}
+        return {f: values[f] for f in fields if f in values and values[f] != []}
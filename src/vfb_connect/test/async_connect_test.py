@@ -0,0 +1,49 @@
+import asyncio
+import unittest
+from ..cross_server_tools import VfbConnect
+
+
+class AsyncVfbConnectTest(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Set up the VFB connection once for all tests"""
+        try:
+            import aiohttp
+        except ImportError:
+            raise unittest.SkipTest("aiohttp not installed")
+        cls.vc = VfbConnect()
+
+    async def asyncSetUp(self):
+        from ..async_connect import AsyncVfbConnect
+        self.avc = AsyncVfbConnect(vc=self.__class__.vc)
+
+    async def asyncTearDown(self):
+        await self.avc.close()
+
+    async def test_get_TermInfo(self):
+        terms = ['medulla', 'fan-shaped body', 'FBbt_00003678']
+        results = await asyncio.gather(*[self.avc.get_TermInfo(t, summary=False) for t in terms])
+        self.assertEqual([r[0]['term']['core']['short_form'] for r in results],
+                         ['FBbt_00003748', 'FBbt_00003679', 'FBbt_00003678'])
+        summary = await self.avc.get_TermInfo(terms, return_dataframe=True)
+        self.assertEqual(len(summary), 3)
+
+    async def test_cypher_query_and_search(self):
+        r = await self.avc.cypher_query("MATCH (n:Class {short_form:'FBbt_00003748'}) RETURN n.label AS label",
+                                        return_dataframe=False)
+        self.assertEqual(r, [{'label': 'medulla'}])
+        results = await self.avc.search('medulla', return_dataframe=False)
+        self.assertTrue('FBbt_00003748' in [d['short_form'] for d in results])
+
+    async def test_owl_queries(self):
+        subclasses, instances = await asyncio.gather(
+            self.avc.owl_subclasses('fan-shaped body layer', return_id_only=True),
+            self.avc.owl_instances('fan-shaped body', return_id_only=True))
+        self.assertTrue(len(subclasses) > 7)
+        self.assertTrue(len(instances) > 0)
+        self.assertEqual(await self.avc.lookup_id('medulla'), 'FBbt_00003748')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,7 @@ import unittest
 from ..cross_server_tools import VfbConnect
 import os
 import shutil
+import tempfile
 from ..schema.vfb_term import VFBTerm, VFBTerms
 
 class VfbConnectTest(unittest.TestCase):
@@ -70,6 +71,40 @@ class VfbConnectTest(unittest.TestCase):
         print(fu)
         self.assertTrue(len(fu) > 0)
 
+    def test_get_downstream_neurons_many(self):
+        neurons = ['D_adPN_R (FlyEM-HB:5813055184)', 'LPC1 (FlyEM-HB:1808965929)']
+        fu = self.vc.get_neurons_downstream_of_many(neurons, weight=20, verbose=True)
+        self.assertEqual(set(fu['query_neuron_id']), {'VFB_jrchk00a', self.vc.lookup_id(neurons[0])})
+        single = self.vc.get_neurons_downstream_of(neurons[1], weight=20)
+        self.assertEqual(set(fu[fu['query_neuron_id'] == 'VFB_jrchk00a']['partner_neuron_id']),
+                         set(single['target_neuron_id']))
+        bar = self.vc.get_neurons_upstream_of_many(neurons, weight=20, classification="'Kenyon cell'")
+        self.assertTrue(len(bar) < len(self.vc.get_neurons_upstream_of_many(neurons, weight=20)))
+
+    def test_get_similar_neurons_many(self):
+        neurons = ['VGlut-F-000118', 'LPC1 (FlyEM-HB:1838269993)']
+        fu = self.vc.get_similar_neurons_many(neurons, top_k=5, verbose=True)
+        self.assertTrue(fu.groupby('query_neuron_id').size().max() <= 5)
+        single = self.vc.get_similar_neurons(self.vc.lookup_id(neurons[0]))
+        self.assertEqual(list(fu['score'][:5]), list(single['score'][:5]))
+        bar = self.vc.get_potential_drivers_many(neurons, similarity_score='neuronbridge_score', min_score=0.5)
+        self.assertTrue((bar['score'] >= 0.5).all())
+
+    def test_similarity_matrix(self):
+        neuron = self.vc.lookup_id('VGlut-F-000118')
+        sm = self.vc.similarity_matrix([neuron], query_by_label=False)
+        local = sm.nearest(neuron, top_k=5)
+        single = self.vc.get_similar_neurons(neuron)
+        self.assertEqual(list(local['score']), list(single['score'][:5]))
+
+    def test_connectivity_matrix(self):
+        neurons = ['VFB_jrchk00a', 'VFB_jrchk3bp']
+        partners = self.vc.get_neurons_downstream_of_many(neurons, weight=20, query_by_label=False)
+        cm = self.vc.connectivity_matrix(list(partners['partner_neuron_id']) + neurons, weight=20, query_by_label=False)
+        local = cm.downstream(neurons)
+        self.assertEqual(set(zip(local['query_neuron_id'], local['partner_neuron_id'])),
+                         set(zip(partners['query_neuron_id'], partners['partner_neuron_id'])))
+
     def test_get_connected_neurons_by_type(self):
         print()
         fu = self.vc.get_connected_neurons_by_type(upstream_type='Kenyon cell', downstream_type='mushroom body output neuron', weight=20)
@@ -80,6 +115,35 @@ class VfbConnectTest(unittest.TestCase):
         self.assertTrue(len(fu) > 0)
 
 
+    def test_get_connectivity_by_type(self):
+        fu = self.vc.get_connectivity_by_type(upstream_type='Kenyon cell', downstream_type='mushroom body output neuron', weight=20)
+        self.assertTrue(len(fu) > 0)
+        neurons = self.vc.get_connected_neurons_by_type(upstream_type='Kenyon cell', downstream_type='mushroom body output neuron', weight=20)
+        self.assertLessEqual(fu['upstream_neurons'].max(), neurons['upstream_neuron_id'].nunique())
+        matrix = self.vc.get_connectivity_by_type(upstream_type='Kenyon cell', downstream_type='mushroom body output neuron',
+                                                  edges=neurons, value='weight')
+        self.assertEqual(matrix.values.sum(), fu['weight'].sum())
+
+    def test_get_paths(self):
+        partners = self.vc.get_neurons_downstream_of_many(['VFB_jrchk00a'], weight=20, query_by_label=False)
+        second = self.vc.get_neurons_downstream_of_many(partners['partner_neuron_id'][:1], weight=20, query_by_label=False)
+        target = [n for n in second['partner_neuron_id'] if n not in set(partners['partner_neuron_id'])][0]
+        paths = self.vc.get_paths(['VFB_jrchk00a'], [target], max_hops=2, weight=20, query_by_label=False)
+        self.assertEqual(paths['hops'][0], 2)
+        reachable = self.vc.get_reachable_neurons(['VFB_jrchk00a'], max_hops=2, weight=20, query_by_label=False)
+        self.assertEqual(reachable[reachable['neuron_id'] == target]['hop'].iloc[0], 2)
+
+    def test_get_reachable_neurons_with_neuron_matrix(self):
+        # A matrix of the connections between a set of neurons must not cut a walk short
+        partners = self.vc.get_neurons_downstream_of_many(['VFB_jrchk00a'], weight=20, query_by_label=False)
+        self.vc.connectivity_matrix(['VFB_jrchk00a'] + list(partners['partner_neuron_id']), weight=20,
+                                    query_by_label=False)
+        reachable = self.vc.get_reachable_neurons(['VFB_jrchk00a'], max_hops=2, weight=20, query_by_label=False)
+        walked = self.vc.get_reachable_neurons(['VFB_jrchk00a'], max_hops=2, weight=20, query_by_label=False,
+                                               use_local=False)
+        self.assertEqual(set(reachable['neuron_id']), set(walked['neuron_id']))
+        self.assertTrue((reachable['hop'] == 2).any())
+
     def test_get_vfb_link(self):
         fu = self.vc.get_vfb_link(['VFB_jrchjz1e', 'VFB_jrchjtdn', 'VFB_jrchk8bo', 'VFB_jrchjz73',
                                    'VFB_jrchjvog',
@@ -129,6 +193,29 @@ class VfbConnectTest(unittest.TestCase):
         self.assertTrue(isinstance(fu[0], dict))
         self.assertEqual(fu[0]['n']['label'], 'fan-shaped body')
 
+    def test_get_transcriptomic_profiles(self):
+        fu = self.vc.get_transcriptomic_profiles(['Dm9', 'Dm8'], gene_types=['GABA_receptor', 'Glutamate_receptor'],
+                                                 no_subtypes=True)
+        self.assertTrue(set(fu['gene_type']) <= {'GABA_receptor', 'Glutamate_receptor'})
+        single = self.vc.get_transcriptomic_profile('Dm9', gene_type='GABA_receptor', no_subtypes=True)
+        dm9 = fu[(fu['cell_type_id'] == self.vc.lookup_id('Dm9')) & (fu['gene_type'] == 'GABA_receptor')]
+        self.assertEqual(len(dm9), len(single))
+
+    def test_expression_matrix(self):
+        em = self.vc.expression_matrix(['Dm9', 'Dm8'], no_subtypes=True, cache=False, return_dataframe=False)
+        self.assertTrue(em.nnz > 0)
+        profile = self.vc.get_transcriptomic_profile('Dm9', no_subtypes=True)
+        self.assertTrue(set(profile['gene_id']) <= set(em.gene_ids))
+        df = self.vc.expression_matrix(['Dm9', 'Dm8'], no_subtypes=True, value='extent', by='cell_type')
+        self.assertEqual(set(df.index), {self.vc.lookup_id('Dm9'), self.vc.lookup_id('Dm8')})
+
+    def test_get_nt_predictions_bulk(self):
+        fu = self.vc.get_nt_predictions_bulk(['Dm8', 'Dm9', 'VFB_jrchk00a'], verbose=True)
+        self.assertTrue(len(fu) > 0)
+        single = self.vc.get_nt_predictions('Dm8')
+        dm8 = fu[fu['term_id'] == self.vc.lookup_id('Dm8')]
+        self.assertEqual(set(dm8['individual_id']), set(single['individual_id']))
+
     def test_nt_receptors_in_downstream_neurons(self):
         fu = self.vc.get_nt_receptors_in_downstream_neurons(upstream_type='Dm8', downstream_type='Dm9', weight=10)
         print(fu)
@@ -143,6 +230,21 @@ class VfbConnectTest(unittest.TestCase):
         print(fu)
         self.assertTrue(fu == ['VFB_jrchk3bp'])
 
+    def test_xref_index(self):
+        index = self.vc.xref_index('FlyEM-HB')
+        self.assertTrue(len(index) > 1000)
+        self.assertEqual(list(index.to_vfb_ids(['1353544607'])), ['VFB_jrchk3bp'])
+        self.assertEqual(self.vc.xref_2_vfb_id(['1353544607'], db='FlyEM-HB'), ['VFB_jrchk3bp'])
+        self.assertEqual(self.vc.lookup_id('FlyEM-HB:1353544607'), 'VFB_jrchk3bp')
+        self.assertIn('neuprint_JRC_Hemibrain_1point2point1:1353544607', self.vc.vfb_id_2_xrefs('VFB_jrchk3bp', db='FlyEM-HB')['VFB_jrchk3bp'])
+        accs = ['1353544607', '5813105722']
+        local = [self.vc.xref_2_vfb_id(accs, db='FlyEM-HB', return_just_ids=False, reverse_return=r) for r in (False, True)]
+        local.append(self.vc.vfb_id_2_xrefs('VFB_jrchk3bp', db='FlyEM-HB'))
+        self.vc._xref_indexes = {}
+        server = [self.vc.xref_2_vfb_id(accs, db='FlyEM-HB', return_just_ids=False, reverse_return=r) for r in (False, True)]
+        server.append(self.vc.vfb_id_2_xrefs('VFB_jrchk3bp', db='FlyEM-HB'))
+        self.assertEqual(local, server)
+
     def test_id_to_xref(self):
         fu = self.vc.vfb_id_2_xrefs('VFB_jrchk3bp', verbose=True)
         self.assertTrue(fu)
@@ -153,6 +255,110 @@ class VfbConnectTest(unittest.TestCase):
         fu = self.vc.get_neuron_pubs('Kenyon cell')
         self.assertTrue(len(fu)> 9)
 
+class FakeConnectivityNeo:
+    """Answers export_connectivity's paged query from a fixed edge list."""
+
+    edges = {'VFB_a': [('VFB_b', 10), ('VFB_c', 3)], 'VFB_b': [('VFB_c', 7)], 'VFB_c': [], 'VFB_d': [('VFB_a', 1)]}
+
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+        self.calls = 0
+
+    def commit_list(self, statements):
+        self.calls += 1
+        if self.fail_after is not None and self.calls > self.fail_after:
+            return False
+        p = statements[0]['parameters']
+        neurons = sorted(n for n in self.edges if n > p['last_neuron'])[:p['page_size']]
+        rows = []
+        for n in neurons:
+            partners = [(d, w) for d, w in self.edges[n] if w >= p['weight']]
+            if partners:
+                rows.extend([n, d, w] for d, w in partners)
+            else:
+                rows.append([n, None, None])
+        return [{'columns': ['upstream_neuron_id', 'downstream_neuron_id', 'weight'],
+                 'data': [{'row': row} for row in rows]}]
+
+
+class ExportConnectivityTest(unittest.TestCase):
+
+    def setUp(self):
+        self.vc = VfbConnect.__new__(VfbConnect)
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def export(self, **kwargs):
+        return self.vc.export_connectivity(self.path, dataset='ds', page_size=2, query_by_label=False, **kwargs)
+
+    def read(self):
+        import pandas as pd
+        df = pd.read_parquet(os.path.join(self.path, 'dataset=ds'))
+        return sorted(zip(df['upstream_neuron_id'].astype(str), df['downstream_neuron_id'].astype(str), df['weight']))
+
+    def test_export_and_resume(self):
+        # The second page fails, then the export is resumed
+        self.vc.nc = FakeConnectivityNeo(fail_after=1)
+        progress = self.export()
+        self.assertFalse(progress['complete'])
+        self.assertEqual((progress['pages'], progress['last_neuron']), (1, 'VFB_b'))
+        self.vc.nc = FakeConnectivityNeo()
+        progress = self.export()
+        self.assertTrue(progress['complete'])
+        self.assertEqual(progress['edges'], 4)
+        self.assertEqual(self.read(), [('VFB_a', 'VFB_b', 10), ('VFB_a', 'VFB_c', 3), ('VFB_b', 'VFB_c', 7),
+                                       ('VFB_d', 'VFB_a', 1)])
+        self.assertEqual(self.export(), progress)
+        with self.assertRaises(ValueError):
+            self.export(weight=5)
+
+    def test_restart(self):
+        self.vc.nc = FakeConnectivityNeo()
+        self.export()
+        progress = self.export(weight=5, resume=False)
+        self.assertEqual(progress['edges'], 2)
+        self.assertEqual(self.read(), [('VFB_a', 'VFB_b', 10), ('VFB_b', 'VFB_c', 7)])
+
+
+class FakeExpressionNeo:
+    """Answers the neurotransmitter label and batched transcriptomic profile queries."""
+
+    def __init__(self):
+        self.cell_types = []
+
+    def commit_list(self, statements):
+        s = statements[0]
+        if 'labels(n) AS labels' in s['statement']:
+            return [{'columns': ['labels'], 'data': [{'row': [['Class', 'Neuron', 'GABAergic']]}]}]
+        self.cell_types.extend(s['parameters']['cell_types'])
+        columns = ['query_cell_type_id', 'cell_type_id', 'gene', 'gene_type']
+        return [{'columns': columns, 'data': [{'row': [c, c, 'Rdl', t]} for c in s['parameters']['cell_types']
+                                              for t in s['parameters']['gene_types']]}]
+
+
+class NtReceptorsTest(unittest.TestCase):
+
+    def setUp(self):
+        import pandas as pd
+        self.vc = VfbConnect.__new__(VfbConnect)
+        self.vc.nc = FakeExpressionNeo()
+        self.vc.lookup_id = lambda key, **kwargs: key
+        self.vc.get_gene_function_filters = lambda: ['GABA_receptor', 'Glutamate_receptor']
+        self.vc.get_nt_predictions = lambda term, verbose=False: pd.DataFrame()
+        self.vc.get_connectivity_by_type = lambda **kwargs: pd.DataFrame(
+            {'downstream_class': ['neuron one', 'neuron two', 'neuron one'],
+             'downstream_class_id': ['FBbt_1', 'FBbt_2', 'FBbt_1']})
+
+    def test_batched_receptors(self):
+        # Downstream classes are queried together by ID, not by label
+        df = self.vc.get_nt_receptors_in_downstream_neurons('FBbt_0', use_predictions=False)
+        self.assertEqual(self.vc.nc.cell_types, ['FBbt_1', 'FBbt_2'])
+        self.assertEqual(list(df['cell_type_id']), ['FBbt_1', 'FBbt_2'])
+        self.assertEqual(set(df['gene_type']), {'GABA_receptor'})
+
+
 class VfbTermTests(unittest.TestCase):
 
     @classmethod
@@ -192,5 +398,27 @@ class VfbTermTests(unittest.TestCase):
         print(fu)
         self.assertTrue(len(fu) > 0)
 
+    def test_solr_search_paging(self):
+        fu = self.vc.search('neuron', return_dataframe=False, fl=['short_form', 'label'], limit=400, page_size=100)
+        self.assertEqual(len(fu), 400)
+        self.assertEqual(len(set(d['short_form'] for d in fu)), 400)
+        self.assertEqual(set(fu[0].keys()), {'short_form', 'label'})
+        self.assertEqual(self.vc.search('neuron', return_dataframe=False, fl=['short_form', 'label'], limit=400, page_size=100), fu)
+
+    def test_local_search(self):
+        fu = self.vc.search('fan-shaped body', return_dataframe=False, backend='local')
+        print(fu[:5])
+        self.assertEqual(fu[0]['short_form'], 'FBbt_00003679')
+        self.assertTrue(set(fu[0].keys()) <= {'short_form', 'label', 'synonym', 'id', 'facets_annotation', 'unique_facets'})
+
+    def test_generate_lab_colors(self):
+        colours = self.vc.generate_lab_colors(200)
+        print(colours[:10])
+        self.assertEqual(len(colours), 200)
+        self.assertEqual(len(set(colours)), 200)
+        self.assertEqual(len(set(self.vc.generate_lab_colors(10))), 10)
+        self.assertTrue(all(0 <= c <= 255 for colour in colours for c in colour))
+        self.assertEqual(self.vc.generate_lab_colors(200), colours)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
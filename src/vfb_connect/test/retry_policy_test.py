@@ -0,0 +1,105 @@
+import threading
+import unittest
+import requests
+from ..retry_policy import RetryPolicy, CircuitOpenError
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = 0
+
+    def flaky(self, responses):
+        def f():
+            r = responses[min(self.calls, len(responses) - 1)]
+            self.calls += 1
+            if isinstance(r, Exception):
+                raise r
+            return FakeResponse(r)
+        return f
+
+    def test_backoff(self):
+        rp = RetryPolicy(base_delay=1, max_delay=3)
+        for attempt in range(1, 6):
+            self.assertTrue(0 <= rp.backoff(attempt) <= min(3, 2 ** (attempt - 1)))
+
+    def test_retry_then_success(self):
+        rp = RetryPolicy(base_delay=0, max_attempts=4)
+        r = rp.call(self.flaky([503, requests.exceptions.ConnectionError('down'), 200]))
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(rp.metrics['retries'], 2)
+        self.assertEqual(rp.metrics['failures'], 0)
+
+    def test_no_retry_on_client_error(self):
+        rp = RetryPolicy(base_delay=0)
+        r = rp.call(self.flaky([400]))
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(self.calls, 1)
+        with self.assertRaises(ValueError):
+            rp.call(self.flaky([ValueError('bad')]))
+        self.assertEqual(self.calls, 2)
+
+    def test_gives_up(self):
+        rp = RetryPolicy(base_delay=0, max_attempts=3, failure_threshold=0)
+        self.assertEqual(rp.call(self.flaky([502])).status_code, 502)
+        self.assertEqual(self.calls, 3)
+        with self.assertRaises(requests.exceptions.Timeout):
+            rp.call(self.flaky([requests.exceptions.Timeout('slow')]))
+        self.assertEqual(rp.metrics['failures'], 2)
+
+    def test_circuit_breaker(self):
+        rp = RetryPolicy(base_delay=0, max_attempts=1, failure_threshold=2, reset_timeout=60)
+        for i in range(2):
+            rp.call(self.flaky([503]))
+        self.assertTrue(rp.circuit_open)
+        with self.assertRaises(CircuitOpenError):
+            rp.call(self.flaky([200]))
+        self.assertEqual(self.calls, 2)
+        rp.reset_timeout = 0
+        self.assertEqual(rp.call(self.flaky([200])).status_code, 200)
+        self.assertFalse(rp.circuit_open)
+        self.assertEqual(rp.metrics['circuit_opened'], 1)
+        self.assertEqual(rp.metrics['circuit_rejected'], 1)
+
+    def test_half_open(self):
+        rp = RetryPolicy(base_delay=0, max_attempts=1, failure_threshold=1, reset_timeout=60)
+        rp.call(self.flaky([503]))
+        rp.reset_timeout = 0
+        started, release = threading.Event(), threading.Event()
+
+        def trial():
+            started.set()
+            release.wait(5)
+            return FakeResponse(200)
+
+        t = threading.Thread(target=rp.call, args=(trial,))
+        t.start()
+        started.wait(5)
+        # Only the trial call is let through while the breaker is half-open
+        self.assertTrue(rp.circuit_open)
+        with self.assertRaises(CircuitOpenError):
+            rp.call(self.flaky([200]))
+        release.set()
+        t.join()
+        self.assertFalse(rp.circuit_open)
+        self.assertEqual(rp.call(self.flaky([200])).status_code, 200)
+        # A failed trial opens the breaker again
+        rp.call(self.flaky([503]))
+        rp.reset_timeout = 60
+        with self.assertRaises(CircuitOpenError):
+            rp.call(self.flaky([200]))
+        rp.reset_timeout = 0
+        rp.call(self.flaky([503]))
+        rp.reset_timeout = 60
+        self.assertTrue(rp.circuit_open)
+        self.assertEqual(self.calls, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
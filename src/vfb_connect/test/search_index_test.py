@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+from ..search_index import SearchIndex
+
+
+class FakeSearchNeo:
+    """Answers the paged search index queries from in-memory nodes."""
+
+    base_uri = 'fake'
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.statements = []
+
+    def commit_list(self, statements):
+        self.statements.extend(statements)
+        s = statements[0]
+        label = s['statement'].split('(n:')[1].split(')')[0]
+        rows = sorted([sf, sf.lower(), [], labels, []] for sf, labels in self.nodes.items()
+                      if label in labels and sf > s['parameters']['last'] and not sf.startswith('VFBc_')
+                      and (label != 'Entity' or sf.startswith(('VFB', 'FB'))))
+        return [{'data': [{'row': row} for row in rows[:s['parameters']['page_size']]]}]
+
+
+class SearchIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.si = SearchIndex(['FBbt_00003748', 'FBbt_00003679', 'VFB_00101567', 'GO_0007608', 'FBbt_00047095'],
+                              ['medulla', 'fan-shaped body', 'JRC2018Unisex', 'sensory perception of smell', 'old medulla'],
+                              synonyms=[['ME'], ['FB', 'central body upper part'], [], [], []],
+                              facets=[['Entity', 'Class', 'Anatomy'], ['Entity', 'Class', 'Anatomy'],
+                                      ['Entity', 'Individual', 'Template'], ['Entity', 'Class'],
+                                      ['Entity', 'Class', 'Deprecated']],
+                              unique_facets=[['Anatomy'], ['Anatomy'], ['Template'], [], []])
+
+    def ids(self, query, **kwargs):
+        return [d['short_form'] for d in self.si.search(query, **kwargs)]
+
+    def test_prefix_and_exact(self):
+        self.assertEqual(self.ids('medulla'), ['FBbt_00003748', 'FBbt_00047095'])
+        self.assertEqual(self.ids('Fan-sha')[0], 'FBbt_00003679')
+        self.assertEqual(self.ids('jrc2018'), ['VFB_00101567'])
+
+    def test_tokens_and_infix(self):
+        self.assertEqual(self.ids('body'), ['FBbt_00003679'])
+        self.assertEqual(self.ids('upper central'), ['FBbt_00003679'])
+        self.assertEqual(self.ids('erception'), ['GO_0007608'])
+        self.assertEqual(self.ids('nothing like this'), [])
+
+    def test_boosts(self):
+        # Deprecated terms are downvoted unless filter_by_not_tag is cleared
+        self.assertEqual(self.ids('medulla', filter_by_not_tag=[])[0], 'FBbt_00003748')
+        self.assertEqual(self.ids('old medulla')[0], 'FBbt_00047095')
+
+    def test_result_fields(self):
+        doc = self.si.search('fan-shaped body', limit=1)[0]
+        self.assertEqual(doc, {'short_form': 'FBbt_00003679', 'label': 'fan-shaped body',
+                               'synonym': ['FB', 'central body upper part'], 'id': 'FBbt_00003679',
+                               'facets_annotation': ['Entity', 'Class', 'Anatomy'], 'unique_facets': ['Anatomy']})
+        self.assertEqual(self.si.search('medulla', fl=['short_form', 'label'], limit=1),
+                         [{'short_form': 'FBbt_00003748', 'label': 'medulla'}])
+
+    def test_save_load_and_lookup(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'search_index.pkl')
+            self.si.save(path)
+            loaded = SearchIndex.load(path)
+            self.assertEqual(loaded.search('medulla'), self.si.search('medulla'))
+            self.assertIsNone(SearchIndex.load(path, max_age=1e-9))
+        si = SearchIndex.from_lookup({'medulla': 'FBbt_00003748', 'ME': 'FBbt_00003748'})
+        self.assertEqual(si.search('me'), [{'short_form': 'FBbt_00003748', 'label': 'medulla', 'synonym': ['ME'],
+                                            'id': 'FBbt_00003748'}])
+
+    def test_from_neo(self):
+        nc = FakeSearchNeo({'FBbt_1': ['Entity', 'Class'], 'VFB_1': ['Entity', 'Individual'],
+                            'VFB_2': ['Entity', 'Individual', 'DataSet'], 'Xu2020': ['Entity', 'Individual', 'DataSet'],
+                            'FBrf_1': ['Entity', 'pub'], 'GO_1': ['Entity', 'Class'], 'VFBc_1': ['Entity', 'Individual']})
+        si = SearchIndex.from_neo(nc, page_size=2)
+        self.assertEqual(si.short_forms, ['FBbt_1', 'FBrf_1', 'VFB_1', 'VFB_2', 'Xu2020'])
+        self.assertTrue(all('$last' in s['statement'] and s['parameters']['page_size'] == 2 for s in nc.statements))
+
+
+if __name__ == '__main__':
+    unittest.main()